@@ -0,0 +1,255 @@
+"""
+Swaplink benchmarks: select() latency and throughput, messages per select,
+join time and degree convergence after mass churn.
+
+    python -m benchmarks.run --transport sim --sizes 100 1000 --loads uniform:2-20
+    python -m benchmarks.run --transport udp --sizes 20 --output udp.json
+
+Results are printed (or written to --output) as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from asyncio import DatagramProtocol, DatagramTransport
+from typing import List, Dict, Any, Callable, Tuple
+
+from swaplink import defaults, Swaplink
+from swaplink.abc import ITransportFactory, NodeAddr
+from swaplink.errors import SelectError
+from swaplink.simulation import SimulatedNetwork, run_simulation, simulated_node
+from swaplink.transport import UDPTransportFactory
+
+LOCALHOST = "127.0.0.1"
+FIRST_PORT = 20000
+
+
+class CountingTransportFactory(ITransportFactory):
+    """
+    Wraps a transport factory to count the datagrams (and bytes) sent by its
+    endpoints.
+    """
+
+    def __init__(self, transport_factory: ITransportFactory):
+        self._transport_factory = transport_factory
+        self.sent = 0
+        self.sent_bytes = 0
+
+    async def create_endpoint(
+        self, protocol_factory: Callable[[], DatagramProtocol], local_addr: NodeAddr
+    ) -> Tuple[DatagramTransport, DatagramProtocol]:
+        transport, protocol = await self._transport_factory.create_endpoint(
+            protocol_factory, local_addr
+        )
+        sendto = transport.sendto
+
+        def counting_sendto(data: bytes, addr: NodeAddr = None) -> None:
+            self.sent += 1
+            self.sent_bytes += len(data)
+            sendto(data, addr)
+
+        transport.sendto = counting_sendto  # type: ignore
+        return transport, protocol
+
+
+def parse_loads(spec: str, size: int, rng: random.Random) -> List[int]:
+    """
+    constant:N | uniform:MIN-MAX | powerlaw:ALPHA:MIN-MAX
+    """
+    kind, _, args = spec.partition(":")
+    if kind == "constant":
+        return [int(args)] * size
+    if kind == "uniform":
+        low, high = map(int, args.split("-"))
+        return [rng.randint(low, high) for _ in range(size)]
+    if kind == "powerlaw":
+        alpha, bounds = args.split(":")
+        low, high = map(int, bounds.split("-"))
+        return [
+            min(high, int(low * rng.paretovariate(float(alpha)))) for _ in range(size)
+        ]
+    raise ValueError(f"unknown load distribution: {spec}")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": percentile(values, 0.5),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+        "count": len(values),
+    }
+
+
+async def run_benchmark(
+    transport: str, size: int, loads: List[int], args: argparse.Namespace
+) -> Dict[str, Any]:
+    loop = asyncio.get_event_loop()
+    if transport == "sim":
+        factory = CountingTransportFactory(
+            SimulatedNetwork(latency=args.latency, jitter=args.latency / 2)
+        )
+        nodes = [simulated_node(i) for i in range(size)]
+    else:
+        factory = CountingTransportFactory(UDPTransportFactory())
+        nodes = [(LOCALHOST, FIRST_PORT + i) for i in range(size)]
+
+    swaplinks: List[Swaplink] = []
+    bootstrap_start = loop.time()
+    for node, load in zip(nodes, loads):
+        swaplink = Swaplink(
+            *node,
+            transport_factory=factory,
+            binary_wire=not args.legacy_wire,
+            one_way_hbeats=args.one_way_hbeats,
+        )
+        await swaplink.join(load, [swaplinks[0]._node] if swaplinks else None)
+        swaplinks.append(swaplink)
+    bootstrap_duration = loop.time() - bootstrap_start
+    join_durations = [swaplink.stats.join_duration for swaplink in swaplinks[1:]]
+    await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 1.5)
+
+    # background traffic (heartbeats, repairs), subtracted from select traffic
+    idle_start, idle_sent = loop.time(), factory.sent
+    idle_sent_bytes = factory.sent_bytes
+    await asyncio.sleep(defaults.HBEAT_SEND_FREQUENCY * 2)
+    background_rate = (factory.sent - idle_sent) / (loop.time() - idle_start)
+    background_bytes = factory.sent_bytes - idle_sent_bytes
+    background_byte_rate = background_bytes / (loop.time() - idle_start)
+
+    latencies, failures = [], 0
+    selects_start, selects_sent = loop.time(), factory.sent
+    for _ in range(args.selects):
+        swaplink = random.choice(swaplinks)
+        select_start = loop.time()
+        try:
+            await swaplink.select()
+        except SelectError:
+            failures += 1
+        else:
+            latencies.append(loop.time() - select_start)
+    selects_duration = loop.time() - selects_start
+    select_messages = factory.sent - selects_sent - background_rate * selects_duration
+
+    throughput_start = loop.time()
+    selected = await swaplinks[-1].select_many(args.selects)
+    throughput = len(selected) / (loop.time() - throughput_start)
+
+    convergence = await measure_churn_convergence(swaplinks, factory, args)
+
+    for swaplink in swaplinks:
+        await swaplink.leave()
+    return {
+        "transport": transport,
+        "size": size,
+        "loads": args.loads_spec,
+        "bootstrap_duration": bootstrap_duration,
+        "join_duration": summary(join_durations),
+        "select_latency": summary(latencies),
+        "select_failures": failures,
+        "messages_per_select": max(select_messages, 0) / max(args.selects, 1),
+        "background_messages_per_second": background_rate,
+        "background_bytes_per_second": background_byte_rate,
+        "selects_per_second_per_node": throughput,
+        "churn_convergence": convergence,
+    }
+
+
+async def measure_churn_convergence(
+    swaplinks: List[Swaplink],
+    factory: CountingTransportFactory,
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    """
+    Crash a fraction of the nodes at once and time how long the survivors
+    take to get rid of them and get back to num_links out-links.
+    """
+    loop = asyncio.get_event_loop()
+    num_dead = int(len(swaplinks) * args.churn)
+    dead = swaplinks[1:][:num_dead]
+    dead_nodes = {swaplink._node for swaplink in dead}
+    survivors = [swaplink for swaplink in swaplinks if swaplink not in dead]
+    network = factory._transport_factory
+    for swaplink in dead:
+        if isinstance(network, SimulatedNetwork):
+            network.kill(swaplink._node)
+        else:
+            await swaplink.leave()
+
+    def converged() -> bool:
+        for swaplink in survivors:
+            neighbours = set(swaplink.list_neighbours())
+            degree = min(swaplink._num_links, len(survivors) - 1)
+            if neighbours & dead_nodes or len(neighbours) < degree:
+                return False
+        return True
+
+    churn_start = loop.time()
+    while not converged():
+        if loop.time() - churn_start > args.convergence_timeout:
+            return {"crashed": len(dead), "duration": None}
+        await asyncio.sleep(defaults.HBEAT_SEND_FREQUENCY / 4)
+    return {"crashed": len(dead), "duration": loop.time() - churn_start}
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--transport", choices=["sim", "udp"], default="sim")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50])
+    parser.add_argument("--loads", nargs="+", default=["uniform:2-20"])
+    parser.add_argument("--selects", type=int, default=200)
+    parser.add_argument("--churn", type=float, default=0.2)
+    parser.add_argument("--convergence-timeout", type=float, default=120)
+    parser.add_argument("--latency", type=float, default=0.01, help="sim only")
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--legacy-wire", action="store_true", help="msgpack only")
+    parser.add_argument("--one-way-hbeats", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+
+    for name in [
+        "HBEAT_SEND_FREQUENCY",
+        "HBEAT_CHECK_FREQUENCY",
+        "HBEAT_ROUND_DEADLINE",
+        "RPC_TIMEOUT",
+        "WALK_TIMEOUT",
+    ]:
+        setattr(defaults, name, getattr(defaults, name) * args.time_scale)
+
+    results = []
+    for size in args.sizes:
+        for loads_spec in args.loads:
+            rng = random.Random(args.seed)
+            random.seed(args.seed)
+            loads = parse_loads(loads_spec, size, rng)
+            args.loads_spec = loads_spec
+            benchmark = run_benchmark(args.transport, size, loads, args)
+            wall_start = time.monotonic()
+            if args.transport == "sim":
+                result = run_simulation(benchmark)
+            else:
+                result = asyncio.run(benchmark)
+            result["wall_duration"] = time.monotonic() - wall_start
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    report = json.dumps({"benchmarks": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
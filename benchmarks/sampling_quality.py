@@ -0,0 +1,66 @@
+"""
+Sampling quality of a simulated Swaplink network: how well select() follows
+the num_links-proportional distribution, and the overlay's degrees and mixing.
+
+    python -m benchmarks.sampling_quality --size 200 --samples 20000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from typing import List
+
+from swaplink import defaults
+from swaplink.analysis import analyze, collect_samples
+from swaplink.simulation import SimulatedNetwork, run_simulation, create_swaplinks
+from benchmarks.run import parse_loads
+
+
+async def sampling_quality(args: argparse.Namespace) -> dict:
+    loads = parse_loads(args.loads, args.size, random.Random(args.seed))
+    network = SimulatedNetwork(latency=0.01, jitter=0.005, seed=args.seed)
+    swaplinks = await create_swaplinks(
+        network, loads, adaptive_walk_length=args.adaptive_walk_length
+    )
+    await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 2)
+
+    samples = await collect_samples(swaplinks, args.samples)
+    report = analyze(swaplinks, samples, args.max_walk_length, args.tolerance)
+    walk_lengths = [swaplink._walk_length() for swaplink in swaplinks]
+    report.update(
+        size=args.size,
+        loads=args.loads,
+        walk_length=sum(walk_lengths) / len(walk_lengths),
+    )
+    for swaplink in swaplinks:
+        await swaplink.leave()
+    return report
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--loads", default="uniform:2-20")
+    parser.add_argument("--samples", type=int, default=10000)
+    parser.add_argument("--walk-length", type=int, default=None)
+    parser.add_argument("--adaptive-walk-length", action="store_true")
+    parser.add_argument("--max-walk-length", type=int, default=30)
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+    if args.walk_length is not None:
+        defaults.DEFAULT_WALK_LENGTH = args.walk_length
+
+    report = json.dumps(run_simulation(sampling_quality(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,33 @@
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Callable, Any
+from asyncio import DatagramProtocol, DatagramTransport
+from typing import (
+    List,
+    Tuple,
+    Callable,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Optional,
+    Container,
+    TYPE_CHECKING,
+)
 
-from swaplink.data_objects import Node, LinkType
+from swaplink import defaults
+from swaplink.data_objects import (
+    Node,
+    LinkType,
+    Stats,
+    NeighborsChange,
+    NeighborsWatch,
+    Subscription,
+)
+
+if TYPE_CHECKING:
+    from swaplink.metrics import Metrics
 
 NodeAddr = Tuple[str, int]
 NeighborsCallback = Callable[[List["Node"]], Any]
+NeighborsDiffCallback = Callable[[NeighborsChange], Any]
 
 
 class ISwaplink(ABC):
@@ -17,18 +40,49 @@ class ISwaplink(ABC):
     _node: Node
     _link_store: "ILinkStore"
 
+    @property
+    @abstractmethod
+    def stats(self) -> Stats:
+        pass
+
+    @property
+    @abstractmethod
+    def metrics(self) -> Optional["Metrics"]:
+        """
+        Counters and histograms of the protocol, None if disabled.
+        """
+        pass
+
     @abstractmethod
-    async def join(self, num_links: int, bootstrap: List[NodeAddr] = None) -> None:
+    async def join(
+        self, num_links: int, bootstrap: List[NodeAddr] = None, min_degree: int = None
+    ) -> None:
         """
         Method for joining network
         :param num_links: Node's relative load
-        :param bootstrap: entrypoint node. None --> first node
+        :param bootstrap: entrypoint node. None --> first node, unless
+         there is a snapshot to restore the links from
+        :param min_degree: out-links needed before returning,
+         the rest are linked in the background. None --> num_links
         :return:
         """
         pass
 
     @abstractmethod
-    async def leave(self) -> None:
+    async def leave(self, deadline: float = None) -> None:
+        """
+        Splice the links out of the network: the in-link peers are given
+        our out-link peers, so the neighbors keep their degree.
+        :param deadline: seconds the handoff may take. None --> LEAVE_DEADLINE,
+         0 --> just close
+        """
+        pass
+
+    @abstractmethod
+    def save_snapshot(self) -> None:
+        """
+        Save the links and recent peers for a warm restart, if enabled.
+        """
         pass
 
     @abstractmethod
@@ -43,10 +97,76 @@ class ISwaplink(ABC):
         pass
 
     @abstractmethod
-    async def select(self) -> Node:
+    def watch_neighbours(
+        self, callback: NeighborsDiffCallback = None, debounce: float = 0
+    ) -> NeighborsWatch:
+        """
+        Follow the neighbor set through diffs of added and removed nodes.
+        :param callback: called with every change. None --> changes are queued
+        :param debounce: seconds during which changes are batched into one diff
+        :return: the subscription, and the queue receiving the changes
+         (None if a callback is given)
+        """
+        pass
+
+    @abstractmethod
+    def unwatch_neighbours(self, watch: NeighborsWatch) -> None:
+        """
+        Stop following the neighbor set, no more changes are delivered.
+        """
+        pass
+
+    @abstractmethod
+    async def select(
+        self,
+        walk_length: int = None,
+        link_type: LinkType = LinkType.IN,
+        exclude: Container[Node] = None,
+        precision: float = None,
+    ) -> Node:
         """
         It randomly selects another node from the network.
+        :param walk_length: hops walked. None --> chosen from precision
+        :param link_type: IN selects nodes proportionally to their num_links,
+         OUT to the amount of nodes linking to them
+        :param exclude: nodes not to select, e.g. the ones already sampled
+        :param precision: accepted distance to the stationary distribution,
+         shorter walks for higher values. None --> the node's walk length
         :return: randomly selected node
+        :raise SelectError: no node could be selected
+        """
+        pass
+
+    @abstractmethod
+    def iter_select(
+        self,
+        k: int,
+        max_in_flight: int = defaults.MAX_WALKS_IN_FLIGHT,
+        unique: bool = False,
+        samples_per_walk: int = 1,
+    ) -> AsyncIterator[Node]:
+        """
+        It runs random walks concurrently and yields nodes as walks finish.
+        :param k: amount of nodes to select
+        :param max_in_flight: maximum walks running at the same time
+        :param unique: skip nodes already yielded
+        :param samples_per_walk: nodes collected by every walk after its burn-in
+        :return: randomly selected nodes
+        """
+        pass
+
+    @abstractmethod
+    async def select_many(
+        self,
+        k: int,
+        max_in_flight: int = defaults.MAX_WALKS_IN_FLIGHT,
+        unique: bool = False,
+        samples_per_walk: int = 1,
+    ) -> List[Node]:
+        """
+        Same as iter_select but returns the collected nodes.
+        Failed walks (and repeated nodes if unique) are not included,
+        so the list may be shorter than k.
         """
         pass
 
@@ -60,23 +180,81 @@ class ISwaplinkProtocol(ABC):
         limit: int,
         link_type: LinkType,
         walk_initiator: Node = None,
+        walk_id: int = None,
+        timeout: float = None,
     ):
+        """
+        :param timeout: seconds the walk may take. None --> WALK_TIMEOUT
+        """
         pass
 
     @abstractmethod
-    async def call_give_me_in_node(self, node_to_ask: Node) -> None:
-        pass  # todo
+    async def call_forward_walk(
+        self, node_to_ask: Node, limit: int, link_type: LinkType, timeout: float = None
+    ) -> Node:
+        pass
+
+    @abstractmethod
+    async def call_sample_walk(
+        self,
+        node_to_ask: Node,
+        burn_in: int,
+        thinning: int,
+        num_samples: int,
+        link_type: LinkType,
+        timeout: float = None,
+    ) -> List[Node]:
+        pass
+
+    @abstractmethod
+    async def call_forward_sample_walk(
+        self,
+        node_to_ask: Node,
+        burn_in: int,
+        thinning: int,
+        num_samples: int,
+        link_type: LinkType,
+        timeout: float = None,
+    ) -> List[Node]:
+        pass
+
+    @abstractmethod
+    async def call_give_me_in_node(self, node_to_ask: Node) -> bool:
+        """
+        Answered at once, the in-node calls im_your_in_node later on.
+        :return: False if the node had no in-link to hand off
+        """
+        pass
 
     @abstractmethod
     async def call_change_your_out_node(
         self, node_to_ask: Node, new_in_node: Node
-    ) -> None:
-        pass  # todo
+    ) -> bool:
+        """
+        :return: False if new_in_node is not a new out-link of the node,
+         e.g. it already was one
+        """
+        pass
 
     @abstractmethod
     async def call_im_your_in_node(self, node_to_ask: Node) -> None:
         pass  # todo
 
+    @abstractmethod
+    def notify_im_your_in_node(self, node_to_notify: Node) -> bool:
+        """
+        One-way heartbeat, nothing is answered.
+        :return: False if the node does not understand it (nothing was sent)
+        """
+        pass
+
+    @abstractmethod
+    async def call_goodbye(self, node_to_notify: Node) -> None:
+        """
+        We are leaving: the node drops its links to us at once.
+        """
+        pass
+
 
 class ILinkStore(ABC):
     @abstractmethod
@@ -91,6 +269,14 @@ class ILinkStore(ABC):
     def get_in_links_copy(self) -> List[Any]:
         pass
 
+    @abstractmethod
+    def random_in_link(self, default: Node = None) -> Node:
+        pass
+
+    @abstractmethod
+    def num_in_links(self) -> int:
+        pass
+
     @abstractmethod
     def remove_in_link(self, node: Node) -> None:
         pass
@@ -111,10 +297,59 @@ class ILinkStore(ABC):
     def get_out_links_copy(self) -> List[Any]:
         pass
 
+    @abstractmethod
+    def random_out_link(self, default: Node = None) -> Node:
+        pass
+
+    @abstractmethod
+    def num_out_links(self) -> int:
+        pass
+
     @abstractmethod
     def remove_out_link(self, node: Node) -> None:
         pass
 
+    @abstractmethod
+    def refresh_out_link(self, node: Node) -> None:
+        """
+        Update the out-link's heartbeat, only if it still is an out-link.
+        """
+        pass
+
+    @abstractmethod
+    def announce_out_link(self, node: Node) -> None:
+        """
+        Record that the out-link was just told we are its in-node.
+        """
+        pass
+
+    @abstractmethod
+    def get_out_link_announce(self, node: Node) -> float:
+        """
+        :return: when the out-link was last told we are its in-node, -inf if never
+        """
+        pass
+
+    @abstractmethod
+    def oldest_in_link_hbeat(self) -> Optional[float]:
+        pass
+
+    @abstractmethod
+    def oldest_out_link_hbeat(self) -> Optional[float]:
+        pass
+
+    @abstractmethod
+    def expire_in_links(self, hbeat_limit: float) -> List[Node]:
+        """
+        Remove the in-links whose last heartbeat is not newer than hbeat_limit.
+        :return: removed in-links
+        """
+        pass
+
+    @abstractmethod
+    def expire_out_links(self, hbeat_limit: float) -> List[Node]:
+        pass
+
     @abstractmethod
     def remove_link(self, node: Node) -> None:
         pass
@@ -126,3 +361,69 @@ class ILinkStore(ABC):
     @abstractmethod
     def set_callback(self, callback: NeighborsCallback) -> None:
         pass
+
+    @abstractmethod
+    def subscribe(
+        self, callback: NeighborsDiffCallback, debounce: float = 0
+    ) -> Subscription:
+        pass
+
+    @abstractmethod
+    def unsubscribe(self, subscription: Subscription) -> None:
+        pass
+
+
+class IWalkTracer(ABC):
+    """
+    Follows individual random walks. Every node a walk visits reports its
+    hop, so a walk is reconstructed by joining the events with its walk id.
+    """
+
+    @abstractmethod
+    def on_walk_start(self, walk_id: int, start_node: NodeAddr) -> None:
+        pass
+
+    @abstractmethod
+    def on_walk_hop(
+        self, walk_id: int, node: NodeAddr, index: int, next_hop: NodeAddr
+    ) -> None:
+        """
+        :param node: node the walk is at, after index hops
+        :param next_hop: where it goes, None if it ends here
+        """
+        pass
+
+    @abstractmethod
+    def on_walk_end(
+        self, walk_id: int, samples: Optional[List[Node]], error: Exception = None
+    ) -> None:
+        """
+        Called on the initiator, with the samples or with the error it failed with.
+        """
+        pass
+
+
+class ITransportFactory(ABC):
+    """
+    Creates the datagram endpoints Swaplink protocols run on.
+    """
+
+    @abstractmethod
+    async def create_endpoint(
+        self, protocol_factory: Callable[[], DatagramProtocol], local_addr: NodeAddr
+    ) -> Tuple[DatagramTransport, DatagramProtocol]:
+        pass
+
+
+class IHbeatScheduler(ABC):
+    """
+    Runs the out-links heartbeat rounds of several Swaplink nodes at once.
+    """
+
+    @abstractmethod
+    def add(self, hbeat_round: Callable[[], Awaitable[None]]) -> None:
+        pass
+
+    @abstractmethod
+    def remove(self, hbeat_round: Callable[[], Awaitable[None]]) -> None:
+        pass
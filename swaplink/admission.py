@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from swaplink import defaults
+from swaplink.data_objects import Node
+from swaplink.utils import monotonic
+
+
+class AdmissionControl:
+    """
+    Decides which incoming walks a node takes: at most max_walks at once, and
+    as many per sender as its token bucket allows. Heartbeats and link RPCs
+    do not go through it, so they are never shed.
+    """
+
+    _buckets: "OrderedDict[Node, Tuple[float, float]]"
+
+    def __init__(
+        self,
+        max_walks: int = defaults.MAX_FORWARDED_WALKS,
+        rate: float = defaults.WALK_RATE_PER_PEER,
+        burst: float = defaults.WALK_BURST_PER_PEER,
+        capacity: int = defaults.ADMISSION_PEERS_CAPACITY,
+    ):
+        """
+        :param max_walks: walks handled at once, the rest are rejected
+        :param rate: walks per second a sender is refilled with
+        :param burst: walks a sender may send at once
+        :param capacity: amount of latest senders whose buckets are kept
+        """
+        self.walks_in_flight = 0
+        self._max_walks = max_walks
+        self._rate = rate
+        self._burst = burst
+        self._capacity = capacity
+        self._buckets = OrderedDict()
+
+    def try_admit(self, sender: Node) -> Optional[str]:
+        """
+        Take a walk from the sender, to be released once it is handled.
+        :return: why the walk is rejected, None if it is admitted
+        """
+        if self.walks_in_flight >= self._max_walks:
+            return "overloaded"
+        now = monotonic()
+        tokens, last_update = self._buckets.pop(sender, (self._burst, now))
+        tokens = min(self._burst, tokens + (now - last_update) * self._rate)
+        if tokens < 1:
+            self._buckets[sender] = (tokens, now)
+            return "rate_limited"
+        self._buckets[sender] = (tokens - 1, now)
+        if len(self._buckets) > self._capacity:
+            self._buckets.popitem(last=False)
+        self.walks_in_flight += 1
+        return None
+
+    def release(self) -> None:
+        self.walks_in_flight -= 1
@@ -0,0 +1,235 @@
+import asyncio
+import math
+import random
+from collections import Counter
+from typing import Dict, List, Any, Hashable, Iterable, Optional, Tuple, Sequence
+
+from swaplink.abc import ISwaplink
+from swaplink.data_objects import Node, LinkType
+
+Graph = Dict[Hashable, List[Hashable]]
+
+
+async def collect_samples(
+    swaplinks: Sequence[ISwaplink], num_samples: int, batch_size: int = 50
+) -> List[Node]:
+    """
+    Select nodes from randomly chosen initiators, batch by batch.
+    """
+    samples: List[Node] = []
+    while len(samples) < num_samples:
+        initiator = random.choice(swaplinks)
+        batch = min(batch_size, num_samples - len(samples))
+        samples.extend(await initiator.select_many(batch))
+        await asyncio.sleep(0)
+    return samples
+
+
+def expected_distribution(weights: Dict[Hashable, float]) -> Dict[Hashable, float]:
+    """
+    Selection probabilities proportional to the weights (e.g. num_links).
+    """
+    total = sum(weights.values())
+    return {node: weight / total for node, weight in weights.items()}
+
+
+def chi_square(
+    samples: Iterable[Hashable], expected: Dict[Hashable, float]
+) -> Tuple[float, int, float]:
+    """
+    Pearson's goodness of fit of the samples against the expected probabilities.
+    :return: statistic, degrees of freedom and p-value
+    """
+    observed = Counter(samples)
+    total = sum(observed.values())
+    statistic = 0.0
+    for node, probability in expected.items():
+        expected_count = probability * total
+        if expected_count > 0:
+            statistic += (observed[node] - expected_count) ** 2 / expected_count
+    degrees_of_freedom = max(len(expected) - 1, 1)
+    return statistic, degrees_of_freedom, chi_square_sf(statistic, degrees_of_freedom)
+
+
+def chi_square_sf(statistic: float, degrees_of_freedom: int) -> float:
+    """
+    Probability of a chi-square value at least as large as the statistic.
+    """
+    return _regularized_gamma_q(degrees_of_freedom / 2, statistic / 2)
+
+
+def kl_divergence(
+    samples: Iterable[Hashable], expected: Dict[Hashable, float]
+) -> float:
+    """
+    KL(observed || expected) in bits.
+    """
+    observed = Counter(samples)
+    total = sum(observed.values())
+    divergence = 0.0
+    for node, count in observed.items():
+        probability = count / total
+        if not expected.get(node):
+            return math.inf
+        divergence += probability * math.log2(probability / expected[node])
+    return divergence
+
+
+def overlay_graph(swaplinks: Iterable[ISwaplink], link_type: LinkType) -> Graph:
+    """
+    Snapshot of the links the random walks follow from every node.
+    """
+    graph: Graph = {}
+    for swaplink in swaplinks:
+        link_store = swaplink._link_store
+        if link_type == LinkType.IN:
+            graph[swaplink._node] = link_store.get_in_links_copy()
+        else:
+            graph[swaplink._node] = link_store.get_out_links_copy()
+    return graph
+
+
+def degree_distribution(swaplinks: Iterable[ISwaplink]) -> Dict[str, Dict[int, int]]:
+    """
+    :return: histograms {degree: amount of nodes} of in- and out-degrees
+    """
+    in_degrees: Dict[int, int] = Counter()
+    out_degrees: Dict[int, int] = Counter()
+    for swaplink in swaplinks:
+        in_degrees[swaplink._link_store.num_in_links()] += 1
+        out_degrees[swaplink._link_store.num_out_links()] += 1
+    return {"in": dict(in_degrees), "out": dict(out_degrees)}
+
+
+def walk_step(graph: Graph, distribution: Dict[Hashable, float]) -> Dict[Any, float]:
+    """
+    Distribution after one more hop; dead ends keep their probability.
+    """
+    next_distribution: Dict[Hashable, float] = {}
+    for node, probability in distribution.items():
+        neighbors = [
+            neighbor for neighbor in graph.get(node, []) if neighbor in graph
+        ] or [node]
+        share = probability / len(neighbors)
+        for neighbor in neighbors:
+            next_distribution[neighbor] = next_distribution.get(neighbor, 0) + share
+    return next_distribution
+
+
+def stationary_distribution(graph: Graph, iterations: int = 200) -> Dict[Any, float]:
+    distribution = {node: 1 / len(graph) for node in graph}
+    for _ in range(iterations):
+        distribution = walk_step(graph, distribution)
+    return dict(distribution)
+
+
+def total_variation(first: Dict[Any, float], second: Dict[Any, float]) -> float:
+    nodes = set(first) | set(second)
+    return sum(abs(first.get(node, 0) - second.get(node, 0)) for node in nodes) / 2
+
+
+def mixing_profile(graph: Graph, max_length: int, num_starts: int = 10) -> List[float]:
+    """
+    Worst total variation distance to the stationary distribution, over
+    num_starts random starting nodes, after every walk length up to max_length.
+    """
+    stationary = stationary_distribution(graph)
+    starts = random.sample(list(graph), min(num_starts, len(graph)))
+    distributions = [{start: 1.0} for start in starts]
+    profile = []
+    for _ in range(max_length + 1):
+        profile.append(max(total_variation(dist, stationary) for dist in distributions))
+        distributions = [walk_step(graph, dist) for dist in distributions]
+    return profile
+
+
+def spectral_gap(profile: List[float], tail: int = 5) -> float:
+    """
+    Estimate 1 - |second eigenvalue| from the decay of the mixing profile.
+    """
+    decays = [
+        (profile[i + 1] / profile[i])
+        for i in range(len(profile) - 1)
+        if profile[i] > 1e-12 and profile[i + 1] > 1e-12
+    ][-tail:]
+    if not decays:
+        return 1.0
+    return 1 - min(1.0, sum(decays) / len(decays))
+
+
+def min_walk_length(profile: List[float], tolerance: float) -> Optional[int]:
+    """
+    Shortest walk whose distance to the stationary distribution is within
+    tolerance, None if none of the profile's lengths is.
+    """
+    for length, distance in enumerate(profile):
+        if distance <= tolerance:
+            return length
+    return None
+
+
+def analyze(
+    swaplinks: Sequence[ISwaplink],
+    samples: List[Node],
+    max_walk_length: int = 30,
+    tolerance: float = 0.05,
+) -> Dict[str, Any]:
+    """
+    Report how close the samples are to the degree-proportional distribution,
+    and the overlay's degrees and mixing. min_walk_length is None when no walk
+    up to max_walk_length mixes within tolerance.
+    """
+    expected = expected_distribution(
+        {swaplink._node: swaplink._num_links for swaplink in swaplinks}
+    )
+    statistic, degrees_of_freedom, p_value = chi_square(samples, expected)
+    profile = mixing_profile(overlay_graph(swaplinks, LinkType.IN), max_walk_length)
+    return {
+        "samples": len(samples),
+        "chi_square": statistic,
+        "degrees_of_freedom": degrees_of_freedom,
+        "p_value": p_value,
+        "kl_divergence": kl_divergence(samples, expected),
+        "degrees": degree_distribution(swaplinks),
+        "mixing_profile": profile,
+        "spectral_gap": spectral_gap(profile),
+        "min_walk_length": min_walk_length(profile, tolerance),
+    }
+
+
+def _regularized_gamma_q(a: float, x: float) -> float:
+    """
+    Upper regularized incomplete gamma function Q(a, x).
+    """
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:  # series of P(a, x)
+        term = total = 1 / a
+        denominator = a
+        for _ in range(1000):
+            denominator += 1
+            term *= x / denominator
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1 - total * math.exp(log_prefix))
+    # continued fraction of Q(a, x), modified Lentz's method
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    fraction = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        fraction *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * fraction
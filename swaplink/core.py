@@ -1,41 +1,101 @@
 import asyncio
-import time
+import random
 from asyncio.protocols import BaseProtocol
 from asyncio.transports import BaseTransport
-from collections import deque
-from typing import List, Any
+from typing import (
+    Dict,
+    List,
+    Any,
+    AsyncIterator,
+    Callable,
+    Awaitable,
+    Optional,
+    Container,
+    Set,
+)
 
 from swaplink import defaults
 from swaplink.abc import (
     ISwaplink,
     NodeAddr,
     NeighborsCallback,
+    NeighborsDiffCallback,
     ISwaplinkProtocol,
     ILinkStore,
+    ITransportFactory,
+    IWalkTracer,
+    IHbeatScheduler,
+)
+from swaplink.data_objects import (
+    DictWithCallback,
+    Node,
+    LinkType,
+    WalkMode,
+    IndexedSet,
+    ExpiryHeap,
+    RecentPeers,
+    Stats,
+    NeighborsChange,
+    NeighborsNotifier,
+    NeighborsWatch,
+    Subscription,
+    PeerSnapshot,
+    SamplePool,
+)
+from swaplink.errors import (
+    RPCError,
+    AllExcludedError,
+    NoPeersError,
+    SelectTimeoutError,
+    WalkFailedError,
 )
-from swaplink.data_objects import DictWithCallback, Node, LinkType
-from swaplink.errors import RPCError
+from swaplink.metrics import Metrics
 from swaplink.protocol import SwaplinkProtocol
-from swaplink.utils import random_choice_safe
+from swaplink.snapshot import save_snapshot, load_snapshot
+from swaplink.transport import UDPTransportFactory
+from swaplink.utils import monotonic
+from swaplink.walk_length import WalkLengthEstimator
 
 
 class LinkStore(ILinkStore):
     _in_links: DictWithCallback
     _out_links: DictWithCallback
+    _in_links_index: IndexedSet
+    _out_links_index: IndexedSet
 
     def __init__(
         self,
         in_links: DictWithCallback = None,
         out_links: DictWithCallback = None,
         callback: NeighborsCallback = None,
+        metrics: Metrics = None,
     ):
+        """
+        :param metrics: where link changes are counted. None --> not counted
+        """
+        self._metrics = metrics
         self._in_links = in_links or DictWithCallback()
         self._out_links = out_links or DictWithCallback()
+        self._in_links_index = IndexedSet(self._in_links.keys())
+        self._out_links_index = IndexedSet(self._out_links.keys())
+        self._out_links_announced: Dict[Node, float] = {}
+        self._in_links_expiry = ExpiryHeap(self._in_links.get)
+        self._out_links_expiry = ExpiryHeap(self._out_links.get)
+        for node, hbeat in self._in_links.items():
+            self._in_links_expiry.push(node, hbeat, len(self._in_links))
+        for node, hbeat in self._out_links.items():
+            self._out_links_expiry.push(node, hbeat, len(self._out_links))
+        self._notifier = NeighborsNotifier(self.get_out_links_copy)
+        self._callback_subscription: Optional[Subscription] = None
         self.set_callback(callback)
-        self._out_links.set_callback(self._my_callback)
 
     def add_in_link(self, node: Node) -> None:
-        self._in_links[node] = time.monotonic()
+        hbeat = monotonic()
+        if self._metrics is not None and node not in self._in_links_index:
+            self._metrics.inc("link_changes", link_type="in", change="added")
+        self._in_links_index.add(node)
+        self._in_links[node] = hbeat
+        self._in_links_expiry.push(node, hbeat, len(self._in_links))
 
     def get_in_link_hbeat(self, node: Node) -> float:
         return self._in_links[node]
@@ -43,87 +103,254 @@ class LinkStore(ILinkStore):
     def get_in_links_copy(self) -> List[Any]:
         return list(self._in_links.keys())
 
+    def random_in_link(self, default: Node = None) -> Node:
+        return self._in_links_index.random_choice(default)
+
+    def num_in_links(self) -> int:
+        return len(self._in_links_index)
+
     def remove_in_link(self, node: Node) -> None:
+        if self._metrics is not None and node in self._in_links_index:
+            self._metrics.inc("link_changes", link_type="in", change="removed")
+        self._in_links_index.discard(node)
         if self._in_links.get(node):
             del self._in_links[node]
 
     def contains_in_link(self, node: Node) -> bool:
-        return node in self._in_links
+        return node in self._in_links_index
 
     def add_out_link(self, node: Node) -> None:
-        self._out_links[node] = time.monotonic()
+        hbeat = monotonic()
+        is_new = node not in self._out_links_index
+        self._out_links_index.add(node)
+        self._out_links[node] = hbeat
+        self._out_links_expiry.push(node, hbeat, len(self._out_links))
+        if is_new:
+            self._notifier.notify(node, added=True)
+            if self._metrics is not None:
+                self._metrics.inc("link_changes", link_type="out", change="added")
+
+    def refresh_out_link(self, node: Node) -> None:
+        if node in self._out_links_index:
+            self.add_out_link(node)
 
     def get_out_link_hbeat(self, node: Node) -> float:
         return self._out_links[node]
 
+    def announce_out_link(self, node: Node) -> None:
+        if node in self._out_links_index:
+            self._out_links_announced[node] = monotonic()
+
+    def get_out_link_announce(self, node: Node) -> float:
+        return self._out_links_announced.get(node, float("-inf"))
+
     def get_out_links_copy(self) -> List[Any]:
         return list(self._out_links.keys())
 
+    def random_out_link(self, default: Node = None) -> Node:
+        return self._out_links_index.random_choice(default)
+
+    def num_out_links(self) -> int:
+        return len(self._out_links_index)
+
     def remove_out_link(self, node: Node) -> None:
-        if self._out_links.get(node):
+        if node in self._out_links_index:
+            self._out_links_index.discard(node)
             del self._out_links[node]
+            self._out_links_announced.pop(node, None)
+            self._notifier.notify(node, added=False)
+            if self._metrics is not None:
+                self._metrics.inc("link_changes", link_type="out", change="removed")
+
+    def oldest_in_link_hbeat(self) -> Optional[float]:
+        oldest = self._in_links_expiry.oldest()
+        return oldest[0] if oldest else None
+
+    def oldest_out_link_hbeat(self) -> Optional[float]:
+        oldest = self._out_links_expiry.oldest()
+        return oldest[0] if oldest else None
+
+    def expire_in_links(self, hbeat_limit: float) -> List[Node]:
+        expired = self._in_links_expiry.pop_older_than(hbeat_limit)
+        for node in expired:
+            self.remove_in_link(node)
+        return expired
+
+    def expire_out_links(self, hbeat_limit: float) -> List[Node]:
+        expired = self._out_links_expiry.pop_older_than(hbeat_limit)
+        for node in expired:
+            self.remove_out_link(node)
+        return expired
 
     def remove_link(self, node: Node) -> None:
         self.remove_in_link(node)
         self.remove_out_link(node)
 
     def contains_out_link(self, node: Node) -> bool:
-        return node in self._out_links
+        return node in self._out_links_index
 
     def set_callback(self, callback: NeighborsCallback):
-        self._callback: NeighborsCallback
-        self._callback = callback
+        if self._callback_subscription:
+            self._notifier.unsubscribe(self._callback_subscription)
+            self._callback_subscription = None
+        if callback:
+            self._callback_subscription = self._notifier.subscribe(
+                lambda change: callback(change.neighbors)
+            )
+
+    def subscribe(
+        self, callback: NeighborsDiffCallback, debounce: float = 0
+    ) -> Subscription:
+        return self._notifier.subscribe(callback, debounce)
 
-    def _my_callback(self, changed_dict: DictWithCallback):
-        if self._callback:
-            changed_nodes = list(changed_dict.keys())
-            self._callback(changed_nodes)
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._notifier.unsubscribe(subscription)
 
 
 class Swaplink(ISwaplink):
     _protocol: ISwaplinkProtocol
     _transport: BaseTransport
     _tasks: List[asyncio.Task]
-    _links_queue: deque
+    _recent_peers: RecentPeers
 
     def __init__(
-        self, host: str = defaults.DEFAULT_HOST, port: int = defaults.DEFAULT_PORT
+        self,
+        host: str = defaults.DEFAULT_HOST,
+        port: int = defaults.DEFAULT_PORT,
+        walk_mode: WalkMode = defaults.DEFAULT_WALK_MODE,
+        transport_factory: ITransportFactory = None,
+        adaptive_walk_length: bool = defaults.ADAPTIVE_WALK_LENGTH,
+        walk_bias_tolerance: float = defaults.WALK_BIAS_TOLERANCE,
+        metrics: bool = defaults.METRICS_ENABLED,
+        walk_tracer: IWalkTracer = None,
+        binary_wire: bool = defaults.BINARY_WIRE_FORMAT,
+        one_way_hbeats: bool = defaults.HBEAT_ONE_WAY,
+        select_deadline: float = None,
+        hbeat_scheduler: IHbeatScheduler = None,
+        snapshot_path: str = None,
+        sample_pool_size: int = defaults.SAMPLE_POOL_SIZE,
+        sample_pool_max_age: float = defaults.SAMPLE_POOL_MAX_AGE,
+        sample_pool_refill_rate: float = defaults.SAMPLE_POOL_REFILL_RATE,
     ):
+        """
+        :param transport_factory: where datagrams are sent. None --> UDP sockets
+        :param adaptive_walk_length: walk as few hops as the estimated network
+        size allows, instead of DEFAULT_WALK_LENGTH
+        :param walk_bias_tolerance: accepted distance to the stationary
+        distribution when the walk length is adaptive
+        :param metrics: count RPCs, walks, link changes and heartbeat rounds
+        :param walk_tracer: receives the events of the walks through this node
+        :param binary_wire: use the compact wire format with the peers that
+         support it. False --> only rpcudp's msgpack format
+        :param one_way_hbeats: heartbeat the out-links heard from lately without
+         waiting for an acknowledgement
+        :param select_deadline: seconds select() may take. None --> WALK_TIMEOUT
+        :param hbeat_scheduler: runs the heartbeat rounds together with other
+         nodes' (see swaplink.host). None --> on its own timer
+        :param snapshot_path: file where the links and recent peers are saved,
+         and restored from on join. None --> no snapshot
+        :param sample_pool_size: walk results kept ready for select(),
+         refilled in the background. 0 --> every select() walks
+        :param sample_pool_max_age: seconds a pooled walk result is selectable
+        :param sample_pool_refill_rate: walks per second refilling the pool
+        """
+        if sample_pool_size > 0 and sample_pool_refill_rate <= 0:
+            raise ValueError(
+                f"sample pool refill rate must be positive: {sample_pool_refill_rate}"
+            )
         self._node = Node(host, port)
-        self._link_store = LinkStore()
+        self._walk_mode = walk_mode
+        self._adaptive_walk_length = adaptive_walk_length
+        self._walk_length_estimator = WalkLengthEstimator()  # also for precision
+        self._walk_bias_tolerance = walk_bias_tolerance
+        self._transport_factory = transport_factory or UDPTransportFactory()
+        self._metrics = Metrics() if metrics else None
+        self._walk_tracer = walk_tracer
+        self._binary_wire = binary_wire
+        self._one_way_hbeats = one_way_hbeats
+        self._select_deadline = select_deadline
+        self._hbeat_scheduler = hbeat_scheduler
+        self._snapshot_path = snapshot_path
+        self._snapshot_write: Optional[asyncio.Future] = None
+        self._sample_pool = (
+            SamplePool(sample_pool_size, sample_pool_max_age)
+            if sample_pool_size > 0
+            else None
+        )
+        self._sample_pool_refill_rate = sample_pool_refill_rate
+        # set when the pool has room
+        self._sample_pool_room: Optional[asyncio.Event] = None
+        self._link_store = LinkStore(metrics=self._metrics)
         self._num_links = None
 
         self._protocol = None
         self._transport = None
         self._tasks = []
-        self._links_queue = deque()
+        # bootstrapping left running by join, which fills the missing out-links
+        self._bootstrap: Optional[asyncio.Future] = None
+        self._stats = Stats()
+        self._recent_peers = RecentPeers(
+            defaults.RECENT_PEERS_CAPACITY, defaults.RECENT_PEERS_MAX_AGE
+        )
+
+    @property
+    def stats(self) -> Stats:
+        return self._stats
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        return self._metrics
 
     async def join(
-        self, num_links: int, bootstrap_nodes: List[NodeAddr] = None
+        self,
+        num_links: int,
+        bootstrap_nodes: List[NodeAddr] = None,
+        min_degree: int = None,
     ) -> None:
-        loop = asyncio.get_event_loop()
-        self._transport, protocol = await loop.create_datagram_endpoint(
+        join_start = monotonic()
+        self._num_links = num_links
+        self._transport, protocol = await self._transport_factory.create_endpoint(
             lambda: SwaplinkProtocol(
-                self._node, self._link_store, self._links_queue, self._num_links
+                self._node,
+                self._link_store,
+                self._recent_peers,
+                self._num_links,
+                self._metrics,
+                self._walk_tracer,
+                self._binary_wire,
             ),
-            local_addr=self._node,
+            self._node,
         )
         self._protocol = self._base_protocol_cast(protocol)
-        self._num_links = num_links
-        if bootstrap_nodes:  # else: first node in the network
-            await self._init_links(bootstrap_nodes)
+        snapshot = self._load_snapshot()
+        if bootstrap_nodes or snapshot:  # else: first node in the network
+            await self._init_links(
+                bootstrap_nodes or [], min_degree or num_links, join_start, snapshot
+            )
 
         self._run_tasks()
+        self._stats.join_duration = monotonic() - join_start
 
-    async def leave(self) -> None:
-        if self._transport is not None:
-            self._transport.close()
+    async def leave(self, deadline: float = None) -> None:
+        if self._hbeat_scheduler is not None:
+            self._hbeat_scheduler.remove(self._clear_out_links)
         for task in self._tasks:
             task.cancel()
             try:
                 await task
             except asyncio.CancelledError:
                 pass
+        if self._protocol is not None:
+            await self._write_snapshot()
+        if deadline is None:
+            deadline = defaults.LEAVE_DEADLINE
+        if self._protocol is not None and deadline > 0:
+            try:
+                await asyncio.wait_for(self._splice_links(), deadline)
+            except asyncio.TimeoutError:
+                pass
+        if self._transport is not None:
+            self._transport.close()
 
     def list_neighbours(
         self, callback_on_change: NeighborsCallback = None
@@ -132,33 +359,523 @@ class Swaplink(ISwaplink):
             self._link_store.set_callback(callback_on_change)
         return self._link_store.get_out_links_copy()  # todo: return also in-links?
 
-    async def select(self) -> Node:
+    def watch_neighbours(
+        self, callback: NeighborsDiffCallback = None, debounce: float = 0
+    ) -> NeighborsWatch:
+        if callback:
+            return NeighborsWatch(self._link_store.subscribe(callback, debounce), None)
+        changes: "asyncio.Queue[NeighborsChange]" = asyncio.Queue()
+        subscription = self._link_store.subscribe(changes.put_nowait, debounce)
+        return NeighborsWatch(subscription, changes)
+
+    def unwatch_neighbours(self, watch: NeighborsWatch) -> None:
+        self._link_store.unsubscribe(watch.subscription)
+
+    async def select(
+        self,
+        walk_length: int = None,
+        link_type: LinkType = LinkType.IN,
+        exclude: Container[Node] = None,
+        precision: float = None,
+    ) -> Node:
+        """
+        Walks are failed over hop by hop, and restarted from another in-link
+        up to WALK_HOP_RETRIES times, within the select deadline.
+        Walks ending at an excluded node go on for DEFAULT_WALK_THINNING hops,
+        so that the other nodes keep their relative probabilities, up to
+        SELECT_EXCLUDED_RETRIES times.
+        With a sample pool, a pooled walk result is taken instead if any,
+        unless the call sets its own parameters.
+        """
+        if walk_length is not None and walk_length < 0:
+            raise ValueError(f"negative walk length: {walk_length}")
+        if precision is not None and precision <= 0:
+            raise ValueError(f"precision must be positive: {precision}")
+        pooled_walk = (
+            walk_length is None and precision is None and link_type == LinkType.IN
+        )
+        if self._sample_pool is not None and pooled_walk and not exclude:
+            pooled = self._pooled_sample()
+            if pooled is not None:
+                return pooled
+        if walk_length is None and precision is not None:
+            walk_length = self._walk_length(precision)
+        # an excluded result is walked on from: the chain stays mixed
+        thinning = defaults.DEFAULT_WALK_THINNING
+        if walk_length is not None:
+            thinning = min(walk_length, thinning)
+        deadline = monotonic() + (self._select_deadline or defaults.WALK_TIMEOUT)
+        cause = None
+        attempts = defaults.WALK_HOP_RETRIES + 1
+        attempt = 0
+        excluded_retries = defaults.SELECT_EXCLUDED_RETRIES
+        start_node, hops = None, walk_length
+        while attempt < attempts:
+            # a dead start node answers nothing: leave time for the next ones
+            timeout = (deadline - monotonic()) / (attempts - attempt)
+            if timeout <= 0:
+                break
+            if start_node is None:
+                try:
+                    start_node = self._walk_start(link_type)
+                except IndexError as error:
+                    self._count_select_failure("no_peers")
+                    raise NoPeersError("no neighbor nor recent peer") from error
+            try:
+                random_node = await self._random_walk(
+                    start_node, link_type, timeout, hops
+                )
+            except RPCError as error:
+                cause = error
+                attempt += 1
+                start_node, hops = None, walk_length
+                continue
+            if exclude and random_node in exclude:  # not a failure
+                if not excluded_retries:
+                    self._count_select_failure("excluded")
+                    raise AllExcludedError("all candidates excluded")
+                excluded_retries -= 1
+                if thinning:
+                    start_node, hops = random_node, thinning
+                else:
+                    start_node = None
+                continue
+            return random_node
+        if monotonic() >= deadline:
+            self._count_select_failure("timeout")
+            raise SelectTimeoutError("select deadline exceeded") from cause
+        self._count_select_failure("walk_failed")
+        raise WalkFailedError("every walk failed") from cause
+
+    def _count_select_failure(self, reason: str) -> None:
+        if self._metrics is not None:
+            self._metrics.inc("select_failures", reason=reason)
+
+    def _pooled_sample(self) -> Optional[Node]:
+        self._count_stale_samples(self._sample_pool.evict_stale())
+        self._make_pool_room()
+        try:
+            node = self._sample_pool.pop()
+        except IndexError:
+            self._stats.sample_pool_misses += 1
+            self._count_pooled_select("miss")
+            return None
+        self._stats.sample_pool_hits += 1
+        self._count_pooled_select("hit")
+        return node
+
+    def _count_stale_samples(self, amount: int) -> None:
+        if not amount:
+            return
+        self._stats.sample_pool_stale += amount
+        if self._metrics is not None:
+            self._metrics.inc("sample_pool", amount, result="stale")
+
+    def _count_pooled_select(self, result: str) -> None:
+        if self._metrics is not None:
+            self._metrics.inc("sample_pool", result=result)
+
+    async def _refill_sample_pool(self) -> None:
+        """
+        Walk for samples while the pool is not full, at most
+        sample_pool_refill_rate walks per second.
+        """
+        pool = self._sample_pool
+        walks: Set[asyncio.Future] = set()
+        due_expiry = None
+        try:
+            while True:
+                self._count_stale_samples(pool.evict_stale(due_expiry))
+                due_expiry = None
+                if len(pool) + len(walks) < pool.size:
+                    walk = asyncio.ensure_future(self._pool_walk())
+                    walks.add(walk)
+                    walk.add_done_callback(walks.discard)
+                    await asyncio.sleep(1 / self._sample_pool_refill_rate)
+                    continue
+                self._sample_pool_room.clear()
+                expiry = pool.next_expiry()  # the oldest sample makes room then
+                try:
+                    await asyncio.wait_for(
+                        self._sample_pool_room.wait(),
+                        None if expiry is None else max(expiry - monotonic(), 0),
+                    )
+                except asyncio.TimeoutError:
+                    due_expiry = expiry
+        finally:
+            for pending_walk in walks:
+                pending_walk.cancel()
+
+    async def _pool_walk(self) -> None:
         try:
-            random_node = random_choice_safe(self._link_store.get_in_links_copy())
-            if not random_node:
-                random_node = self._links_queue.pop()
-            return await self._protocol.call_random_walk(
-                random_node, 0, defaults.DEFAULT_WALK_LENGTH, LinkType.IN
+            start_node = self._walk_start(LinkType.IN)
+            self._sample_pool.add(await self._random_walk(start_node, LinkType.IN))
+        except (IndexError, RPCError):
+            self._make_pool_room()
+
+    def _make_pool_room(self) -> None:
+        if self._sample_pool_room is not None:  # else: not joined yet
+            self._sample_pool_room.set()
+
+    async def iter_select(
+        self,
+        k: int,
+        max_in_flight: int = defaults.MAX_WALKS_IN_FLIGHT,
+        unique: bool = False,
+        samples_per_walk: int = 1,
+    ) -> AsyncIterator[Node]:
+        semaphore = asyncio.Semaphore(max_in_flight)
+
+        async def walk(start_node: Node) -> List[Node]:
+            async with semaphore:
+                return await self._sample_walk(
+                    start_node, LinkType.IN, samples_per_walk
+                )
+
+        num_walks = -(-k // samples_per_walk)
+        walks = [
+            asyncio.ensure_future(walk(node)) for node in self._walk_starts(num_walks)
+        ]
+        selected = set()
+        num_selected = 0
+        try:
+            for next_walk in asyncio.as_completed(walks):
+                try:
+                    random_nodes = await next_walk
+                except RPCError:
+                    continue
+                for random_node in random_nodes:
+                    if unique:
+                        if random_node in selected:
+                            continue
+                        selected.add(random_node)
+                    if num_selected == k:
+                        return
+                    num_selected += 1
+                    yield random_node
+        finally:
+            for pending_walk in walks:
+                pending_walk.cancel()
+
+    async def select_many(
+        self,
+        k: int,
+        max_in_flight: int = defaults.MAX_WALKS_IN_FLIGHT,
+        unique: bool = False,
+        samples_per_walk: int = 1,
+    ) -> List[Node]:
+        return [
+            node
+            async for node in self.iter_select(
+                k, max_in_flight, unique, samples_per_walk
             )
-        except (RPCError, IndexError):
-            pass
-        return None  # todo: raise error?
-
-    async def _init_links(self, bootstrap_nodes):
-        for _ in range(self._num_links):
-            random_bootstrap_addr = random_choice_safe(bootstrap_nodes)
-            random_bootstrap = Node(*random_bootstrap_addr)
+        ]
+
+    def _walk_starts(self, k: int) -> List[Node]:
+        """
+        Spread k walks over the in-links, so that they start from different nodes.
+        """
+        in_links = self._link_store.get_in_links_copy()
+        random.shuffle(in_links)
+        if not in_links:
+            in_links = self._recent_peers.most_recent(k)
+        if not in_links:
+            return []
+        return [in_links[i % len(in_links)] for i in range(k)]
+
+    async def _splice_links(self) -> None:
+        """
+        Ask every in-link peer to take one of our out-link peers instead of
+        us, then say goodbye to the neighbors, so that they drop us at once.
+        """
+        in_links = self._link_store.get_in_links_copy()
+        out_links = self._link_store.get_out_links_copy()
+
+        async def splice(in_link: Node, candidates: List[Node]) -> None:
+            for out_link in candidates:
+                try:
+                    if await self._protocol.call_change_your_out_node(
+                        in_link, out_link
+                    ):
+                        self._count_splice("given")
+                        return
+                except RPCError:
+                    break  # the in-link peer is gone
+            self._count_splice("failed")
+
+        async def say_goodbye(node: Node) -> None:
+            self._link_store.remove_link(node)  # no more piggybacked heartbeats
+            try:
+                await self._protocol.call_goodbye(node)
+            except RPCError:
+                pass
+
+        random.shuffle(out_links)
+        await asyncio.gather(
+            *(
+                splice(in_link, self._splice_candidates(i, in_link, out_links))
+                for i, in_link in enumerate(in_links)
+            )
+        )
+        await asyncio.gather(*map(say_goodbye, dict.fromkeys(in_links + out_links)))
+
+    @staticmethod
+    def _splice_candidates(i: int, in_link: Node, out_links: List[Node]) -> List[Node]:
+        """
+        Out-link peers for the i-th in-link peer, in an order that spreads
+        the in-link peers evenly among them.
+        """
+        if not out_links:
+            return []
+        start = i % len(out_links)
+        rotated = out_links[start:] + out_links[:start]
+        return [out_link for out_link in rotated if out_link != in_link]
+
+    def _count_splice(self, result: str) -> None:
+        if self._metrics is not None:
+            self._metrics.inc("leave_splices", result=result)
+
+    def save_snapshot(self) -> None:
+        """
+        Save the links and recent peers to snapshot_path, if there is one.
+        Blocks until the file is written and synced. Done periodically and on
+        leave, in a thread.
+        """
+        if self._snapshot_path is None:
+            return
+        save_snapshot(self._snapshot_path, self._take_snapshot())
+
+    def _take_snapshot(self) -> PeerSnapshot:
+        return PeerSnapshot(
+            self._link_store.get_out_links_copy(),
+            self._link_store.get_in_links_copy(),
+            self._recent_peers.most_recent(defaults.RECENT_PEERS_CAPACITY),
+        )
+
+    async def _write_snapshot(self) -> None:
+        """
+        save_snapshot() off the event loop, once the previous write is done.
+        """
+        if self._snapshot_path is None:
+            return
+        if self._snapshot_write is not None:
+            await asyncio.wait([self._snapshot_write])  # e.g. a cancelled one
+        self._snapshot_write = asyncio.get_running_loop().run_in_executor(
+            None, save_snapshot, self._snapshot_path, self._take_snapshot()
+        )
+        # the file is still written if we are cancelled
+        await asyncio.shield(self._snapshot_write)
+
+    def _load_snapshot(self) -> Optional[PeerSnapshot]:
+        if self._snapshot_path is None:
+            return None
+        snapshot = load_snapshot(self._snapshot_path)
+        if snapshot is None:
+            return None
+        for node in reversed(snapshot.recent_peers + snapshot.in_links):
+            if node != self._node:
+                self._recent_peers.add(node)  # walk starts until in-links come
+        return snapshot
+
+    async def _save_snapshots(self) -> None:
+        while True:
+            await asyncio.sleep(defaults.SNAPSHOT_INTERVAL)
+            await self._write_snapshot()
+
+    async def _init_links(
+        self,
+        bootstrap_nodes: List[NodeAddr],
+        min_degree: int,
+        join_start: float,
+        snapshot: PeerSnapshot = None,
+    ) -> None:
+        """
+        Returns once min_degree out-links are established (or bootstrapping
+        gave up), the remaining ones are established in the background.
+        :param snapshot: saved peers, whose out-links are restored first
+        """
+        min_degree_reached = asyncio.Event()
+
+        def on_new_link() -> None:
+            degree = self._link_store.num_out_links()
+            if degree >= min_degree and not min_degree_reached.is_set():
+                self._stats.min_degree_duration = monotonic() - join_start
+                min_degree_reached.set()
+            if degree >= self._num_links and not self._stats.full_degree_duration:
+                self._stats.full_degree_duration = monotonic() - join_start
+
+        bootstrap = asyncio.ensure_future(
+            self._bootstrap_links(bootstrap_nodes, on_new_link, snapshot)
+        )
+        degree_reached = asyncio.ensure_future(min_degree_reached.wait())
+        await asyncio.wait(
+            [bootstrap, degree_reached], return_when=asyncio.FIRST_COMPLETED
+        )
+        degree_reached.cancel()
+        if not bootstrap.done():
+            self._tasks.append(bootstrap)
+            self._bootstrap = bootstrap
+
+    async def _bootstrap_links(
+        self,
+        bootstrap_nodes: List[NodeAddr],
+        on_new_link: Callable[[], None],
+        snapshot: PeerSnapshot = None,
+    ) -> None:
+        """
+        Saved out-links that are still alive are taken back, and the walks
+        for the missing ones start from them rather than from the bootstrap
+        nodes.
+        """
+        # deduplicated in order: set order would vary with the hash seed
+        entry_points = list(dict.fromkeys(Node(*node) for node in bootstrap_nodes))
+        claimed = set()
+        if snapshot is not None:
+            restored = await self._restore_links(snapshot.out_links, on_new_link)
+            if restored:
+                entry_points = restored
+            claimed |= set(snapshot.out_links)
+        if not entry_points:
+            return
+
+        async def init_link(neighbor: Node) -> None:
+            if not self._has_out_link_room():
+                return
             try:
-                neighbor = await self._protocol.call_random_walk(
-                    random_bootstrap, 0, defaults.DEFAULT_WALK_LENGTH, LinkType.IN
-                )
                 await self._protocol.call_give_me_in_node(neighbor)
                 await self._protocol.call_im_your_in_node(neighbor)
-                self._link_store.add_out_link(neighbor)
-                bootstrap_nodes.append(neighbor)
-                bootstrap_nodes = list(set(bootstrap_nodes))
             except RPCError:
-                pass
+                return
+            if not self._has_out_link_room():  # e.g. handed-off links came first
+                return
+            self._link_store.add_out_link(neighbor)
+            entry_points.append(neighbor)
+            on_new_link()
+
+        # walks adding no link (failed, or ended on claimed nodes) are retried,
+        # as many times per link as the repair would
+        failed_walks = 0
+        while failed_walks < self._num_links * (defaults.LINK_REPAIR_RETRIES + 1):
+            num_out_links = self._link_store.num_out_links()
+            missing_links = self._num_links - num_out_links
+            if missing_links <= 0:
+                break
+            try:
+                neighbors = await self._sample_walk(
+                    random.choice(entry_points), LinkType.IN, missing_links
+                )
+            except RPCError:
+                failed_walks += 1
+                continue
+            candidates = [
+                neighbor
+                for neighbor in dict.fromkeys(neighbors)
+                if neighbor not in claimed and neighbor != self._node
+            ]
+            claimed.update(candidates)
+            await asyncio.gather(*(init_link(neighbor) for neighbor in candidates))
+            if self._link_store.num_out_links() == num_out_links:
+                failed_walks += 1
+
+    async def _restore_links(
+        self, saved_links: List[Node], on_new_link: Callable[[], None]
+    ) -> List[Node]:
+        """
+        Probe the saved out-links concurrently with im_your_in_node.
+        :return: the ones that answered, now out-links again
+        """
+
+        async def restore_link(node: Node) -> bool:
+            try:
+                await self._protocol.call_im_your_in_node(node)
+            except RPCError:
+                return False
+            self._link_store.add_out_link(node)
+            on_new_link()
+            return True
+
+        candidates = [node for node in saved_links if node != self._node]
+        candidates = candidates[: self._num_links]
+        restored = await asyncio.gather(*(restore_link(node) for node in candidates))
+        self._stats.restored_links = sum(restored)
+        return [node for node, is_restored in zip(candidates, restored) if is_restored]
+
+    def _walk_length(self, precision: float = None) -> int:
+        """
+        The overlay's average degree is taken to be our num_links. Our
+        in-degree is not used: it grows with our own load, and a loaded node
+        would walk too few hops.
+        :param precision: accepted bias. None --> walk_bias_tolerance if the
+         walk length is adaptive, else DEFAULT_WALK_LENGTH
+        """
+        if precision is None:
+            if not self._adaptive_walk_length:
+                return defaults.DEFAULT_WALK_LENGTH
+            precision = self._walk_bias_tolerance
+        return self._walk_length_estimator.walk_length(self._num_links or 0, precision)
+
+    def _observe_samples(self, link_type: LinkType, samples: List[Node]) -> None:
+        """
+        Feed the walk length estimator with the nodes that walks over
+        in-links end at, which are the ones select() samples from.
+        """
+        if link_type == LinkType.IN:
+            self._walk_length_estimator.observe(
+                sample for sample in samples if sample is not None
+            )
+
+    async def _random_walk(
+        self,
+        start_node: Node,
+        link_type: LinkType,
+        timeout: float = None,
+        walk_length: int = None,
+    ) -> Node:
+        """
+        :param timeout: seconds the walk may take. None --> WALK_TIMEOUT
+        :param walk_length: hops chosen by the caller, whose result is not fed
+         to the walk length estimator. None --> the node's walk length
+        """
+        hops = self._walk_length() if walk_length is None else walk_length
+        if self._walk_mode == WalkMode.FORWARDING:
+            random_node = await self._protocol.call_forward_walk(
+                start_node, hops, link_type, timeout
+            )
+        else:
+            random_node = await self._protocol.call_random_walk(
+                start_node, 0, hops, link_type, timeout=timeout
+            )
+        if walk_length is None:
+            self._observe_samples(link_type, [random_node])
+        return random_node
+
+    async def _sample_walk(
+        self, start_node: Node, link_type: LinkType, num_samples: int
+    ) -> List[Node]:
+        """
+        Collect several nodes in one walk: after the walk length,
+        every DEFAULT_WALK_THINNING-th visited node is taken.
+        """
+        if num_samples == 1:
+            return [await self._random_walk(start_node, link_type)]
+        if self._walk_mode == WalkMode.FORWARDING:
+            samples = await self._protocol.call_forward_sample_walk(
+                start_node,
+                self._walk_length(),
+                defaults.DEFAULT_WALK_THINNING,
+                num_samples,
+                link_type,
+            )
+        else:
+            samples = await self._protocol.call_sample_walk(
+                start_node,
+                self._walk_length(),
+                defaults.DEFAULT_WALK_THINNING,
+                num_samples,
+                link_type,
+            )
+        self._observe_samples(link_type, samples)
+        return samples
 
     def _base_protocol_cast(self, protocol: BaseProtocol) -> ISwaplinkProtocol:
         """
@@ -173,55 +890,190 @@ class Swaplink(ISwaplink):
     def _run_tasks(self) -> None:
         self._tasks.append(asyncio.create_task(self._update_in_links()))
         self._tasks.append(asyncio.create_task(self._update_out_links()))
+        self._tasks.append(asyncio.create_task(self._expire_links()))
+        if self._hbeat_scheduler is not None:
+            self._hbeat_scheduler.add(self._clear_out_links)
+        if self._snapshot_path is not None:
+            self._tasks.append(asyncio.create_task(self._save_snapshots()))
+        if self._sample_pool is not None:
+            self._sample_pool_room = asyncio.Event()
+            self._tasks.append(asyncio.create_task(self._refill_sample_pool()))
 
     async def _update_in_links(self) -> None:
         while True:
-            self._clear_in_links()
             await self._add_in_links()
             await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
 
+    async def _expire_links(self) -> None:
+        """
+        Links expire HBEAT_CHECK_FREQUENCY after their last heartbeat.
+        Sleeps until the oldest one is due, so only expiring links cost work.
+        """
+        due_hbeat = None
+        while True:
+            ttl = defaults.HBEAT_CHECK_FREQUENCY
+            hbeat_limit = monotonic() - ttl
+            if due_hbeat is not None:  # the clock may land just before it
+                hbeat_limit = max(hbeat_limit, due_hbeat)
+            self._clear_in_links(hbeat_limit)
+            self._clear_silent_out_links(hbeat_limit)
+            oldest_hbeats = [
+                hbeat
+                for hbeat in (
+                    self._link_store.oldest_in_link_hbeat(),
+                    self._link_store.oldest_out_link_hbeat(),
+                )
+                if hbeat is not None
+            ]
+            due_hbeat = min(oldest_hbeats) if oldest_hbeats else None
+            next_expiry = (due_hbeat if oldest_hbeats else monotonic()) + ttl
+            await asyncio.sleep(max(next_expiry - monotonic(), 0))
+
     async def _update_out_links(self) -> None:
         while True:
-            await self._clear_out_links()
-            await self._add_out_links()
+            if self._hbeat_scheduler is None:
+                await self._clear_out_links()
+            if self._bootstrap is None or self._bootstrap.done():  # same slots
+                await self._add_out_links()
             await asyncio.sleep(defaults.HBEAT_SEND_FREQUENCY)
 
     async def _clear_out_links(self) -> None:
+        """
+        Heartbeat the idle out-links. An out-link is not idle while it answers
+        other RPCs and was told recently we are its in-node, e.g. piggybacked.
+        """
+        round_start = monotonic()
+        semaphore = asyncio.Semaphore(defaults.HBEAT_MAX_IN_FLIGHT)
+
+        async def send_hbeat(node: Node) -> bool:
+            async with semaphore:
+                try:
+                    await self._protocol.call_im_your_in_node(node)
+                    self._link_store.refresh_out_link(node)
+                    return True
+                except RPCError:
+                    self._link_store.remove_out_link(node)
+                    return False
+
+        # one-way heartbeats are not acknowledged: probe early enough for a
+        # dead out-link to be noticed before the check expires it
+        max_one_way_silence = (
+            defaults.HBEAT_CHECK_FREQUENCY - 2 * defaults.HBEAT_SEND_FREQUENCY
+        )
+        idle_links = []
+        skipped = one_way = 0
         for node in self._link_store.get_out_links_copy():
-            try:
-                await self._protocol.call_im_your_in_node(node)
-            except RPCError:
-                self._link_store.remove_out_link(node)
+            heard = round_start - self._link_store.get_out_link_hbeat(node)
+            announced = round_start - self._link_store.get_out_link_announce(node)
+            if max(heard, announced) < defaults.HBEAT_SEND_FREQUENCY:
+                skipped += 1
+            elif (
+                self._one_way_hbeats
+                and heard < max_one_way_silence
+                and self._protocol.notify_im_your_in_node(node)
+            ):
+                one_way += 1
+            else:
+                idle_links.append(node)
+        hbeats = [asyncio.ensure_future(send_hbeat(node)) for node in idle_links]
+        failed = 0
+        if hbeats:
+            # late heartbeats are not cancelled: they still clear dead links
+            done, late = await asyncio.wait(
+                hbeats, timeout=defaults.HBEAT_ROUND_DEADLINE
+            )
+            failed = len(late) + sum(not hbeat.result() for hbeat in done)
+        round_duration = monotonic() - round_start
+        self._stats.add_hbeat_round(
+            round_duration, len(idle_links), failed, skipped, one_way
+        )
+        if self._metrics is not None:
+            self._metrics.observe("hbeat_round_duration_seconds", round_duration)
+            self._metrics.inc("hbeats", len(idle_links), kind="acked")
+            self._metrics.inc("hbeats", one_way, kind="one_way")
+            self._metrics.inc("hbeats", skipped, kind="skipped")
 
-    def _clear_in_links(self) -> None:
-        for node in self._link_store.get_in_links_copy():
-            hbeat = self._link_store.get_in_link_hbeat(node)
-            if time.monotonic() - hbeat >= defaults.HBEAT_CHECK_FREQUENCY:
-                self._link_store.remove_in_link(node)
+    def _clear_in_links(self, hbeat_limit: float) -> None:
+        self._link_store.expire_in_links(hbeat_limit)
+
+    def _clear_silent_out_links(self, hbeat_limit: float) -> None:
+        self._link_store.expire_out_links(hbeat_limit)
 
     async def _add_out_links(self):
-        for _ in range(self._num_links - len(self._link_store.get_out_links_copy())):
-            try:
-                random_node = random_choice_safe(self._link_store.get_in_links_copy())
-                if not random_node:
-                    random_node = self._links_queue.pop()
-                node = await self._protocol.call_random_walk(
-                    random_node, 0, defaults.DEFAULT_WALK_LENGTH, LinkType.IN
-                )
-                await self._protocol.call_im_your_in_node(node)
+        async def add_out_link(node: Node) -> None:
+            if not self._has_out_link_room():
+                return  # filled meanwhile, e.g. by handed-off links
+            await self._protocol.call_im_your_in_node(node)
+            if self._has_out_link_room():
                 self._link_store.add_out_link(node)
-            except (RPCError, IndexError):
-                pass
+
+        await self._repair_links(
+            self._num_links - self._link_store.num_out_links(),
+            LinkType.IN,
+            self._link_store.contains_out_link,
+            add_out_link,
+        )
+
+    def _has_out_link_room(self) -> bool:
+        return self._link_store.num_out_links() < self._num_links
 
     async def _add_in_links(self):
-        for _ in range(self._num_links - len(self._link_store.get_in_links_copy())):
-            try:
-                random_node = random_choice_safe(self._link_store.get_out_links_copy())
-                if not random_node:
-                    random_node = self._links_queue.pop()
-                node = await self._protocol.call_random_walk(
-                    random_node, 0, defaults.DEFAULT_WALK_LENGTH, LinkType.OUT
-                )
-                await self._protocol.call_give_me_in_node(node)
-            except (RPCError, IndexError):
-                pass
+        await self._repair_links(
+            self._num_links - self._link_store.num_in_links(),
+            LinkType.OUT,
+            self._link_store.contains_in_link,
+            self._protocol.call_give_me_in_node,
+        )
+
+    async def _repair_links(
+        self,
+        missing_links: int,
+        link_type: LinkType,
+        is_linked: Callable[[Node], bool],
+        link: Callable[[Node], Awaitable[Optional[bool]]],
+    ) -> None:
+        """
+        Fill the missing links concurrently. Every slot walks for a candidate
+        no other slot has claimed, and failed slots are retried with backoff.
+        :param missing_links: amount of slots to fill
+        :param link_type: direction of the walks
+        :param is_linked: whether a candidate is already linked
+        :param link: establishes the link with the candidate, False if it
+         could not
+        """
+        semaphore = asyncio.Semaphore(defaults.LINK_REPAIR_MAX_IN_FLIGHT)
+        claimed = set()
+
+        async def repair_slot() -> None:
+            backoff = defaults.LINK_REPAIR_BACKOFF
+            for attempt in range(defaults.LINK_REPAIR_RETRIES + 1):
+                if attempt:
+                    await asyncio.sleep(backoff)
+                    backoff *= 2
+                async with semaphore:
+                    try:
+                        node = await self._random_walk(
+                            self._walk_start(link_type), link_type
+                        )
+                        if node in claimed or node == self._node or is_linked(node):
+                            continue
+                        claimed.add(node)
+                        if await link(node) is False:
+                            continue  # e.g. no in-link to hand off
+                        return
+                    except (RPCError, IndexError):
+                        pass
+
+        await asyncio.gather(*(repair_slot() for _ in range(missing_links)))
+
+    def _walk_start(self, link_type: LinkType) -> Node:
+        """
+        :raise IndexError: no neighbor nor recent peer to start from
+        """
+        if link_type == LinkType.IN:
+            random_node = self._link_store.random_in_link()
+        else:
+            random_node = self._link_store.random_out_link()
+        if not random_node:
+            random_node = self._recent_peers.pop()
+        return random_node
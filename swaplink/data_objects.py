@@ -1,8 +1,23 @@
-from collections import namedtuple
+import asyncio
+import heapq
+import random
+from collections import namedtuple, OrderedDict, deque
 from enum import IntEnum, auto
-from typing import Callable, List, Any
+from typing import Callable, List, Any, Dict, Iterable, Iterator, Tuple, Optional
+
+from swaplink.utils import monotonic
 
 Node = namedtuple("Node", ["host", "port"])
+HeartbeatRound = namedtuple(
+    "HeartbeatRound", ["duration", "sent", "failed", "skipped", "one_way"]
+)
+NeighborsChange = namedtuple("NeighborsChange", ["added", "removed", "neighbors"])
+# changes: queue the diffs are put in, None if they go to a callback
+NeighborsWatch = namedtuple("NeighborsWatch", ["subscription", "changes"])
+# kind: "start" (node: first hop), "hop" (detail: next hop, None if it ends)
+# or "end" (detail: samples, or the error the walk failed with)
+WalkEvent = namedtuple("WalkEvent", ["kind", "node", "index", "detail"])
+PeerSnapshot = namedtuple("PeerSnapshot", ["out_links", "in_links", "recent_peers"])
 
 
 class LinkType(IntEnum):  # IntEnum instead of enum for compatibility with MsgPack
@@ -10,6 +25,11 @@ class LinkType(IntEnum):  # IntEnum instead of enum for compatibility with MsgPa
     OUT = auto()
 
 
+class WalkMode(IntEnum):
+    RECURSIVE = auto()  # every hop awaits the next one, result unwinds the chain
+    FORWARDING = auto()  # every hop forwards the walk, last one replies initiator
+
+
 class DictWithCallback(dict):
     """
     Send all changes to an observer.
@@ -61,3 +81,332 @@ class DictWithCallback(dict):
     def _call_callback(self) -> None:
         if self._callback:
             self._callback(self)
+
+
+class NeighborsNotifier:
+    """
+    Report neighbors' membership changes to subscribers as NeighborsChange diffs,
+    optionally batching the changes of a debounce window.
+    """
+
+    _subscriptions: List["Subscription"]
+
+    def __init__(self, get_neighbors: Callable[[], List[Node]]):
+        """
+        :param get_neighbors: current neighbors, sent along with every diff
+        """
+        self._get_neighbors = get_neighbors
+        self._subscriptions = []
+
+    def subscribe(
+        self, deliver: Callable[[NeighborsChange], Any], debounce: float = 0
+    ) -> "Subscription":
+        subscription = Subscription(self, deliver, debounce)
+        self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: "Subscription") -> None:
+        if subscription in self._subscriptions:
+            self._subscriptions.remove(subscription)
+            subscription.cancel()
+
+    def notify(self, node: Node, added: bool) -> None:
+        for subscription in list(self._subscriptions):
+            subscription.change(node, added)
+
+
+class Subscription:
+    def __init__(
+        self,
+        notifier: NeighborsNotifier,
+        deliver: Callable[[NeighborsChange], Any],
+        debounce: float,
+    ):
+        self._notifier = notifier
+        self._deliver = deliver
+        self._debounce = debounce
+        self._added: set = set()
+        self._removed: set = set()
+        self._timer: asyncio.TimerHandle = None
+
+    def change(self, node: Node, added: bool) -> None:
+        pending, opposite = (
+            (self._added, self._removed) if added else (self._removed, self._added)
+        )
+        if node in opposite:  # changes within the same window cancel each other
+            opposite.discard(node)
+        else:
+            pending.add(node)
+        if not self._debounce:
+            self.flush()
+        elif not self._timer:
+            self._timer = asyncio.get_event_loop().call_later(
+                self._debounce, self.flush
+            )
+
+    def flush(self) -> None:
+        self._timer = None
+        if not self._added and not self._removed:
+            return
+        change = NeighborsChange(
+            frozenset(self._added),
+            frozenset(self._removed),
+            self._notifier._get_neighbors(),
+        )
+        self._added, self._removed = set(), set()
+        self._deliver(change)
+
+    def cancel(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+
+class IndexedSet:
+    """
+    Set that also keeps its items in a list, so that adding, removing
+    (swapping with the last item) and picking a random item are O(1).
+    """
+
+    _items: List[Any]
+    _positions: Dict[Any, int]
+
+    def __init__(self, items: Iterable = ()):
+        self._items = []
+        self._positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: Any) -> None:
+        if item not in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item: Any) -> None:
+        position = self._positions.pop(item, None)
+        if position is None:
+            return
+        last_item = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last_item
+            self._positions[last_item] = position
+
+    def random_choice(self, default: Any = None) -> Any:
+        if not self._items:
+            return default
+        return self._items[random.randrange(len(self._items))]
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self._positions
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._items)
+
+
+class ExpiryHeap:
+    """
+    Min-heap of (timestamp, item) for expiring items in timestamp order.
+    Refreshed or removed items leave outdated entries behind,
+    which are skipped when they reach the top.
+    """
+
+    _heap: List[Tuple[float, Any]]
+
+    def __init__(self, get_timestamp: Callable[[Any], Optional[float]]):
+        """
+        :param get_timestamp: current timestamp of an item, None if removed
+        """
+        self._heap = []
+        self._get_timestamp = get_timestamp
+
+    def push(self, item: Any, timestamp: float, num_items: int) -> None:
+        """
+        :param num_items: amount of live items, used for compacting the heap
+        """
+        heapq.heappush(self._heap, (timestamp, item))
+        if len(self._heap) > 4 * num_items + 16:
+            self._heap = [
+                (timestamp, item)
+                for timestamp, item in self._heap
+                if self._get_timestamp(item) == timestamp
+            ]
+            heapq.heapify(self._heap)
+
+    def oldest(self) -> Optional[Tuple[float, Any]]:
+        while self._heap:
+            timestamp, item = self._heap[0]
+            if self._get_timestamp(item) == timestamp:
+                return timestamp, item
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_older_than(self, timestamp: float) -> List[Any]:
+        expired = []
+        oldest = self.oldest()
+        while oldest and oldest[0] <= timestamp:
+            heapq.heappop(self._heap)
+            expired.append(oldest[1])
+            oldest = self.oldest()
+        return expired
+
+
+class RecentPeers:
+    """
+    Fixed-capacity LRU of the peers we recently heard from, with the time they
+    were last seen. Used as fallback starting points for random walks.
+    """
+
+    _peers: "OrderedDict[Any, float]"
+
+    def __init__(self, capacity: int, max_age: float):
+        """
+        :param capacity: maximum amount of peers kept, least recent are evicted
+        :param max_age: seconds after which a peer is not considered alive
+        """
+        self._peers = OrderedDict()
+        self._capacity = capacity
+        self._max_age = max_age
+
+    def add(self, node: Any) -> None:
+        self._peers[node] = monotonic()
+        self._peers.move_to_end(node)
+        while len(self._peers) > self._capacity:
+            self._peers.popitem(last=False)
+
+    def discard(self, node: Any) -> None:
+        self._peers.pop(node, None)
+
+    def last_seen(self, node: Any) -> float:
+        return self._peers[node]
+
+    def pop(self) -> Any:
+        """
+        Remove and return the most recently seen peer.
+        :raise IndexError: no alive peer left
+        """
+        self._evict_stale()
+        if not self._peers:
+            raise IndexError("no recent peers")
+        node, _ = self._peers.popitem()
+        return node
+
+    def most_recent(self, amount: int) -> List[Any]:
+        self._evict_stale()
+        peers: List[Any] = []
+        for node in reversed(self._peers):
+            if len(peers) == amount:
+                break
+            peers.append(node)
+        return peers
+
+    def _evict_stale(self) -> None:
+        oldest_alive = monotonic() - self._max_age
+        while self._peers:
+            node, last_seen = next(iter(self._peers.items()))
+            if last_seen >= oldest_alive:
+                break
+            del self._peers[node]
+
+    def __contains__(self, node: Any) -> bool:
+        return node in self._peers
+
+    def __len__(self) -> int:
+        return len(self._peers)
+
+
+class SamplePool:
+    """
+    Walk results waiting to be selected, first in first out. Each one is
+    taken at most once, and only until it is max_age seconds old.
+    """
+
+    _samples: "deque[Tuple[Any, float]]"
+
+    def __init__(self, size: int, max_age: float):
+        """
+        :param size: amount of samples the pool is refilled up to
+        :param max_age: seconds after which a sample is discarded as stale
+        """
+        self.size = size
+        self._max_age = max_age
+        self._samples = deque()
+
+    def add(self, node: Any) -> None:
+        self._samples.append((node, monotonic() + self._max_age))
+
+    def pop(self) -> Any:
+        """
+        Remove and return the oldest sample, stale ones should be evicted first.
+        :raise IndexError: the pool is empty
+        """
+        node, _ = self._samples.popleft()
+        return node
+
+    def evict_stale(self, due: float = None) -> int:
+        """
+        :param due: expiry known to be reached, the clock may land just before it
+        :return: amount of samples evicted
+        """
+        now = monotonic() if due is None else max(monotonic(), due)
+        evicted = 0
+        while self._samples and self._samples[0][1] <= now:
+            self._samples.popleft()
+            evicted += 1
+        return evicted
+
+    def next_expiry(self) -> Optional[float]:
+        return self._samples[0][1] if self._samples else None
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class Stats:
+    """
+    Timings and counters of a Swaplink node, for upper layers' monitoring.
+    """
+
+    hbeat_rounds: "deque[HeartbeatRound]"
+    hbeat_failures: int
+    join_duration: float
+    min_degree_duration: float
+    full_degree_duration: float
+    restored_links: int
+    sample_pool_hits: int
+    sample_pool_misses: int
+    sample_pool_stale: int
+
+    def __init__(self, history: int = 100):
+        """
+        :param history: amount of latest rounds kept
+        """
+        self.hbeat_rounds = deque(maxlen=history)
+        self.hbeat_failures = 0
+        self.join_duration = None  # seconds until join returned
+        self.min_degree_duration = None  # seconds until join's min_degree
+        self.full_degree_duration = None  # seconds until num_links out-links
+        self.restored_links = 0  # out-links taken back from the snapshot
+        self.sample_pool_hits = 0  # select() calls answered from the pool
+        self.sample_pool_misses = 0  # select() calls that walked, the pool empty
+        self.sample_pool_stale = 0  # pooled samples discarded as too old
+
+    def add_hbeat_round(
+        self,
+        duration: float,
+        sent: int,
+        failed: int,
+        skipped: int = 0,
+        one_way: int = 0,
+    ) -> None:
+        """
+        :param sent: acknowledged heartbeats sent
+        :param skipped: out-links not heartbeated, as they were not idle
+        :param one_way: unacknowledged heartbeats sent
+        """
+        self.hbeat_rounds.append(
+            HeartbeatRound(duration, sent, failed, skipped, one_way)
+        )
+        self.hbeat_failures += failed
@@ -1,6 +1,44 @@
+from swaplink.data_objects import WalkMode
+
 DEFAULT_HOST = "0.0.0.0"
 DEFAULT_PORT = 5678
 DEFAULT_WALK_LENGTH = 10
+DEFAULT_WALK_MODE = WalkMode.RECURSIVE
+DEFAULT_WALK_THINNING = 2
 RPC_TIMEOUT = 2
+WALK_TIMEOUT = 4
+MAX_WALKS_IN_FLIGHT = 16
 HBEAT_CHECK_FREQUENCY = 10
 HBEAT_SEND_FREQUENCY = 2
+HBEAT_MAX_IN_FLIGHT = 32
+HBEAT_ROUND_DEADLINE = 2
+RECENT_PEERS_CAPACITY = 128
+RECENT_PEERS_MAX_AGE = 60
+LINK_REPAIR_MAX_IN_FLIGHT = 8
+LINK_REPAIR_RETRIES = 3
+LINK_REPAIR_BACKOFF = 0.1
+ADAPTIVE_WALK_LENGTH = False
+WALK_BIAS_TOLERANCE = 0.05
+MIN_WALK_LENGTH = 3
+MAX_WALK_LENGTH = 30
+WALK_LENGTH_SAMPLES = 512
+WALK_LENGTH_MIN_COLLISIONS = 8
+METRICS_ENABLED = True
+BINARY_WIRE_FORMAT = True
+WIRE_PEERS_CAPACITY = 1024
+HBEAT_ONE_WAY = False
+IN_LINK_HANDOFF_CANDIDATES = 3
+MAX_FORWARDED_WALKS = 256
+WALK_RATE_PER_PEER = 100
+WALK_BURST_PER_PEER = 200
+ADMISSION_PEERS_CAPACITY = 1024
+WALK_REJECT_RETRIES = 4
+WALK_HOP_RETRIES = 2
+SELECT_EXCLUDED_RETRIES = 16
+WALK_HOP_TIMEOUT = 0.5
+MUX_MAX_DATAGRAM = 1400
+SNAPSHOT_INTERVAL = 30
+LEAVE_DEADLINE = 2
+SAMPLE_POOL_SIZE = 0
+SAMPLE_POOL_MAX_AGE = 10
+SAMPLE_POOL_REFILL_RATE = 50
@@ -1,2 +1,30 @@
 class RPCError(Exception):
     pass
+
+
+class RPCRejected(RPCError):
+    pass
+
+
+class SelectError(Exception):
+    """
+    select() found no node, the cause is chained when there is one.
+    """
+
+    pass
+
+
+class NoPeersError(SelectError):
+    pass
+
+
+class SelectTimeoutError(SelectError):
+    pass
+
+
+class WalkFailedError(SelectError):
+    pass
+
+
+class AllExcludedError(SelectError):
+    pass
@@ -0,0 +1,209 @@
+"""
+Many Swaplink overlays on one socket: every overlay has its own protocol,
+but they share the transport, and their heartbeat rounds run together so
+that the heartbeats to a peer travel in one datagram.
+
+    host = SwaplinkHost("0.0.0.0", 5678)
+    await host.start()
+    tenant = host.add_overlay("tenant-1")
+    await tenant.join(5, [("10.0.0.2", 5678)])
+
+Peers must run a SwaplinkHost too: plain Swaplink nodes do not understand
+the overlay ids.
+"""
+
+import asyncio
+from asyncio import BaseTransport, DatagramProtocol, DatagramTransport
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Callable,
+    Awaitable,
+    Set,
+    Any,
+    Optional,
+    cast,
+)
+
+from swaplink import defaults, wire
+from swaplink.abc import ITransportFactory, IHbeatScheduler, NodeAddr
+from swaplink.core import Swaplink
+from swaplink.data_objects import Node
+from swaplink.transport import UDPTransportFactory
+
+
+class HbeatScheduler(IHbeatScheduler):
+    """
+    A single timer for the heartbeat rounds of every overlay, all of them
+    started at once.
+    """
+
+    _hbeat_rounds: Set[Callable[[], Awaitable[None]]]
+
+    def __init__(self):
+        self._hbeat_rounds = set()
+        self._task = None
+
+    def add(self, hbeat_round: Callable[[], Awaitable[None]]) -> None:
+        self._hbeat_rounds.add(hbeat_round)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def remove(self, hbeat_round: Callable[[], Awaitable[None]]) -> None:
+        self._hbeat_rounds.discard(hbeat_round)
+        if not self._hbeat_rounds and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.gather(
+                *(hbeat_round() for hbeat_round in list(self._hbeat_rounds)),
+                return_exceptions=True,  # an overlay's failure is not the others'
+            )
+            await asyncio.sleep(defaults.HBEAT_SEND_FREQUENCY)
+
+
+class SwaplinkHost(DatagramProtocol):
+    """
+    Datagrams are dispatched to the overlays by overlay id. The ones sent to
+    a peer in the same event loop iteration are batched together.
+    """
+
+    _overlays: Dict[str, DatagramProtocol]
+    _overlay_ids: Set[str]
+    _outbox: Dict[NodeAddr, List[Tuple[str, bytes]]]
+
+    def __init__(
+        self,
+        host: str = defaults.DEFAULT_HOST,
+        port: int = defaults.DEFAULT_PORT,
+        transport_factory: ITransportFactory = None,
+    ):
+        """
+        :param transport_factory: where datagrams are sent. None --> UDP sockets
+        """
+        self._node = Node(host, port)
+        self._transport_factory = transport_factory or UDPTransportFactory()
+        self._transport: Optional[DatagramTransport] = None
+        self._overlays = {}
+        self._overlay_ids = set()  # added, joined or not
+        self._outbox = {}
+        self._hbeat_scheduler = HbeatScheduler()
+        self.datagrams_sent = 0
+        self.frames_sent = 0  # datagrams of the overlays, before batching
+
+    async def start(self) -> None:
+        await self._transport_factory.create_endpoint(lambda: self, self._node)
+
+    def close(self) -> None:
+        """
+        The overlays should leave first.
+        """
+        if self._transport is not None:
+            self._transport.close()
+
+    def add_overlay(self, overlay_id: str, **swaplink_kwargs: Any) -> Swaplink:
+        """
+        :param swaplink_kwargs: passed on to Swaplink
+        :return: node of the overlay, to be joined as any Swaplink
+        """
+        if overlay_id in self._overlay_ids:
+            raise ValueError(f"overlay {overlay_id} already added")
+        if len(overlay_id.encode()) > 255:
+            raise ValueError(f"overlay id too long: {overlay_id}")
+        self._overlay_ids.add(overlay_id)
+        return Swaplink(
+            self._node.host,
+            self._node.port,
+            transport_factory=_OverlayEndpoints(self, overlay_id),
+            hbeat_scheduler=self._hbeat_scheduler,
+            **swaplink_kwargs,
+        )
+
+    def overlays(self) -> List[str]:
+        return list(self._overlays)
+
+    def connection_made(self, transport: BaseTransport) -> None:
+        self._transport = cast(DatagramTransport, transport)
+
+    def datagram_received(self, data: bytes, addr: NodeAddr) -> None:
+        try:
+            frames = wire.decode_batch(data)
+        except wire.MalformedMessage:
+            return
+        for overlay_id, datagram in frames:
+            protocol = self._overlays.get(overlay_id)
+            if protocol is not None:
+                protocol.datagram_received(datagram, addr)
+
+    def _open(self, overlay_id: str, protocol: DatagramProtocol) -> "_OverlayTransport":
+        if overlay_id in self._overlays:
+            raise ValueError(f"overlay {overlay_id} already open")
+        transport = _OverlayTransport(self, overlay_id)
+        self._overlays[overlay_id] = protocol
+        protocol.connection_made(transport)
+        return transport
+
+    def _close(self, overlay_id: str) -> None:
+        self._overlay_ids.discard(overlay_id)
+        protocol = self._overlays.pop(overlay_id, None)
+        if protocol is not None:
+            asyncio.get_event_loop().call_soon(protocol.connection_lost, None)
+
+    def _send(self, overlay_id: str, data: bytes, addr: NodeAddr) -> None:
+        if not self._outbox:
+            asyncio.get_event_loop().call_soon(self._flush)
+        self._outbox.setdefault(Node(*addr[:2]), []).append((overlay_id, data))
+
+    def _flush(self) -> None:
+        outbox, self._outbox = self._outbox, {}
+        if self._transport is None or self._transport.is_closing():
+            return
+        for addr, frames in outbox.items():
+            for batch in wire.encode_batches(frames, defaults.MUX_MAX_DATAGRAM):
+                self._transport.sendto(batch, addr)
+                self.datagrams_sent += 1
+            self.frames_sent += len(frames)
+
+
+class _OverlayEndpoints(ITransportFactory):
+    def __init__(self, host: SwaplinkHost, overlay_id: str):
+        self._host = host
+        self._overlay_id = overlay_id
+
+    async def create_endpoint(
+        self, protocol_factory: Callable[[], DatagramProtocol], local_addr: NodeAddr
+    ) -> Tuple[DatagramTransport, DatagramProtocol]:
+        protocol = protocol_factory()
+        return self._host._open(self._overlay_id, protocol), protocol
+
+
+class _OverlayTransport(DatagramTransport):
+    def __init__(self, host: SwaplinkHost, overlay_id: str):
+        super().__init__()
+        self._host = host
+        self._overlay_id = overlay_id
+        self._closing = False
+
+    def sendto(self, data: wire.Buffer, addr: Any = None) -> None:
+        if not self._closing:
+            self._host._send(self._overlay_id, bytes(data), addr)
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        if name == "sockname":
+            return self._host._node
+        return default
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._host._close(self._overlay_id)
+
+    def abort(self) -> None:
+        self.close()
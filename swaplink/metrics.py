@@ -0,0 +1,216 @@
+import asyncio
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Tuple, List, Any, Iterable, Optional
+
+from swaplink.abc import IWalkTracer, NodeAddr
+from swaplink.data_objects import Node, WalkEvent
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+HOPS_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30)
+BUCKETS = {
+    "rpc_duration_seconds": LATENCY_BUCKETS,
+    "walk_duration_seconds": LATENCY_BUCKETS,
+    "hbeat_round_duration_seconds": LATENCY_BUCKETS,
+    "walk_hops": HOPS_BUCKETS,
+}
+
+HELP = {
+    "rpc_calls": "RPCs sent, by type",
+    "rpc_timeouts": "RPCs left without response, by type",
+    "rpc_duration_seconds": "Round-trip time of answered RPCs, by type",
+    "walks": "Random walks started by this node, by result",
+    "walk_duration_seconds": "Time until a started walk returned its samples",
+    "walk_hops": "Hops walked by the walks ending at this node",
+    "link_changes": "Links added or removed, by type",
+    "hbeat_round_duration_seconds": "Duration of the out-links heartbeat rounds",
+    "hbeats": "Out-link heartbeats, by kind: acked, one-way or skipped as not idle",
+    "select_failures": "select() calls that found no node",
+    "in_link_handoffs": "give_me_in_node requests served, by result",
+    "walks_rejected": "Incoming walks rejected by admission control, by reason",
+    "leave_splices": "In-link peers given an out-link peer on leave, by result",
+    "sample_pool": "select() calls answered from the pool or not, and stale samples",
+}
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        """
+        :param buckets: upper bounds; values above the last one go to +Inf
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[Tuple[float, int]]:
+        """
+        :return: (upper bound, observations up to it) pairs, ending with +Inf
+        """
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Metrics:
+    """
+    Counters and histograms of a Swaplink node, addressed by name and labels.
+    """
+
+    counters: Dict[str, Dict[Labels, float]]
+    histograms: Dict[str, Dict[Labels, Histogram]]
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(BUCKETS.get(name, LATENCY_BUCKETS))
+        histogram.observe(value)
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self.counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self.histograms.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        :return: every series as plain data, e.g. for JSON
+        """
+        return {
+            "counters": {
+                name: [
+                    {"labels": dict(key), "value": value}
+                    for key, value in series.items()
+                ]
+                for name, series in self.counters.items()
+            },
+            "histograms": {
+                name: [
+                    {
+                        "labels": dict(key),
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "buckets": histogram.cumulative_counts(),
+                    }
+                    for key, histogram in series.items()
+                ]
+                for name, series in self.histograms.items()
+            },
+        }
+
+
+def to_prometheus(metrics: Metrics, namespace: str = "swaplink") -> str:
+    """
+    Render the metrics in Prometheus' text exposition format.
+    """
+    lines = []
+    for name, counter_series in sorted(metrics.counters.items()):
+        full_name = f"{namespace}_{name}_total"
+        lines.append(f"# HELP {full_name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full_name} counter")
+        for key, value in counter_series.items():
+            lines.append(f"{full_name}{_format_labels(key)} {value}")
+    for name, histogram_series in sorted(metrics.histograms.items()):
+        full_name = f"{namespace}_{name}"
+        lines.append(f"# HELP {full_name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full_name} histogram")
+        for key, histogram in histogram_series.items():
+            for bound, count in histogram.cumulative_counts():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(key + (("le", le),))
+                lines.append(f"{full_name}_bucket{labels} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(key)} {histogram.sum}")
+            lines.append(f"{full_name}_count{_format_labels(key)} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+async def serve_prometheus(
+    metrics: Metrics, host: str = "0.0.0.0", port: int = 9100
+) -> asyncio.AbstractServer:
+    """
+    Answer every HTTP request with the metrics, for Prometheus to scrape.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        body = to_prometheus(metrics).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body
+        )
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class WalkRecorder(IWalkTracer):
+    """
+    Keeps the events of the latest walks seen by a node, by walk id.
+    """
+
+    walks: "OrderedDict[int, List[WalkEvent]]"
+
+    def __init__(self, capacity: int = 1000):
+        """
+        :param capacity: amount of walks kept, the oldest ones are forgotten
+        """
+        self.walks = OrderedDict()
+        self._capacity = capacity
+
+    def on_walk_start(self, walk_id: int, start_node: NodeAddr) -> None:
+        self._record(walk_id, WalkEvent("start", start_node, 0, None))
+
+    def on_walk_hop(
+        self, walk_id: int, node: NodeAddr, index: int, next_hop: NodeAddr
+    ) -> None:
+        self._record(walk_id, WalkEvent("hop", node, index, next_hop))
+
+    def on_walk_end(
+        self, walk_id: int, samples: Optional[List[Node]], error: Exception = None
+    ) -> None:
+        self._record(walk_id, WalkEvent("end", None, None, samples or error))
+
+    def _record(self, walk_id: int, event: WalkEvent) -> None:
+        events = self.walks.get(walk_id)
+        if events is None:
+            events = self.walks[walk_id] = []
+            if len(self.walks) > self._capacity:
+                self.walks.popitem(last=False)
+        events.append(event)
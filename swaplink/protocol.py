@@ -1,32 +1,128 @@
-from collections import deque
-from typing import Any, Tuple
+import asyncio
+import os
+import random
+from typing import (
+    Any,
+    Tuple,
+    Dict,
+    List,
+    Awaitable,
+    Callable,
+    Optional,
+    Union,
+    NewType,
+)
 
+import umsgpack
 from rpcudp.protocol import RPCProtocol
 
 from swaplink import defaults
-from swaplink.abc import ISwaplinkProtocol, LinkType, Node, NodeAddr, ILinkStore
-from swaplink.errors import RPCError
-from swaplink.utils import random_choice_safe
+from swaplink.abc import (
+    ISwaplinkProtocol,
+    LinkType,
+    Node,
+    NodeAddr,
+    ILinkStore,
+    IWalkTracer,
+)
+from swaplink import wire
+from swaplink.admission import AdmissionControl
+from swaplink.data_objects import RecentPeers
+from swaplink.errors import RPCError, RPCRejected
+from swaplink.metrics import Metrics
+from swaplink.utils import monotonic
+
+# answer to the walks a hop is too loaded to take or cannot continue. Only
+# the peers known to speak the binary format get it: the others would take
+# it for a node, so their request is dropped and times out instead
+Rejected = NewType("Rejected", str)
+REJECTED = Rejected("rejected")
+
+
+class _NoReply(Exception):
+    """
+    Raised by an rpc handler whose request must not be answered.
+    """
+
+    pass
 
 
 class SwaplinkProtocol(RPCProtocol, ISwaplinkProtocol):
     _origin_node: Node
     _link_store: ILinkStore
-    _links_queue: deque
+    _recent_peers: RecentPeers
     _num_links: int
+    _pending_walks: Dict[int, asyncio.Future]
 
     def __init__(
         self,
         origin_node: Node,
         link_store: ILinkStore,
-        links_queue: deque,
+        recent_peers: RecentPeers,
         num_links: int,
+        metrics: Metrics = None,
+        walk_tracer: IWalkTracer = None,
+        binary_wire: bool = defaults.BINARY_WIRE_FORMAT,
+        admission: AdmissionControl = None,
     ):
+        """
+        :param metrics: where calls, walks and timeouts are counted. None --> off
+        :param walk_tracer: receives the events of the walks. None --> off
+        :param binary_wire: talk the compact binary format to the peers that
+         understand it, msgpack to the rest. False --> always msgpack
+        :param admission: which incoming walks are taken. None --> defaults
+        """
         RPCProtocol.__init__(self, defaults.RPC_TIMEOUT)
         self._origin_node = origin_node
         self._link_store = link_store
-        self._links_queue = links_queue
+        self._recent_peers = recent_peers
         self._num_links = num_links
+        self._metrics = metrics
+        self._walk_tracer = walk_tracer
+        self._binary_wire = binary_wire
+        self._peer_versions = wire.PeerVersions(defaults.WIRE_PEERS_CAPACITY)
+        self._pending_walks = {}
+        self._admission = admission or AdmissionControl()
+        self._handoffs: Dict[Node, asyncio.Future] = {}
+
+    def datagram_received(self, data: bytes, addr: NodeAddr) -> None:
+        if wire.is_binary(data):
+            if self._binary_wire:
+                self._solve_binary_datagram(data, addr)
+            return
+        if wire.is_marked_request(data):
+            self._peer_versions.add(Node(*addr[:2]))
+        super().datagram_received(data, addr)
+
+    async def _accept_request(
+        self, msg_id: bytes, data: Any, address: NodeAddr
+    ) -> None:
+        try:
+            await super()._accept_request(msg_id, data, address)
+        except _NoReply:
+            pass
+
+    async def _solve_datagram(self, datagram: bytes, address: NodeAddr) -> None:
+        """
+        rpcudp's, but undecodable datagrams are dropped before they count as
+        a sign of life from the sender.
+        """
+        if len(datagram) < 22 or datagram[:1] not in (b"\x00", b"\x01"):
+            return
+        msg_id = datagram[1:21]
+        try:
+            data = umsgpack.unpackb(datagram[21:])
+        except umsgpack.UnpackException:
+            return
+        self._refresh_sender(address)
+        if datagram[:1] == b"\x00":
+            asyncio.ensure_future(self._accept_request(msg_id, data, address))
+        else:
+            self._accept_response(msg_id, data, address)
+
+    def connection_lost(self, exc: Exception) -> None:
+        for handoff in list(self._handoffs.values()):
+            handoff.cancel()
 
     # Calls
     async def call_random_walk(
@@ -36,28 +132,175 @@ class SwaplinkProtocol(RPCProtocol, ISwaplinkProtocol):
         limit: int,
         link_type: LinkType,
         walk_initiator: Node = None,
+        walk_id: int = None,
+        timeout: float = None,
     ) -> Node:
-        if not walk_initiator:
-            walk_initiator = self._origin_node
-        result = await self.random_walk(
-            node_to_ask, walk_initiator, index, limit, link_type
+        """
+        :param timeout: seconds the walk may take. None --> WALK_TIMEOUT
+        """
+        timeout = timeout or defaults.WALK_TIMEOUT
+        if walk_initiator:  # a hop of someone else's walk
+            random_node = await self._call(
+                "random_walk",
+                node_to_ask,
+                *self._random_walk_args(
+                    node_to_ask,
+                    (walk_initiator, index, limit, link_type),
+                    walk_id,
+                    _to_ms(timeout),
+                ),
+                timeout=timeout,
+            )
+            return Node(*random_node)
+
+        async def walk() -> List[Node]:
+            random_node = await self._call(
+                "random_walk",
+                node_to_ask,
+                *self._random_walk_args(
+                    node_to_ask,
+                    (self._origin_node, index, limit, link_type),
+                    walk_id,
+                    _to_ms(timeout),
+                ),
+                timeout=timeout,
+            )
+            return [Node(*random_node)]
+
+        if walk_id is None:
+            walk_id = random.getrandbits(64)
+        samples = await self._traced_walk(walk_id, node_to_ask, walk())
+        return samples[0]
+
+    async def call_forward_walk(
+        self, node_to_ask: Node, limit: int, link_type: LinkType, timeout: float = None
+    ) -> Node:
+        """
+        One-way random walk: every hop forwards the walk token and the last node
+        sends its address straight to us, matched by the walk id. Older nodes
+        get a recursive random_walk instead.
+        """
+        samples = await self.call_forward_sample_walk(
+            node_to_ask, limit, 1, 1, link_type, timeout
         )
-        random_node = self._handle_call_response(result, node_to_ask)
-        return Node(*random_node)
+        return samples[0]
+
+    async def call_sample_walk(
+        self,
+        node_to_ask: Node,
+        burn_in: int,
+        thinning: int,
+        num_samples: int,
+        link_type: LinkType,
+        timeout: float = None,
+    ) -> List[Node]:
+        """
+        Random walk that collects every thinning-th node once burn_in hops
+        have been walked, until it has num_samples nodes. Older nodes do not
+        know sample_walk: they are walked for a single sample.
+        """
+        timeout = timeout or defaults.WALK_TIMEOUT
+        if not self._speaks_current(node_to_ask):
+            return [
+                await self.call_random_walk(
+                    node_to_ask, 0, burn_in, link_type, timeout=timeout
+                )
+            ]
+
+        async def walk() -> List[Node]:
+            samples = await self._call(
+                "sample_walk",
+                node_to_ask,
+                self._origin_node,
+                0,
+                burn_in,
+                thinning,
+                num_samples,
+                link_type,
+                [],
+                walk_id,
+                _to_ms(timeout),
+                timeout=timeout,
+            )
+            return [Node(*sample) for sample in samples]
 
-    async def call_give_me_in_node(self, node_to_ask: Node) -> None:
-        result = await self.give_me_in_node(node_to_ask)
-        self._handle_call_response(result, node_to_ask)
+        walk_id = random.getrandbits(64)
+        return await self._traced_walk(walk_id, node_to_ask, walk())
+
+    async def call_forward_sample_walk(
+        self,
+        node_to_ask: Node,
+        burn_in: int,
+        thinning: int,
+        num_samples: int,
+        link_type: LinkType,
+        timeout: float = None,
+    ) -> List[Node]:
+        timeout = timeout or defaults.WALK_TIMEOUT
+        if not self._speaks_current(node_to_ask):
+            return [
+                await self.call_random_walk(
+                    node_to_ask, 0, burn_in, link_type, timeout=timeout
+                )
+            ]
+
+        async def walk() -> List[Node]:
+            future = asyncio.get_event_loop().create_future()
+            self._pending_walks[walk_id] = future
+            try:
+                await self._call(
+                    "forward_walk",
+                    node_to_ask,
+                    walk_id,
+                    self._origin_node,
+                    0,
+                    burn_in,
+                    link_type,
+                    thinning,
+                    num_samples,
+                    [],
+                    timeout=defaults.WALK_HOP_TIMEOUT,  # acknowledged at once
+                )
+                samples = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                if self._metrics is not None:
+                    self._metrics.inc("rpc_timeouts", rpc="walk_result")
+                raise RPCError
+            finally:
+                del self._pending_walks[walk_id]
+            if not samples:  # the walk broke on its way
+                raise RPCError
+            return [Node(*sample) for sample in samples]
+
+        walk_id = random.getrandbits(64)
+        return await self._traced_walk(walk_id, node_to_ask, walk())
+
+    async def call_give_me_in_node(self, node_to_ask: Node) -> bool:
+        given = await self._call("give_me_in_node", node_to_ask)
+        return given is not False  # older nodes answer None
 
     async def call_change_your_out_node(
         self, node_to_ask: Node, new_in_node: Node
-    ) -> None:
-        result = await self.change_your_out_node(node_to_ask, new_in_node)
-        self._handle_call_response(result, node_to_ask)
+    ) -> bool:
+        changed = await self._call("change_your_out_node", node_to_ask, new_in_node)
+        return changed is not False  # older nodes answer None
 
     async def call_im_your_in_node(self, node_to_ask: Node) -> None:
-        result = await self.im_your_in_node(node_to_ask)
-        self._handle_call_response(result, node_to_ask)
+        await self._call("im_your_in_node", node_to_ask)
+
+    def notify_im_your_in_node(self, node_to_notify: Node) -> bool:
+        node_to_notify = Node(*node_to_notify)
+        if not (
+            self._binary_wire and self._peer_versions.supports_binary(node_to_notify)
+        ):
+            return False
+        data = wire.encode_request("hbeat", 0, (), in_node=True)
+        self.transport.sendto(data, node_to_notify)
+        self._link_store.announce_out_link(node_to_notify)
+        return True
+
+    async def call_goodbye(self, node_to_notify: Node) -> None:
+        await self._call("goodbye", node_to_notify)
 
     # RPCs
     async def rpc_random_walk(
@@ -67,70 +310,660 @@ class SwaplinkProtocol(RPCProtocol, ISwaplinkProtocol):
         index: int,
         limit: int,
         link_type: LinkType,
-    ) -> NodeAddr:
-        random_node: Node
-        self._add_sender_to_queue(sender)
-        if index >= limit:
-            return self._origin_node
-        if link_type == LinkType.IN:
-            random_node = random_choice_safe(
-                self._link_store.get_in_links_copy(), self._origin_node
+        walk_id: int = None,
+        timeout_ms: int = None,
+    ) -> Union[NodeAddr, Rejected]:
+        """
+        :param timeout_ms: when the sender gives up. None --> RPC_TIMEOUT
+        """
+        deadline = self._walk_deadline(timeout_ms)
+        self._add_sender_to_recent_peers(sender)
+        if self._reject_walk(sender):
+            return self._rejection(sender)
+        try:
+            random_node = self._next_walk_hop(
+                sender, walk_initiator, index, limit, link_type
             )
-        else:
-            random_node = random_choice_safe(
-                self._link_store.get_out_links_copy(), self._origin_node
+            self._record_hop(walk_id, index, random_node)
+            if not random_node:
+                return self._origin_node
+            return await self._call_next_hop(
+                "random_walk",
+                random_node,
+                self._walk_redraw(
+                    sender, walk_initiator, walk_id, index, limit, link_type
+                ),
+                deadline,
+                limit - index,
+                walk_initiator,
+                index + 1,
+                limit,
+                link_type,
+                walk_id=walk_id,
+            )
+        except RPCError:
+            return self._rejection(sender)
+        finally:
+            self._admission.release()
+
+    async def rpc_sample_walk(
+        self,
+        sender: NodeAddr,
+        walk_initiator: NodeAddr,
+        index: int,
+        burn_in: int,
+        thinning: int,
+        num_samples: int,
+        link_type: LinkType,
+        samples: List[NodeAddr],
+        walk_id: int = None,
+        timeout_ms: int = None,
+    ) -> Union[List[NodeAddr], Rejected]:
+        deadline = self._walk_deadline(timeout_ms)
+        limit = self._sample_walk_limit(burn_in, thinning, num_samples)
+        self._add_sender_to_recent_peers(sender)
+        if self._reject_walk(sender):
+            return self._rejection(sender)
+        try:
+            collected, random_node = self._sample_walk_step(
+                sender,
+                walk_initiator,
+                index,
+                burn_in,
+                thinning,
+                num_samples,
+                link_type,
+                samples,
+            )
+            self._record_hop(walk_id, index, random_node)
+            if not random_node:
+                return collected
+            return await self._call_next_hop(
+                "sample_walk",
+                random_node,
+                self._walk_redraw(
+                    sender, walk_initiator, walk_id, index, limit, link_type
+                ),
+                deadline,
+                limit - index,
+                walk_initiator,
+                index + 1,
+                burn_in,
+                thinning,
+                num_samples,
+                link_type,
+                collected,
+                walk_id,
+            )
+        except RPCError:
+            return self._rejection(sender)
+        finally:
+            self._admission.release()
+
+    async def rpc_forward_walk(
+        self,
+        sender: NodeAddr,
+        walk_id: int,
+        walk_initiator: NodeAddr,
+        index: int,
+        limit: int,
+        link_type: LinkType,
+        thinning: int = 1,
+        num_samples: int = 1,
+        samples: List[NodeAddr] = None,
+    ) -> Union[bool, Rejected]:
+        """
+        limit works as the burn-in when several samples are collected.
+        """
+        self._add_sender_to_recent_peers(sender)
+        if self._reject_walk(sender):
+            return self._rejection(sender)
+        asyncio.ensure_future(
+            self._forward_walk(
+                sender,
+                walk_id,
+                Node(*walk_initiator),
+                index,
+                limit,
+                thinning,
+                num_samples,
+                link_type,
+                samples or [],
             )
-        if random_node in {self._origin_node, sender, tuple(walk_initiator)}:
-            return self._origin_node
-        result_node = await self.call_random_walk(
-            random_node, index + 1, limit, link_type, walk_initiator
         )
-        return result_node
+        return True
 
-    async def rpc_give_me_in_node(self, sender: NodeAddr) -> None:
-        self._add_sender_to_queue(sender)
-        in_node_given = False
-        while not in_node_given:
-            try:
-                random_in_node = random_choice_safe(
-                    self._link_store.get_in_links_copy(), self._origin_node
+    async def rpc_walk_result(
+        self, sender: NodeAddr, walk_id: int, samples: List[NodeAddr]
+    ) -> None:
+        self._add_sender_to_recent_peers(sender)
+        future = self._pending_walks.get(walk_id)
+        if future and not future.done():
+            future.set_result(samples)
+
+    async def rpc_give_me_in_node(self, sender: NodeAddr) -> bool:
+        """
+        Answered at once: the in-link is handed off in the background.
+        :return: whether there was an in-link to hand off
+        """
+        self._add_sender_to_recent_peers(sender)
+        sender = Node(*sender)
+        candidates = [
+            in_link
+            for in_link in self._link_store.get_in_links_copy()
+            if in_link not in {self._origin_node, sender}
+        ]
+        if not candidates:
+            self._count_handoff("no_candidate")
+            return False
+        if sender not in self._handoffs:  # else: a retried request
+            random.shuffle(candidates)
+            handoff = asyncio.ensure_future(
+                self._hand_off_in_link(
+                    sender, candidates[: defaults.IN_LINK_HANDOFF_CANDIDATES]
                 )
-                if random_in_node not in {self._origin_node, sender}:
-                    await self.call_change_your_out_node(random_in_node, Node(*sender))
-                in_node_given = True
-            except RPCError:
-                pass
+            )
+            self._handoffs[sender] = handoff
+            handoff.add_done_callback(lambda _: self._handoffs.pop(sender, None))
+        return True
 
     async def rpc_change_your_out_node(
         self, sender: NodeAddr, new_out_node: NodeAddr
-    ) -> None:
-        self._add_sender_to_queue(sender)
+    ) -> bool:
+        """
+        :return: whether new_out_node is a new out-link, False if it already
+         was one, it did not answer, or we are not the sender's in-node and
+         have no room for another out-link
+        """
+        self._add_sender_to_recent_peers(sender)
         new_out_node = Node(*new_out_node)
         old_out_node = Node(*sender)
         if sender == self._origin_node:
-            return
-        if (
-            self._link_store.contains_out_link(old_out_node)
-            and not len(self._link_store.get_out_links_copy()) < self._num_links
-        ):
+            return False
+        is_new = not self._link_store.contains_out_link(new_out_node)
+        if not self._link_store.num_out_links() < self._num_links:
+            if not self._link_store.contains_out_link(old_out_node):
+                return False  # a stale in-link of the sender: no room for it
             self._link_store.remove_out_link(old_out_node)
-        await self.call_im_your_in_node(new_out_node)
+        try:
+            await self.call_im_your_in_node(new_out_node)
+        except RPCError:
+            return False
         self._link_store.add_out_link(new_out_node)
+        return is_new
 
     async def rpc_im_your_in_node(self, sender: NodeAddr) -> None:
-        self._add_sender_to_queue(sender)
+        self._add_sender_to_recent_peers(sender)
         if sender != self._origin_node:
             self._link_store.add_in_link(Node(*sender))
 
-    def _handle_call_response(self, result: Tuple[int, Any], node: Node) -> Any:
+    async def rpc_hbeat(self, sender: NodeAddr) -> None:
+        """
+        One-way im_your_in_node: nothing is answered.
+        """
+        await self.rpc_im_your_in_node(sender)
+
+    async def rpc_goodbye(self, sender: NodeAddr) -> None:
+        """
+        The sender leaves: its links are dropped now, not when they expire.
+        """
+        sender = Node(*sender)
+        self._link_store.remove_link(sender)
+        self._recent_peers.discard(sender)
+
+    async def _hand_off_in_link(
+        self, new_out_node: Node, candidates: List[Node]
+    ) -> bool:
+        """
+        Ask the candidate in-links, one after another, to take new_out_node
+        as out-link instead of us, until one of them does.
+        """
+        for candidate in candidates:
+            if not self._link_store.contains_in_link(candidate):
+                continue  # expired meanwhile
+            try:
+                if not await self.call_change_your_out_node(candidate, new_out_node):
+                    continue  # no room, or it already links to new_out_node
+            except RPCError:
+                continue
+            self._count_handoff("given")
+            return True
+        self._count_handoff("failed")
+        return False
+
+    def _count_handoff(self, result: str) -> None:
+        if self._metrics is not None:
+            self._metrics.inc("in_link_handoffs", result=result)
+
+    async def _forward_walk(
+        self,
+        sender: NodeAddr,
+        walk_id: int,
+        walk_initiator: Node,
+        index: int,
+        burn_in: int,
+        thinning: int,
+        num_samples: int,
+        link_type: LinkType,
+        samples: List[NodeAddr],
+    ) -> None:
+        try:  # malformed samples raise: the walk must be released anyway
+            collected, random_node = self._sample_walk_step(
+                sender,
+                walk_initiator,
+                index,
+                burn_in,
+                thinning,
+                num_samples,
+                link_type,
+                samples,
+            )
+            self._record_hop(walk_id, index, random_node)
+            if not random_node:
+                await self._request("walk_result", walk_initiator, walk_id, collected)
+                return
+            await self._call_next_hop(
+                "forward_walk",
+                random_node,
+                self._walk_redraw(
+                    sender,
+                    walk_initiator,
+                    walk_id,
+                    index,
+                    self._sample_walk_limit(burn_in, thinning, num_samples),
+                    link_type,
+                ),
+                None,
+                1,
+                walk_id,
+                walk_initiator,
+                index + 1,
+                burn_in,
+                link_type,
+                thinning,
+                num_samples,
+                collected,
+            )
+        except RPCError:
+            await self._request("walk_result", walk_initiator, walk_id, None)
+        finally:
+            self._admission.release()
+
+    def _reject_walk(self, sender: NodeAddr) -> bool:
+        """
+        Whether admission control rejects the sender's walk. Otherwise the
+        walk must be released once handled.
+        """
+        reason = self._admission.try_admit(Node(*sender))
+        if reason is None:
+            return False
+        if self._metrics is not None:
+            self._metrics.inc("walks_rejected", reason=reason)
+        return True
+
+    def _rejection(self, sender: NodeAddr) -> Rejected:
+        """
+        :raise _NoReply: the sender may not understand REJECTED
+        """
+        if not self._speaks_current(sender):
+            raise _NoReply
+        return REJECTED
+
+    def _walk_redraw(
+        self,
+        sender: NodeAddr,
+        walk_initiator: NodeAddr,
+        walk_id: int,
+        index: int,
+        limit: int,
+        link_type: LinkType,
+    ) -> Callable[[], Node]:
+        """
+        :return: draws another next hop for the walk, None if there is none
+        """
+
+        def redraw() -> Node:
+            next_hop = self._next_walk_hop(
+                sender, walk_initiator, index, limit, link_type
+            )
+            if next_hop:
+                self._record_hop(walk_id, index, next_hop)
+            return next_hop
+
+        return redraw
+
+    async def _call_next_hop(
+        self,
+        rpc: str,
+        next_hop: Node,
+        redraw: Callable[[], Node],
+        deadline: Optional[float],
+        round_trips: int,
+        *args: Any,
+        walk_id: int = None,
+    ) -> Any:
+        """
+        Call the rpc on a walk's next hop. If the hop rejects the walk, another
+        one is drawn, up to WALK_REJECT_RETRIES times. If it does not answer in
+        time, up to WALK_HOP_RETRIES times.
+        Older nodes only take random_walk, with the baseline arguments.
+        :param deadline: when our caller gives up on us, its share of the time
+         is passed on as the rpc's last argument. None --> the hop answers at
+         once (forwarding mode) and gets WALK_HOP_TIMEOUT
+        :param round_trips: hops the rpc waits for, counting the next one
+        :param walk_id: random_walk's, passed on with the time share
+        :raise RPCError: no hop could continue the walk
+        """
+        rejections = failures = 0
+        while True:
+            if deadline is None:
+                timeout = defaults.WALK_HOP_TIMEOUT
+            else:
+                # keep a share of the time left to try another hop and answer
+                timeout = (deadline - monotonic()) * round_trips / (round_trips + 1)
+                if timeout <= 0:
+                    raise RPCError
+            try:
+                if rpc == "random_walk":
+                    hop_args = self._random_walk_args(
+                        next_hop, args, walk_id, _to_ms(timeout)
+                    )
+                elif not self._speaks_current(next_hop):
+                    raise RPCError  # unknown to older nodes, do not wait for them
+                elif deadline is None:
+                    hop_args = args
+                else:
+                    hop_args = (*args, _to_ms(timeout))
+                return await self._call(
+                    rpc,
+                    next_hop,
+                    *hop_args,
+                    timeout=timeout,
+                    # out of our caller's budget, the hop may just be slow
+                    keep_link=deadline is not None and timeout < self._wait_timeout,
+                )
+            except RPCRejected:
+                rejections += 1  # answered at once, cheaper to retry
+                if rejections > defaults.WALK_REJECT_RETRIES:
+                    raise
+                next_hop = redraw()
+                if next_hop is None:
+                    raise
+            except RPCError:
+                failures += 1
+                if failures > defaults.WALK_HOP_RETRIES:
+                    raise
+                next_hop = redraw()
+                if next_hop is None:
+                    raise
+
+    def _random_walk_args(
+        self, node: NodeAddr, args: Tuple[Any, ...], walk_id: int, timeout_ms: int
+    ) -> Tuple[Any, ...]:
+        """
+        :param args: the baseline ones: walk_initiator, index, limit, link_type
+        :return: random_walk's arguments, walk_id and timeout_ms only for the
+         nodes known to take them
+        """
+        if not self._speaks_current(node):
+            return args
+        return (*args, walk_id, timeout_ms)
+
+    def _speaks_current(self, node: NodeAddr) -> bool:
+        """
+        Whether the node is known to run this version, so it takes the rpcs and
+        arguments older nodes do not. Peers not heard from yet are taken for
+        older ones.
+        """
+        return self._peer_versions.supports_binary(Node(*node[:2]))
+
+    def _walk_deadline(self, timeout_ms: Optional[int]) -> float:
+        if timeout_ms is None:  # older nodes wait as long as any rpc
+            return monotonic() + self._wait_timeout
+        return monotonic() + timeout_ms / 1000
+
+    @staticmethod
+    def _sample_walk_limit(burn_in: int, thinning: int, num_samples: int) -> int:
+        return burn_in + (num_samples - 1) * thinning
+
+    def _sample_walk_step(
+        self,
+        sender: NodeAddr,
+        walk_initiator: NodeAddr,
+        index: int,
+        burn_in: int,
+        thinning: int,
+        num_samples: int,
+        link_type: LinkType,
+        samples: List[NodeAddr],
+    ) -> Tuple[List[NodeAddr], Node]:
+        """
+        Add this node to the samples if it is due and choose where the walk goes.
+        :return: samples collected so far and next hop (None if the walk ends here)
+        """
+        collected: List[NodeAddr] = [Node(*sample) for sample in samples]
+        if index >= burn_in and (index - burn_in) % thinning == 0:
+            collected.append(self._origin_node)
+        limit = self._sample_walk_limit(burn_in, thinning, num_samples)
+        random_node = self._next_walk_hop(
+            sender, walk_initiator, index, limit, link_type
+        )
+        if not random_node and (not collected or collected[-1] != self._origin_node):
+            collected.append(self._origin_node)  # dead end: the walk stops here
+        return collected, random_node
+
+    def _next_walk_hop(
+        self,
+        sender: NodeAddr,
+        walk_initiator: NodeAddr,
+        index: int,
+        limit: int,
+        link_type: LinkType,
+    ) -> Node:
+        """
+        Choose where the walk goes next.
+        :return: next hop, or None if the walk must end on this node
+        """
+        if index >= limit:
+            return None
+        if link_type == LinkType.IN:
+            random_node = self._link_store.random_in_link(self._origin_node)
+        else:
+            random_node = self._link_store.random_out_link(self._origin_node)
+        if random_node in {self._origin_node, tuple(sender), tuple(walk_initiator)}:
+            return None
+        return random_node
+
+    async def _call(
+        self,
+        rpc: str,
+        node_to_ask: Node,
+        *args: Any,
+        timeout: float = None,
+        keep_link: bool = False,
+    ) -> Any:
+        """
+        Call the rpc on the node and count it.
+        :param timeout: seconds to wait for the answer. None --> RPC_TIMEOUT
+        :param keep_link: whether the node's links are kept when it does not
+         answer, e.g. because the timeout was too short to tell it is dead
+        :raise RPCError: the node did not answer
+        """
+        if self._metrics is None:
+            result = await self._request(rpc, node_to_ask, *args, timeout=timeout)
+            return self._handle_call_response(result, node_to_ask, keep_link)
+        call_start = monotonic()
+        result = await self._request(rpc, node_to_ask, *args, timeout=timeout)
+        self._metrics.inc("rpc_calls", rpc=rpc)
+        if result[0]:
+            duration = monotonic() - call_start
+            self._metrics.observe("rpc_duration_seconds", duration, rpc=rpc)
+        else:
+            self._metrics.inc("rpc_timeouts", rpc=rpc)
+        return self._handle_call_response(result, node_to_ask, keep_link)
+
+    def _request(
+        self, rpc: str, address: NodeAddr, *args: Any, timeout: float = None
+    ) -> asyncio.Future:
+        """
+        Send the request in the binary format if the peer understands it,
+        otherwise in rpcudp's msgpack envelope with a marked message id.
+        :param timeout: seconds to wait for the answer. None --> RPC_TIMEOUT
+        :return: future of (whether it was answered, result)
+        """
+        address = Node(*address)
+        if rpc == "im_your_in_node":
+            self._link_store.announce_out_link(address)
+        if self._binary_wire and self._peer_versions.supports_binary(address):
+            msg_id = random.getrandbits(32)
+            while msg_id in self._outstanding:
+                msg_id = random.getrandbits(32)
+            in_node = self._link_store.contains_out_link(address)
+            try:
+                data = wire.encode_request(rpc, msg_id, args, in_node)
+            except wire.MalformedMessage:
+                pass  # e.g. an rpc without opcode: msgpack handles anything
+            else:
+                self.transport.sendto(data, address)
+                if in_node:
+                    self._link_store.announce_out_link(address)
+                return self._wait_response(msg_id, timeout)
+        marker = wire.LEGACY_MARKER if self._binary_wire else b""
+        legacy_msg_id = marker + os.urandom(20 - len(marker))
+        data = b"\x00" + legacy_msg_id + umsgpack.packb([rpc, args])
+        self.transport.sendto(data, address)
+        return self._wait_response(legacy_msg_id, timeout)
+
+    def _wait_response(self, msg_id: Any, timeout: float = None) -> asyncio.Future:
+        """
+        The future is forgotten as soon as the caller cancels it.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        timeout_handle = loop.call_later(
+            timeout or self._wait_timeout, self._timeout, msg_id
+        )
+        self._outstanding[msg_id] = (future, timeout_handle)
+
+        def forget(done: asyncio.Future) -> None:
+            if done.cancelled():
+                self._outstanding.pop(msg_id, None)
+                timeout_handle.cancel()
+
+        future.add_done_callback(forget)
+        return future
+
+    def _accept_response(self, msg_id: Any, data: Any, address: NodeAddr) -> None:
+        """
+        rpcudp's, but late responses to the calls given up are ignored.
+        """
+        pending = self._outstanding.pop(msg_id, None)
+        if pending is None:
+            return
+        future, timeout = pending
+        timeout.cancel()
+        if not future.done():
+            future.set_result((True, data))
+
+    def _timeout(self, msg_id: Any) -> None:
+        future, _ = self._outstanding.pop(msg_id)
+        if not future.done():
+            future.set_result((False, None))
+
+    def _solve_binary_datagram(self, data: bytes, addr: NodeAddr) -> None:
+        try:
+            message = wire.decode(data)
+        except wire.MalformedMessage:
+            return
+        self._refresh_sender(addr)
+        sender = Node(*addr[:2])
+        self._peer_versions.add(sender)
+        if message.in_node and sender != self._origin_node:
+            self._link_store.add_in_link(sender)  # piggybacked heartbeat
+        if not message.is_response:
+            asyncio.ensure_future(
+                self._accept_binary_request(
+                    message.opcode, message.msg_id, message.values, addr
+                )
+            )
+            return
+        value = message.values[0] if message.values else None
+        self._accept_response(message.msg_id, value, addr)
+
+    async def _accept_binary_request(
+        self, opcode: int, msg_id: int, args: List[Any], addr: NodeAddr
+    ) -> None:
+        func = getattr(self, "rpc_" + wire.RPC_NAMES[opcode])
+        try:
+            response = await func(addr, *args)
+        except _NoReply:
+            return
+        if opcode in wire.ONE_WAY:
+            return
+        sender = Node(*addr[:2])
+        in_node = self._link_store.contains_out_link(sender)
+        try:
+            data = wire.encode_response(opcode, msg_id, response, in_node)
+        except wire.MalformedMessage:
+            return
+        self.transport.sendto(data, addr)
+        if in_node:
+            self._link_store.announce_out_link(sender)
+
+    async def _traced_walk(
+        self, walk_id: int, start_node: Node, walk: Awaitable[List[Node]]
+    ) -> List[Node]:
+        """
+        Await a walk started by this node, counting and tracing it.
+        """
+        if self._walk_tracer:
+            self._walk_tracer.on_walk_start(walk_id, start_node)
+        walk_start = monotonic()
+        try:
+            samples = await walk
+        except RPCError as error:
+            if self._metrics is not None:
+                self._metrics.inc("walks", result="failed")
+            if self._walk_tracer:
+                self._walk_tracer.on_walk_end(walk_id, None, error)
+            raise
+        if self._metrics is not None:
+            self._metrics.inc("walks", result="ok")
+            self._metrics.observe("walk_duration_seconds", monotonic() - walk_start)
+        if self._walk_tracer:
+            self._walk_tracer.on_walk_end(walk_id, samples)
+        return samples
+
+    def _record_hop(self, walk_id: int, index: int, next_hop: Node) -> None:
+        if self._walk_tracer:
+            self._walk_tracer.on_walk_hop(walk_id, self._origin_node, index, next_hop)
+        if next_hop is None and self._metrics is not None:
+            self._metrics.observe("walk_hops", index)
+
+    def _handle_call_response(
+        self, result: Tuple[int, Any], node: Node, keep_link: bool = False
+    ) -> Any:
         """
         If we get a response, returns it.
          Otherwise raise error and remove the node from ILinkStore.
+        :param keep_link: the node is not removed when it did not answer
+        :raise RPCRejected: the node is overloaded, it is kept
         """
         if not result[0]:
-            self._link_store.remove_link(node)
+            if not keep_link:
+                self._link_store.remove_link(node)
             raise RPCError
+        if result[1] == REJECTED:
+            raise RPCRejected
         return result[1]
 
-    def _add_sender_to_queue(self, sender: NodeAddr) -> None:
-        self._links_queue.append(Node(*sender))
+    def _refresh_sender(self, sender: NodeAddr) -> None:
+        # whatever it says, the sender is alive: no need to heartbeat it soon
+        self._link_store.refresh_out_link(Node(*sender[:2]))
+
+    def _add_sender_to_recent_peers(self, sender: NodeAddr) -> None:
+        self._recent_peers.add(Node(*sender))
+
+
+def _to_ms(seconds: float) -> int:
+    return max(int(seconds * 1000), 0)
@@ -0,0 +1,209 @@
+import asyncio
+import random
+import selectors
+from asyncio import DatagramProtocol, DatagramTransport
+from typing import Callable, Tuple, Dict, List, Any, Awaitable, Set, Union
+
+from swaplink.abc import ITransportFactory, NodeAddr
+from swaplink.core import Swaplink
+from swaplink.data_objects import Node
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """
+    Event loop whose clock jumps to the next scheduled callback instead of
+    waiting for it. Only in-process transports can be used on it.
+    """
+
+    def __init__(self):
+        self._virtual_time = 0.0
+        super().__init__(_VirtualTimeSelector(self))
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def _advance(self, seconds: float) -> None:
+        self._virtual_time += seconds
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    def __init__(self, loop: VirtualTimeEventLoop):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout: float = None):
+        events = super().select(0)
+        if events or timeout is None:  # nothing scheduled: wait for real wakeups
+            return events or super().select(timeout)
+        self._loop._advance(timeout)
+        return []
+
+
+def run_simulation(main: Awaitable) -> Any:
+    """
+    Run a coroutine on a new VirtualTimeEventLoop, like asyncio.run().
+    """
+    loop = VirtualTimeEventLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class SimulatedNetwork(ITransportFactory):
+    """
+    Delivers datagrams between endpoints of the same process.
+    """
+
+    _endpoints: Dict[NodeAddr, "SimulatedTransport"]
+    _down: Set[NodeAddr]
+
+    def __init__(
+        self,
+        latency: float = 0.01,
+        jitter: float = 0.0,
+        loss_rate: float = 0.0,
+        seed: int = None,
+    ):
+        """
+        :param latency: seconds every datagram takes
+        :param jitter: maximum random seconds added to the latency
+        :param loss_rate: probability of a datagram being lost
+        :param seed: seed of the losses and jitter
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss_rate = loss_rate
+        self.sent = 0
+        self.delivered = 0
+        self._random = random.Random(seed)
+        self._endpoints = {}
+        self._down = set()
+
+    async def create_endpoint(
+        self, protocol_factory: Callable[[], DatagramProtocol], local_addr: NodeAddr
+    ) -> Tuple[DatagramTransport, DatagramProtocol]:
+        local_addr = Node(*local_addr[:2])
+        if local_addr in self._endpoints:
+            raise OSError(f"address already in use: {local_addr}")
+        protocol = protocol_factory()
+        transport = SimulatedTransport(self, local_addr, protocol)
+        self._endpoints[local_addr] = transport
+        protocol.connection_made(transport)
+        return transport, protocol
+
+    def kill(self, addr: NodeAddr) -> None:
+        """
+        Crash a node: its datagrams, in and out, are dropped until revived.
+        """
+        self._down.add(Node(*addr[:2]))
+
+    def revive(self, addr: NodeAddr) -> None:
+        self._down.discard(Node(*addr[:2]))
+
+    def is_down(self, addr: NodeAddr) -> bool:
+        return Node(*addr[:2]) in self._down
+
+    async def churn(
+        self, period: float, fraction: float, downtime: float, seed: int = None
+    ) -> None:
+        """
+        Every period, crash a fraction of the endpoints for downtime seconds.
+        Runs until cancelled.
+        """
+        churn_random = random.Random(seed)
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(period)
+            alive = [addr for addr in self._endpoints if addr not in self._down]
+            for addr in churn_random.sample(alive, int(len(alive) * fraction)):
+                self.kill(addr)
+                loop.call_later(downtime, self.revive, addr)
+
+    def _send(self, data: bytes, source: NodeAddr, destination: NodeAddr) -> None:
+        self.sent += 1
+        if self._is_dropped(source, destination):
+            return
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        asyncio.get_event_loop().call_later(
+            delay, self._deliver, data, source, destination
+        )
+
+    def _deliver(self, data: bytes, source: NodeAddr, destination: NodeAddr) -> None:
+        if Node(*destination[:2]) in self._down:  # crashed while in flight
+            return
+        endpoint = self._endpoints.get(Node(*destination[:2]))
+        if endpoint:
+            self.delivered += 1
+            endpoint._protocol.datagram_received(data, source)
+
+    def _is_dropped(self, source: NodeAddr, destination: NodeAddr) -> bool:
+        if source in self._down or Node(*destination[:2]) in self._down:
+            return True
+        return self.loss_rate > 0 and self._random.random() < self.loss_rate
+
+    def _remove(self, addr: NodeAddr) -> None:
+        self._endpoints.pop(addr, None)
+
+
+class SimulatedTransport(DatagramTransport):
+    def __init__(
+        self, network: SimulatedNetwork, addr: NodeAddr, protocol: DatagramProtocol
+    ):
+        super().__init__()
+        self._network = network
+        self._addr = addr
+        self._protocol = protocol
+        self._closing = False
+
+    def sendto(
+        self, data: Union[bytes, bytearray, memoryview], addr: Any = None
+    ) -> None:
+        if not self._closing:
+            self._network._send(bytes(data), self._addr, addr)
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        if name == "sockname":
+            return self._addr
+        return default
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._network._remove(self._addr)
+        asyncio.get_event_loop().call_soon(self._protocol.connection_lost, None)
+
+    def abort(self) -> None:
+        self.close()
+
+
+def simulated_node(index: int, port: int = 5678) -> Node:
+    return Node(f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}", port)
+
+
+async def create_swaplinks(
+    network: SimulatedNetwork, loads: List[int], **swaplink_kwargs: Any
+) -> List[Swaplink]:
+    """
+    Join a Swaplink node per load to the simulated network, one after another,
+    all of them bootstrapping through the first one.
+    """
+    swaplinks: List[Swaplink] = []
+    for index, load in enumerate(loads):
+        node = simulated_node(index)
+        swaplink = Swaplink(
+            node.host, node.port, transport_factory=network, **swaplink_kwargs
+        )
+        await swaplink.join(load, [swaplinks[0]._node] if swaplinks else None)
+        swaplinks.append(swaplink)
+    return swaplinks
@@ -0,0 +1,48 @@
+"""
+On-disk snapshot of a node's links and recent peers, for a warm restart.
+"""
+
+import os
+import tempfile
+from typing import Optional
+
+import umsgpack
+
+from swaplink.data_objects import Node, PeerSnapshot
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(path: str, snapshot: PeerSnapshot) -> None:
+    """
+    Written to a temporary file that then replaces the old snapshot, so that
+    a crash leaves either the old snapshot or the new one.
+    """
+    data = umsgpack.packb(
+        [SNAPSHOT_VERSION] + [[list(node) for node in nodes] for nodes in snapshot]
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=".swaplink-")
+    try:
+        with os.fdopen(fd, "wb") as temporary_file:
+            temporary_file.write(data)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def load_snapshot(path: str) -> Optional[PeerSnapshot]:
+    """
+    :return: None if there is no snapshot, or it is unreadable
+    """
+    try:
+        with open(path, "rb") as snapshot_file:
+            version, *nodes_lists = umsgpack.unpackb(snapshot_file.read())
+        if version != SNAPSHOT_VERSION:
+            return None
+        return PeerSnapshot(*([Node(*node) for node in nodes] for nodes in nodes_lists))
+    except (OSError, ValueError, TypeError, umsgpack.UnpackException):
+        return None
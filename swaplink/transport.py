@@ -0,0 +1,19 @@
+import asyncio
+from asyncio import DatagramProtocol, DatagramTransport
+from typing import Callable, Tuple
+
+from swaplink.abc import ITransportFactory, NodeAddr
+
+
+class UDPTransportFactory(ITransportFactory):
+    """
+    Real UDP sockets on the running event loop.
+    """
+
+    async def create_endpoint(
+        self, protocol_factory: Callable[[], DatagramProtocol], local_addr: NodeAddr
+    ) -> Tuple[DatagramTransport, DatagramProtocol]:
+        loop = asyncio.get_event_loop()
+        return await loop.create_datagram_endpoint(
+            protocol_factory, local_addr=local_addr
+        )
@@ -1,4 +1,6 @@
+import asyncio
 import random
+import time
 from collections.abc import Sequence
 from typing import Any
 
@@ -8,3 +10,14 @@ def random_choice_safe(sequence: Sequence, default: Any = None) -> Any:
         return random.choice(sequence)
     except IndexError:
         return default
+
+
+def monotonic() -> float:
+    """
+    Clock of the running event loop, so that simulations run in virtual time.
+    Same as time.monotonic() with the default event loop.
+    """
+    try:
+        return asyncio.get_running_loop().time()
+    except RuntimeError:
+        return time.monotonic()
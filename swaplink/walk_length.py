@@ -0,0 +1,76 @@
+import math
+from collections import Counter, deque
+from typing import Iterable, Optional
+
+from swaplink import defaults
+from swaplink.data_objects import Node
+
+
+class WalkLengthEstimator:
+    """
+    Chooses the shortest walk whose bias stays within a tolerance, from the
+    network size estimated by collisions among recently selected nodes.
+    """
+
+    _samples: "deque[Node]"
+    _counts: Counter
+
+    def __init__(
+        self,
+        window: int = defaults.WALK_LENGTH_SAMPLES,
+        min_collisions: int = defaults.WALK_LENGTH_MIN_COLLISIONS,
+    ):
+        """
+        :param window: amount of latest samples the size is estimated from
+        :param min_collisions: repeated samples needed before trusting the estimate
+        """
+        self._samples = deque()
+        self._counts = Counter()
+        self._collisions = 0
+        self._window = window
+        self._min_collisions = min_collisions
+
+    def observe(self, samples: Iterable[Node]) -> None:
+        for sample in samples:
+            self._collisions += self._counts[sample]
+            self._counts[sample] += 1
+            self._samples.append(sample)
+            if len(self._samples) > self._window:
+                oldest = self._samples.popleft()
+                self._counts[oldest] -= 1
+                self._collisions -= self._counts[oldest]
+                if not self._counts[oldest]:
+                    del self._counts[oldest]
+
+    def network_size(self) -> Optional[float]:
+        """
+        Birthday-paradox estimate: k samples with C colliding pairs come from
+        about k(k-1)/2C nodes. Degree-biased sampling makes it a lower bound.
+        :return: estimated amount of nodes, None if not enough collisions yet
+        """
+        if self._collisions < self._min_collisions:
+            return None
+        num_samples = len(self._samples)
+        return max(num_samples * (num_samples - 1) / (2 * self._collisions), 2)
+
+    def walk_length(
+        self, degree: int, tolerance: float = defaults.WALK_BIAS_TOLERANCE
+    ) -> int:
+        """
+        Hops after which the distance to the stationary distribution,
+        about sqrt(N) * lambda^hops, is within tolerance. Walks follow in-links,
+        and random directed graphs of average degree d have lambda ~ 1/sqrt(d).
+        :param degree: average degree of the overlay (e.g. own num_links)
+        :param tolerance: accepted total variation distance
+        """
+        network_size = self.network_size()
+        if network_size is None or degree < 2:
+            return defaults.DEFAULT_WALK_LENGTH
+        if degree >= network_size - 1:  # (nearly) complete graph
+            return defaults.MIN_WALK_LENGTH
+        hops = math.log(math.sqrt(network_size) / tolerance) / math.log(
+            math.sqrt(degree)
+        )
+        return min(
+            max(math.ceil(hops), defaults.MIN_WALK_LENGTH), defaults.MAX_WALK_LENGTH
+        )
@@ -0,0 +1,345 @@
+"""
+Compact binary encoding of Swaplink RPCs.
+
+Datagram: MAGIC, VERSION, opcode (high bit set on responses, next one when
+the sender has the receiver as out-link) and a 4-byte message id, followed
+by the tagged arguments (requests) or the tagged result (responses).
+Nodes are packed as IPv4/IPv6 address plus port. One-way opcodes get no
+response.
+
+Overlays sharing a socket (swaplink.host) wrap their datagrams in batches:
+MUX_MAGIC, VERSION, then frames of overlay id and datagram, so that the
+datagrams sent to a peer at once travel together.
+
+Old nodes only understand rpcudp's msgpack envelope, so a peer is only sent
+binary datagrams once it is known to understand them: because it sent one,
+or because its msgpack message ids start with LEGACY_MARKER.
+"""
+
+import socket
+import struct
+from collections import OrderedDict, namedtuple
+from enum import IntEnum
+from typing import Any, List, Tuple, Dict, Union, Sequence
+
+from swaplink.data_objects import Node
+
+MAGIC = 0xB5  # never 0x00 nor 0x01, rpcudp's request and response kinds
+VERSION = 1
+LEGACY_MARKER = b"SWL" + bytes([VERSION])  # prefix of our rpcudp message ids
+
+MUX_MAGIC = 0xB6
+
+RESPONSE_FLAG = 0x80
+IN_NODE_FLAG = 0x40  # piggybacked heartbeat: "I'm your in-node"
+_HEADER = struct.Struct("!BBBI")
+_MUX_HEADER = struct.Struct("!BB")
+_U8 = struct.Struct("!B")
+_U16 = struct.Struct("!H")
+_U32 = struct.Struct("!I")
+_U64 = struct.Struct("!Q")
+_IPV4 = struct.Struct("!4sH")
+_IPV6 = struct.Struct("!16sH")
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class MalformedMessage(Exception):
+    pass
+
+
+class Opcode(IntEnum):
+    RANDOM_WALK = 1
+    SAMPLE_WALK = 2
+    FORWARD_WALK = 3
+    WALK_RESULT = 4
+    GIVE_ME_IN_NODE = 5
+    CHANGE_YOUR_OUT_NODE = 6
+    IM_YOUR_IN_NODE = 7
+    HBEAT = 8  # one-way im_your_in_node
+    GOODBYE = 9
+
+
+OPCODES: Dict[str, int] = {opcode.name.lower(): opcode for opcode in Opcode}
+RPC_NAMES: Dict[int, str] = {opcode: name for name, opcode in OPCODES.items()}
+ONE_WAY = {Opcode.HBEAT}
+
+Message = namedtuple(
+    "Message", ["is_response", "opcode", "msg_id", "values", "in_node"]
+)
+
+
+class Tag(IntEnum):
+    NONE = 0
+    FALSE = 1
+    TRUE = 2
+    U8 = 3
+    U16 = 4
+    U32 = 5
+    U64 = 6
+    NODE_IPV4 = 7
+    NODE_IPV6 = 8
+    NODE_NAME = 9  # host that is not an IP address, as utf-8
+    NODES = 10  # u8 count, then every node with its own NODE_* tag
+    STR = 11
+
+
+def encode_request(
+    rpc: str, msg_id: int, args: Tuple[Any, ...], in_node: bool = False
+) -> bytearray:
+    """
+    :param in_node: the receiver is an out-link of the sender
+    :raise MalformedMessage: unknown rpc or an argument that cannot be encoded
+    """
+    opcode = OPCODES.get(rpc)
+    if opcode is None:
+        raise MalformedMessage(f"no opcode for {rpc}")
+    if in_node:
+        opcode |= IN_NODE_FLAG
+    data = bytearray(_HEADER.pack(MAGIC, VERSION, opcode, msg_id))
+    for arg in args:
+        _encode_value(data, arg)
+    return data
+
+
+def encode_response(
+    opcode: int, msg_id: int, value: Any, in_node: bool = False
+) -> bytearray:
+    opcode |= RESPONSE_FLAG
+    if in_node:
+        opcode |= IN_NODE_FLAG
+    data = bytearray(_HEADER.pack(MAGIC, VERSION, opcode, msg_id))
+    _encode_value(data, value)
+    return data
+
+
+def decode(datagram: Buffer) -> Message:
+    """
+    :raise MalformedMessage: not a datagram of this version
+    """
+    buffer = memoryview(datagram)
+    try:
+        magic, version, opcode, msg_id = _HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise MalformedMessage(f"unsupported version {version}")
+        values = []
+        offset = _HEADER.size
+        while offset < len(buffer):
+            value, offset = _decode_value(buffer, offset)
+            values.append(value)
+    except (struct.error, IndexError, ValueError, UnicodeDecodeError) as error:
+        raise MalformedMessage(str(error)) from error
+    is_response = bool(opcode & RESPONSE_FLAG)
+    in_node = bool(opcode & IN_NODE_FLAG)
+    opcode &= ~(RESPONSE_FLAG | IN_NODE_FLAG)
+    if opcode not in RPC_NAMES:
+        raise MalformedMessage(f"unknown opcode {opcode}")
+    return Message(is_response, opcode, msg_id, values, in_node)
+
+
+def is_binary(datagram: Buffer) -> bool:
+    return len(datagram) > 0 and datagram[0] == MAGIC
+
+
+def is_marked_request(datagram: Buffer) -> bool:
+    """
+    Whether an rpcudp request comes from a node that understands this version.
+    Responses echo the caller's message id, so they say nothing of the sender.
+    """
+    marker_end = 1 + len(LEGACY_MARKER)
+    return datagram[:1] == b"\x00" and datagram[1:marker_end] == LEGACY_MARKER
+
+
+def encode_batches(
+    frames: Sequence[Tuple[str, Buffer]], max_size: int
+) -> List[bytearray]:
+    """
+    Pack the overlays' datagrams in as few batches of up to max_size bytes
+    as their order allows. A datagram too big for a batch goes alone.
+    :param frames: (overlay id, datagram) pairs
+    :raise MalformedMessage: overlay id longer than 255 bytes
+    """
+    batches = []
+    batch = None
+    for overlay_id, datagram in frames:
+        encoded_id = overlay_id.encode()
+        if len(encoded_id) > 255:
+            raise MalformedMessage(f"overlay id too long: {overlay_id}")
+        frame = _U8.pack(len(encoded_id)) + encoded_id + _U16.pack(len(datagram))
+        if batch is None or len(batch) + len(frame) + len(datagram) > max_size:
+            batch = bytearray(_MUX_HEADER.pack(MUX_MAGIC, VERSION))
+            batches.append(batch)
+        batch += frame
+        batch += datagram
+    return batches
+
+
+def decode_batch(datagram: Buffer) -> List[Tuple[str, bytes]]:
+    """
+    :return: (overlay id, datagram) pairs
+    :raise MalformedMessage: not a batch of this version
+    """
+    buffer = memoryview(datagram)
+    frames = []
+    try:
+        magic, version = _MUX_HEADER.unpack_from(buffer)
+        if magic != MUX_MAGIC or version != VERSION:
+            raise MalformedMessage(f"unsupported batch version {version}")
+        offset = _MUX_HEADER.size
+        while offset < len(buffer):
+            id_length = buffer[offset]
+            offset += 1
+            id_end = offset + id_length
+            overlay_id = str(buffer[offset:id_end], "utf-8")
+            (length,) = _U16.unpack_from(buffer, id_end)
+            offset = id_end + _U16.size
+            end = offset + length
+            if end > len(buffer):
+                raise MalformedMessage("truncated frame")
+            frames.append((overlay_id, bytes(buffer[offset:end])))
+            offset = end
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise MalformedMessage(str(error)) from error
+    return frames
+
+
+def _encode_value(data: bytearray, value: Any) -> None:
+    if value is None:
+        data += _U8.pack(Tag.NONE)
+    elif value is True or value is False:
+        data += _U8.pack(Tag.TRUE if value else Tag.FALSE)
+    elif isinstance(value, int):
+        _encode_int(data, value)
+    elif isinstance(value, str):
+        encoded = value.encode()
+        data += _U8.pack(Tag.STR) + _U16.pack(len(encoded)) + encoded
+    elif _is_node(value):
+        _encode_node(data, value)
+    elif isinstance(value, (list, tuple)) and all(_is_node(node) for node in value):
+        if len(value) > 255:
+            raise MalformedMessage("too many nodes")
+        data += _U8.pack(Tag.NODES) + _U8.pack(len(value))
+        for node in value:
+            _encode_node(data, node)
+    else:
+        raise MalformedMessage(f"cannot encode {value!r}")
+
+
+def _encode_int(data: bytearray, value: int) -> None:
+    if value < 0:
+        raise MalformedMessage(f"cannot encode {value}")
+    if value <= 0xFF:
+        data += _U8.pack(Tag.U8) + _U8.pack(value)
+    elif value <= 0xFFFF:
+        data += _U8.pack(Tag.U16) + _U16.pack(value)
+    elif value <= 0xFFFFFFFF:
+        data += _U8.pack(Tag.U32) + _U32.pack(value)
+    elif value <= 0xFFFFFFFFFFFFFFFF:
+        data += _U8.pack(Tag.U64) + _U64.pack(value)
+    else:
+        raise MalformedMessage(f"cannot encode {value}")
+
+
+def _is_node(value: Any) -> bool:
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def _encode_node(data: bytearray, node: Tuple[str, int]) -> None:
+    host, port = node
+    try:
+        data += _U8.pack(Tag.NODE_IPV4) + _IPV4.pack(
+            socket.inet_pton(socket.AF_INET, host), port
+        )
+        return
+    except OSError:
+        pass
+    try:
+        data += _U8.pack(Tag.NODE_IPV6) + _IPV6.pack(
+            socket.inet_pton(socket.AF_INET6, host), port
+        )
+        return
+    except OSError:
+        pass
+    encoded = host.encode()
+    if len(encoded) > 255:
+        raise MalformedMessage(f"host too long: {host}")
+    data += _U8.pack(Tag.NODE_NAME) + _U8.pack(len(encoded)) + encoded
+    data += _U16.pack(port)
+
+
+def _decode_value(buffer: memoryview, offset: int) -> Tuple[Any, int]:
+    tag = buffer[offset]
+    offset += 1
+    if tag == Tag.NONE:
+        return None, offset
+    if tag == Tag.FALSE or tag == Tag.TRUE:
+        return tag == Tag.TRUE, offset
+    if tag == Tag.U8:
+        return buffer[offset], offset + 1
+    if tag == Tag.U16:
+        return _U16.unpack_from(buffer, offset)[0], offset + _U16.size
+    if tag == Tag.U32:
+        return _U32.unpack_from(buffer, offset)[0], offset + _U32.size
+    if tag == Tag.U64:
+        return _U64.unpack_from(buffer, offset)[0], offset + _U64.size
+    if tag == Tag.STR:
+        (length,) = _U16.unpack_from(buffer, offset)
+        offset += _U16.size
+        end = offset + length
+        if end > len(buffer):
+            raise MalformedMessage("truncated string")
+        return str(buffer[offset:end], "utf-8"), end
+    if tag == Tag.NODES:
+        count = buffer[offset]
+        offset += 1
+        nodes = []
+        for _ in range(count):
+            node, offset = _decode_node(buffer, buffer[offset], offset + 1)
+            nodes.append(node)
+        return nodes, offset
+    return _decode_node(buffer, tag, offset)
+
+
+def _decode_node(buffer: memoryview, tag: int, offset: int) -> Tuple[Node, int]:
+    if tag == Tag.NODE_IPV4:
+        packed, port = _IPV4.unpack_from(buffer, offset)
+        return Node(socket.inet_ntop(socket.AF_INET, packed), port), offset + 6
+    if tag == Tag.NODE_IPV6:
+        packed, port = _IPV6.unpack_from(buffer, offset)
+        return Node(socket.inet_ntop(socket.AF_INET6, packed), port), offset + 18
+    if tag == Tag.NODE_NAME:
+        length = buffer[offset]
+        offset += 1
+        end = offset + length
+        if end > len(buffer):
+            raise MalformedMessage("truncated host")
+        host = str(buffer[offset:end], "utf-8")
+        (port,) = _U16.unpack_from(buffer, end)
+        return Node(host, port), end + _U16.size
+    raise MalformedMessage(f"unknown tag {tag}")
+
+
+class PeerVersions:
+    """
+    Latest peers known to understand the binary format.
+    """
+
+    _peers: "OrderedDict[Tuple[str, int], int]"
+
+    def __init__(self, capacity: int):
+        self._peers = OrderedDict()
+        self._capacity = capacity
+
+    def add(self, addr: Tuple[str, int], version: int = VERSION) -> None:
+        self._peers[addr] = version
+        self._peers.move_to_end(addr)
+        if len(self._peers) > self._capacity:
+            self._peers.popitem(last=False)
+
+    def supports_binary(self, addr: Tuple[str, int]) -> bool:
+        return self._peers.get(addr) == VERSION
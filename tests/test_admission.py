@@ -0,0 +1,29 @@
+import asyncio
+
+from swaplink.admission import AdmissionControl
+from swaplink.simulation import simulated_node, run_simulation
+
+
+def test_max_walks():
+    admission = AdmissionControl(max_walks=2)
+    sender = simulated_node(0)
+    assert admission.try_admit(sender) is None
+    assert admission.try_admit(sender) is None
+    assert admission.try_admit(simulated_node(1)) == "overloaded"
+    admission.release()
+    assert admission.try_admit(simulated_node(1)) is None
+
+
+def test_rate_per_sender():
+    async def simulation():
+        admission = AdmissionControl(max_walks=100, rate=10, burst=3)
+        sender, other_sender = simulated_node(0), simulated_node(1)
+        for _ in range(3):
+            assert admission.try_admit(sender) is None
+        assert admission.try_admit(sender) == "rate_limited"
+        assert admission.try_admit(other_sender) is None  # its own bucket
+        await asyncio.sleep(0.1)  # refilled with a token
+        assert admission.try_admit(sender) is None
+        assert admission.try_admit(sender) == "rate_limited"
+
+    run_simulation(simulation())
@@ -0,0 +1,50 @@
+import math
+
+import pytest
+
+from swaplink.analysis import (
+    chi_square,
+    chi_square_sf,
+    expected_distribution,
+    kl_divergence,
+    mixing_profile,
+    min_walk_length,
+    spectral_gap,
+)
+
+
+def test_chi_square():
+    expected = expected_distribution({"a": 1, "b": 3})
+    assert expected == {"a": 0.25, "b": 0.75}
+
+    statistic, degrees_of_freedom, p_value = chi_square(["a"] + ["b"] * 3, expected)
+    assert statistic == 0 and degrees_of_freedom == 1 and p_value == 1
+
+    _, _, p_value = chi_square(["a"] * 50 + ["b"] * 50, expected)
+    assert p_value < 0.001
+
+    assert chi_square_sf(3.841, 1) == pytest.approx(0.05, abs=1e-4)
+    assert chi_square_sf(124.342, 100) == pytest.approx(0.05, abs=1e-4)
+
+
+def test_kl_divergence():
+    expected = expected_distribution({"a": 1, "b": 1})
+    assert kl_divergence(["a", "b"], expected) == 0
+    assert kl_divergence(["a", "a"], expected) == pytest.approx(1)
+    assert kl_divergence(["c"], expected) == math.inf
+
+
+def test_mixing():
+    complete_graph = {
+        node: [other for other in range(5) if other != node] for node in range(5)
+    }
+    profile = mixing_profile(complete_graph, max_length=10)
+    assert profile[0] == pytest.approx(0.8)
+    assert profile[-1] < 1e-6
+    assert min_walk_length(profile, 0.01) <= 4
+    assert spectral_gap(profile) == pytest.approx(0.75, abs=0.01)  # eigenvalue -1/4
+
+    cycle = {node: [(node + 1) % 4] for node in range(4)}  # periodic: never mixes
+    profile = mixing_profile(cycle, max_length=10)
+    assert min_walk_length(profile, 0.01) is None
+    assert spectral_gap(profile) == pytest.approx(0)
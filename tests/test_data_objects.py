@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+
+from swaplink.core import LinkStore
+from swaplink.data_objects import (
+    IndexedSet,
+    RecentPeers,
+    Node,
+    NeighborsChange,
+    ExpiryHeap,
+    SamplePool,
+)
+
+
+def test_indexed_set():
+    indexed_set = IndexedSet(range(5))
+    assert len(indexed_set) == 5
+
+    indexed_set.add(3)
+    assert len(indexed_set) == 5
+
+    indexed_set.discard(0)
+    indexed_set.discard(4)
+    indexed_set.discard(42)
+    assert set(indexed_set) == {1, 2, 3}
+    assert 0 not in indexed_set and 3 in indexed_set
+    for _ in range(20):
+        assert indexed_set.random_choice() in {1, 2, 3}
+
+    for item in [1, 2, 3]:
+        indexed_set.discard(item)
+    assert len(indexed_set) == 0
+    assert indexed_set.random_choice("default") == "default"
+
+
+def test_recent_peers():
+    recent_peers = RecentPeers(capacity=3, max_age=60)
+    for node in [1, 2, 1, 3, 4]:
+        recent_peers.add(node)
+    assert len(recent_peers) == 3
+    assert 2 not in recent_peers  # least recently seen is evicted
+    assert recent_peers.most_recent(2) == [4, 3]
+
+    assert recent_peers.pop() == 4
+    recent_peers._max_age = 0
+    with pytest.raises(IndexError):
+        recent_peers.pop()
+
+
+@pytest.mark.asyncio
+async def test_neighbors_changes():
+    link_store = LinkStore()
+    node_a, node_b = Node("127.0.0.1", 1), Node("127.0.0.1", 2)
+    changes = []
+    link_store.subscribe(changes.append)
+    batched_changes = []
+    link_store.subscribe(batched_changes.append, debounce=0.01)
+
+    link_store.add_out_link(node_a)
+    link_store.add_out_link(node_a)  # heartbeat refresh, not a change
+    link_store.add_out_link(node_b)
+    link_store.remove_out_link(node_b)
+    assert changes == [
+        NeighborsChange({node_a}, set(), [node_a]),
+        NeighborsChange({node_b}, set(), [node_a, node_b]),
+        NeighborsChange(set(), {node_b}, [node_a]),
+    ]
+
+    await asyncio.sleep(0.02)
+    assert batched_changes == [NeighborsChange({node_a}, set(), [node_a])]
+
+
+def test_expiry_heap():
+    timestamps = {"a": 1.0, "b": 2.0, "c": 3.0}
+    expiry_heap = ExpiryHeap(timestamps.get)
+    for item, timestamp in timestamps.items():
+        expiry_heap.push(item, timestamp, len(timestamps))
+    timestamps["a"] = 4.0  # refreshed
+    expiry_heap.push("a", 4.0, len(timestamps))
+    del timestamps["b"]  # removed
+
+    assert expiry_heap.oldest() == (3.0, "c")
+    assert expiry_heap.pop_older_than(3.5) == ["c"]
+    assert expiry_heap.pop_older_than(3.5) == []
+    assert expiry_heap.oldest() == (4.0, "a")
+
+
+def test_sample_pool():
+    sample_pool = SamplePool(size=3, max_age=60)
+    sample_pool.add("a")
+    sample_pool.add("b")
+    assert len(sample_pool) == 2
+    assert sample_pool.evict_stale() == 0
+    assert sample_pool.pop() == "a"  # oldest first, taken once
+    assert sample_pool.pop() == "b"
+    with pytest.raises(IndexError):
+        sample_pool.pop()
+
+    stale_pool = SamplePool(size=3, max_age=0)
+    stale_pool.add("a")
+    assert stale_pool.next_expiry() <= time.monotonic()
+    assert stale_pool.evict_stale() == 1
+    assert len(stale_pool) == 0
+    assert stale_pool.next_expiry() is None
+
+
+def test_link_store_expiry():
+    link_store = LinkStore()
+    node_a, node_b = Node("127.0.0.1", 1), Node("127.0.0.1", 2)
+    link_store.add_in_link(node_a)
+    link_store.add_out_link(node_b)
+    hbeat_limit = time.monotonic()
+    link_store.add_in_link(node_b)
+
+    assert link_store.expire_in_links(hbeat_limit) == [node_a]
+    assert link_store.expire_out_links(hbeat_limit) == [node_b]
+    assert link_store.get_in_links_copy() == [node_b]
+    assert link_store.oldest_in_link_hbeat() > hbeat_limit
+    assert link_store.oldest_out_link_hbeat() is None
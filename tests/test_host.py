@@ -0,0 +1,56 @@
+import asyncio
+import random
+
+import pytest
+
+from swaplink import defaults
+from swaplink.host import SwaplinkHost
+from swaplink.simulation import SimulatedNetwork, run_simulation, simulated_node
+
+
+def test_overlays_share_host():
+    async def simulation():
+        random.seed(7)
+        network = SimulatedNetwork(latency=0.01, seed=7)
+        hosts = [
+            SwaplinkHost(*simulated_node(index), transport_factory=network)
+            for index in range(6)
+        ]
+        overlays = {overlay_id: [] for overlay_id in ("a", "b", "c", "d")}
+        for host in hosts:
+            await host.start()
+            for overlay_id, swaplinks in overlays.items():
+                swaplink = host.add_overlay(overlay_id)
+                bootstrap = [swaplinks[0]._node] if swaplinks else None
+                await swaplink.join(3, bootstrap)
+                swaplinks.append(swaplink)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 2)
+        idle_frames = sum(host.frames_sent for host in hosts)
+        idle_datagrams = sum(host.datagrams_sent for host in hosts)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+        frames = sum(host.frames_sent for host in hosts) - idle_frames
+        datagrams = sum(host.datagrams_sent for host in hosts) - idle_datagrams
+
+        for swaplinks in overlays.values():
+            degrees = [len(swaplink.list_neighbours()) for swaplink in swaplinks]
+            assert sum(degrees) >= 0.9 * 3 * len(swaplinks)
+            assert await swaplinks[-1].select() in {host._node for host in hosts}
+        assert hosts[0].overlays() == list(overlays)
+
+        for swaplinks in overlays.values():
+            for swaplink in swaplinks:
+                await swaplink.leave()
+        for host in hosts:
+            host.close()
+        return frames, datagrams
+
+    frames, datagrams = run_simulation(simulation())
+    assert datagrams < frames * 0.7  # heartbeats to the same host are merged
+
+
+def test_add_overlay_reserves_id():
+    host = SwaplinkHost(*simulated_node(0), transport_factory=SimulatedNetwork())
+    host.add_overlay("a")
+    with pytest.raises(ValueError):
+        host.add_overlay("a")  # not joined yet, but taken
+    host.add_overlay("b")
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from swaplink import defaults
+from swaplink.metrics import Metrics, to_prometheus, serve_prometheus, WalkRecorder
+from swaplink.simulation import SimulatedNetwork, run_simulation, create_swaplinks
+
+
+def test_metrics():
+    metrics = Metrics()
+    metrics.inc("rpc_calls", rpc="random_walk")
+    metrics.inc("rpc_calls", 2, rpc="random_walk")
+    metrics.observe("walk_hops", 3)
+    metrics.observe("walk_hops", 100)
+    assert metrics.counter("rpc_calls", rpc="random_walk") == 3
+    assert metrics.counter("rpc_calls", rpc="give_me_in_node") == 0
+    hops = metrics.histogram("walk_hops")
+    assert hops.count == 2 and hops.sum == 103
+    assert hops.cumulative_counts()[-1] == (float("inf"), 2)
+
+    text = to_prometheus(metrics)
+    assert "# TYPE swaplink_rpc_calls_total counter" in text
+    assert 'swaplink_rpc_calls_total{rpc="random_walk"} 3' in text
+    assert 'swaplink_walk_hops_bucket{le="3"} 1' in text
+    assert 'swaplink_walk_hops_bucket{le="+Inf"} 2' in text
+    assert "swaplink_walk_hops_count 2" in text
+
+
+@pytest.mark.asyncio
+async def test_serve_prometheus():
+    metrics = Metrics()
+    metrics.inc("walks", result="ok")
+    server = await serve_prometheus(metrics, "127.0.0.1", 9477)
+    reader, writer = await asyncio.open_connection("127.0.0.1", 9477)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    response = await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert b'swaplink_walks_total{result="ok"} 1' in response
+
+
+def test_walk_tracing():
+    async def simulation():
+        network = SimulatedNetwork(latency=0.01, seed=5)
+        recorder = WalkRecorder()
+        swaplinks = await create_swaplinks(network, [3] * 20, walk_tracer=recorder)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+        initiator = swaplinks[-1]
+        recorder.walks.clear()
+        selected = await initiator.select()
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return initiator, selected, recorder
+
+    initiator, selected, recorder = run_simulation(simulation())
+    # background walks are traced too: check the ones that ended where select did
+    walks = [
+        events
+        for events in recorder.walks.values()
+        if events[0].kind == "start" and events[-1] == ("end", None, None, [selected])
+    ]
+    assert walks
+    for events in walks:
+        hops = [event for event in events if event.kind == "hop"]
+        assert [hop.index for hop in hops] == list(range(len(hops)))
+        assert hops[-1].node == selected and hops[-1].detail is None
+    assert initiator.metrics.counter("walks", result="ok") >= 1
+    assert initiator.metrics.counter("rpc_calls", rpc="im_your_in_node") > 0
+    assert initiator.metrics.counter("link_changes", link_type="out", change="added")
+    assert initiator.metrics.histogram("hbeat_round_duration_seconds").count > 0
@@ -1,7 +1,13 @@
+import asyncio
+
 import pytest
 
-from swaplink.data_objects import LinkType
-from tests.utils import setup_n_protocols, close_transports
+from swaplink import defaults, wire
+from swaplink.admission import AdmissionControl
+from swaplink.data_objects import LinkType, Node
+from swaplink.errors import RPCError, RPCRejected
+from swaplink.utils import monotonic
+from tests.utils import setup_n_protocols, close_transports, introduce
 
 
 @pytest.mark.asyncio
@@ -25,6 +31,188 @@ async def test_random_walk():
     close_transports(transports)
 
 
+@pytest.mark.asyncio
+async def test_walk_rejected():
+    protocols, transports = await setup_n_protocols(3)
+    protocol_a, protocol_b, protocol_c = protocols
+    protocol_c._admission = AdmissionControl(max_walks=0)  # overloaded
+    protocol_a._link_store.add_out_link(protocol_b._origin_node)
+    protocol_b._link_store.add_in_link(protocol_c._origin_node)
+
+    with pytest.raises(RPCRejected):  # C rejects B, which has no other hop
+        await protocol_a.call_random_walk(protocol_b._origin_node, 0, 1, LinkType.IN)
+    assert protocol_a._link_store.contains_out_link(protocol_b._origin_node)
+    assert protocol_b._link_store.contains_in_link(protocol_c._origin_node)
+    assert protocol_b._admission.walks_in_flight == 0
+
+    redraws = []  # rejections are retried longer than silent hops
+
+    def redraw():
+        redraws.append(protocol_c._origin_node)
+        return protocol_c._origin_node
+
+    node_a = protocol_a._origin_node
+    with pytest.raises(RPCRejected):
+        await protocol_b._call_next_hop(
+            "random_walk",
+            protocol_c._origin_node,
+            redraw,
+            None,
+            1,
+            node_a,
+            1,
+            1,
+            LinkType.IN,
+        )
+    assert len(redraws) == defaults.WALK_REJECT_RETRIES > defaults.WALK_HOP_RETRIES
+
+    protocol_c._admission = AdmissionControl()
+    random_node = await protocol_a.call_random_walk(
+        protocol_b._origin_node, 0, 1, LinkType.IN
+    )
+    assert random_node == protocol_c._origin_node
+
+    # a peer that may not understand the rejection gets no answer at all
+    protocol_b._admission = AdmissionControl(max_walks=0)
+    protocol_c._binary_wire = False  # like a node that only speaks msgpack
+    assert not protocol_b._peer_versions.supports_binary(protocol_c._origin_node)
+    with pytest.raises(RPCError) as error:
+        await protocol_c.call_random_walk(
+            protocol_b._origin_node, 0, 1, LinkType.IN, timeout=0.2
+        )
+    assert not isinstance(error.value, RPCRejected)
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_walk_hop_failover():
+    protocols, transports = await setup_n_protocols(3)
+    protocol_a, protocol_b, protocol_c = protocols
+    introduce(protocols)  # else B does not get A's time budget
+    dead_node = Node("127.0.0.1", 1)
+    protocol_b._link_store.add_in_link(dead_node)
+    protocol_b._link_store.add_in_link(protocol_c._origin_node)
+
+    random_nodes = []
+    for _ in range(5):  # C ends the walk, unless B draws the dead node each time
+        call_start = monotonic()
+        try:
+            random_nodes.append(
+                await protocol_a.call_random_walk(
+                    protocol_b._origin_node, 0, 1, LinkType.IN, timeout=0.5
+                )
+            )
+        except RPCRejected:
+            pass
+        assert monotonic() - call_start < 0.5
+    assert random_nodes and set(random_nodes) == {protocol_c._origin_node}
+    # the hop only ran out of A's budget: a slow node is not a dead one
+    assert protocol_b._link_store.contains_in_link(dead_node)
+
+    # a hop that does not even acknowledge a forwarded walk is dead
+    node_a = protocol_a._origin_node
+    with pytest.raises(RPCError):
+        await protocol_b._call_next_hop(
+            "random_walk", dead_node, lambda: None, None, 1, node_a, 1, 1, LinkType.IN
+        )
+    assert not protocol_b._link_store.contains_in_link(dead_node)
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_forward_walk():
+    protocols, transports = await setup_n_protocols(3)
+    protocol_a, protocol_b, protocol_c = protocols
+    walk_length = 0
+    random_node = await protocol_a.call_forward_walk(
+        protocol_b._origin_node, walk_length, LinkType.IN
+    )
+    assert random_node == protocol_b._origin_node
+
+    walk_length = 1
+    protocol_b._link_store.add_in_link(protocol_c._origin_node)
+    random_node = await protocol_a.call_forward_walk(
+        protocol_b._origin_node, walk_length, LinkType.IN
+    )
+    assert random_node == protocol_c._origin_node
+    assert not protocol_a._pending_walks
+
+    # malformed samples, e.g. from a misbehaving peer, do not keep a slot taken
+    node_a = protocol_a._origin_node
+    await protocol_b.rpc_forward_walk(node_a, 1, node_a, 0, 0, LinkType.IN, 1, 1, [1])
+    await asyncio.sleep(0.01)
+    assert protocol_b._admission.walks_in_flight == 0
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_sample_walk():
+    protocols, transports = await setup_n_protocols(4)
+    protocol_a, protocol_b, protocol_c, protocol_d = protocols
+    introduce(protocols)
+    protocol_b._link_store.add_in_link(protocol_c._origin_node)
+    protocol_c._link_store.add_in_link(protocol_d._origin_node)
+
+    burn_in, thinning, num_samples = 0, 1, 3
+    samples = await protocol_a.call_sample_walk(
+        protocol_b._origin_node, burn_in, thinning, num_samples, LinkType.IN
+    )
+    assert samples == [
+        protocol_b._origin_node,
+        protocol_c._origin_node,
+        protocol_d._origin_node,
+    ]
+
+    burn_in, thinning, num_samples = 1, 2, 2  # D is a dead end
+    samples = await protocol_a.call_forward_sample_walk(
+        protocol_b._origin_node, burn_in, thinning, num_samples, LinkType.IN
+    )
+    assert samples == [protocol_c._origin_node, protocol_d._origin_node]
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_walks_through_older_nodes():
+    protocols, transports = await setup_n_protocols(3)
+    protocol_a, protocol_b, protocol_c = protocols
+    introduce([protocol_a, protocol_c])
+    protocol_b._binary_wire = False  # B runs the baseline: msgpack only,
+    protocol_b.rpc_sample_walk = None  # no sample_walk
+
+    async def baseline_random_walk(sender, walk_initiator, index, limit, link_type):
+        return await type(protocol_b).rpc_random_walk(
+            protocol_b, sender, walk_initiator, index, limit, link_type
+        )
+
+    protocol_b.rpc_random_walk = baseline_random_walk
+    protocol_b._link_store.add_in_link(protocol_c._origin_node)
+    protocol_c._link_store.add_in_link(protocol_b._origin_node)
+
+    random_node = await protocol_a.call_random_walk(
+        protocol_b._origin_node, 0, 1, LinkType.IN, timeout=0.5
+    )
+    assert random_node == protocol_c._origin_node
+    random_node = await protocol_a.call_random_walk(
+        protocol_c._origin_node, 0, 1, LinkType.IN, timeout=0.5
+    )  # C forwards it to B
+    assert random_node == protocol_b._origin_node
+    samples = await protocol_a.call_sample_walk(
+        protocol_b._origin_node, 1, 1, 3, LinkType.IN, timeout=0.5
+    )
+    assert samples == [protocol_c._origin_node]  # one sample per walk
+
+    # clean up
+    close_transports(transports)
+
+
 @pytest.mark.asyncio
 async def test_im_your_in_node():
     protocols, transports = await setup_n_protocols(3)
@@ -52,6 +240,53 @@ async def test_change_your_out_node():
     assert protocol_c._link_store.contains_out_link(protocol_a._origin_node)
     assert protocol_a._link_store.contains_in_link(protocol_c._origin_node)
 
+    assert not await protocol_b.call_change_your_out_node(
+        protocol_c._origin_node, protocol_a._origin_node
+    )  # already an out-link
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_change_your_out_node_at_degree():
+    protocols, transports = await setup_n_protocols(3)
+    protocol_a, protocol_b, protocol_c = protocols
+    for port in (1, 2, 3):  # num_links out-links, none of them a
+        protocol_c._link_store.add_out_link(Node("127.0.0.2", port))
+
+    assert not await protocol_a.call_change_your_out_node(
+        protocol_c._origin_node, protocol_b._origin_node
+    )  # a stale in-link of a: no room for b
+    assert not protocol_c._link_store.contains_out_link(protocol_b._origin_node)
+    assert protocol_c._link_store.num_out_links() == 3
+
+    protocol_c._link_store.remove_out_link(Node("127.0.0.2", 1))
+    protocol_c._link_store.add_out_link(protocol_a._origin_node)
+    assert await protocol_a.call_change_your_out_node(
+        protocol_c._origin_node, protocol_b._origin_node
+    )
+    assert not protocol_c._link_store.contains_out_link(protocol_a._origin_node)
+    assert protocol_c._link_store.contains_out_link(protocol_b._origin_node)
+    assert protocol_c._link_store.num_out_links() == 3
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_goodbye():
+    protocols, transports = await setup_n_protocols(2)
+    protocol_a, protocol_b = protocols
+    protocol_b._link_store.add_in_link(protocol_a._origin_node)
+    protocol_b._link_store.add_out_link(protocol_a._origin_node)
+
+    await protocol_a.call_goodbye(protocol_b._origin_node)
+
+    assert not protocol_b._link_store.contains_in_link(protocol_a._origin_node)
+    assert not protocol_b._link_store.contains_out_link(protocol_a._origin_node)
+    assert protocol_a._origin_node not in protocol_b._recent_peers
+
     # clean up
     close_transports(transports)
 
@@ -62,12 +297,13 @@ async def test_give_me_in_node():
     protocol_a, protocol_b, protocol_c = protocols
     protocol_c._link_store.add_in_link(protocol_b._origin_node)
 
-    await protocol_a.call_give_me_in_node(protocol_b._origin_node)
+    assert not await protocol_a.call_give_me_in_node(protocol_b._origin_node)
     assert (
         len(protocol_a._link_store.get_in_links_copy()) == 0
     )  # B has no in-link to give
 
-    await protocol_a.call_give_me_in_node(protocol_c._origin_node)
+    assert await protocol_a.call_give_me_in_node(protocol_c._origin_node)
+    assert await asyncio.gather(*protocol_c._handoffs.values()) == [True]
 
     assert not protocol_c._link_store.contains_out_link(protocol_b._origin_node)
     assert protocol_b._link_store.contains_out_link(protocol_a._origin_node)
@@ -75,3 +311,151 @@ async def test_give_me_in_node():
 
     # clean up
     close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_hand_off_in_link_refused():
+    protocols, transports = await setup_n_protocols(4)
+    protocol_a, protocol_b, protocol_c, protocol_d = protocols
+    node_a, node_b, node_c = (p._origin_node for p in protocols[:3])
+    protocol_d._link_store.add_in_link(node_b)
+    protocol_d._link_store.add_in_link(node_c)
+    for port in range(1, 5):  # B is at its degree, D only a stale in-link of it
+        protocol_b._link_store.add_out_link(Node("127.0.0.2", port))
+    protocol_c._link_store.add_out_link(protocol_d._origin_node)
+
+    assert await protocol_d._hand_off_in_link(node_a, [node_b, node_c])
+    assert not protocol_b._link_store.contains_out_link(node_a)
+    assert protocol_c._link_store.contains_out_link(node_a)  # the next one took it
+    assert protocol_a._link_store.contains_in_link(node_c)
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_give_me_in_node_dead_in_links():
+    protocols, transports = await setup_n_protocols(2)
+    protocol_a, protocol_b = protocols
+    protocol_b._wait_timeout = 0.1
+    for port in range(1, 6):
+        protocol_b._link_store.add_in_link(Node("127.0.0.1", port))
+
+    call_start = monotonic()
+    assert await protocol_a.call_give_me_in_node(protocol_b._origin_node)
+    assert monotonic() - call_start < protocol_b._wait_timeout  # not held back
+    (handoff,) = protocol_b._handoffs.values()
+    assert not await handoff  # gives up after IN_LINK_HANDOFF_CANDIDATES
+    assert monotonic() - call_start < protocol_b._wait_timeout * 5
+    assert not protocol_b._handoffs
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_wire_format_negotiation():
+    protocols, transports = await setup_n_protocols(3)
+    protocol_a, protocol_b, protocol_c = protocols
+    protocol_c._binary_wire = False  # like a node that only speaks msgpack
+    protocol_b._link_store.add_in_link(protocol_c._origin_node)
+    sent = []
+    sendto = transports[0].sendto
+    transports[0].sendto = lambda data, addr: sent.append(data) or sendto(data, addr)
+
+    await protocol_a.call_im_your_in_node(protocol_b._origin_node)
+    assert not wire.is_binary(sent[-1])  # first contact: msgpack, marked id
+    assert protocol_b._peer_versions.supports_binary(protocol_a._origin_node)
+
+    random_node = await protocol_b.call_random_walk(
+        protocol_a._origin_node, 0, 0, LinkType.IN
+    )  # B knows A understands the binary format: A learns it from the request
+    assert random_node == protocol_a._origin_node
+    assert protocol_a._peer_versions.supports_binary(protocol_b._origin_node)
+
+    protocol_b._link_store.remove_in_link(protocol_a._origin_node)
+    random_node = await protocol_a.call_random_walk(
+        protocol_b._origin_node, 0, 1, LinkType.IN
+    )  # binary to B, msgpack from B to C
+    assert wire.is_binary(sent[-1])
+    assert random_node == protocol_c._origin_node
+    assert not protocol_b._peer_versions.supports_binary(protocol_c._origin_node)
+
+    await protocol_c.call_im_your_in_node(protocol_a._origin_node)
+    assert not protocol_c._peer_versions.supports_binary(protocol_a._origin_node)
+    assert protocol_a._link_store.contains_in_link(protocol_c._origin_node)
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_piggybacked_hbeat():
+    protocols, transports = await setup_n_protocols(2)
+    protocol_a, protocol_b = protocols
+    node_a, node_b = protocol_a._origin_node, protocol_b._origin_node
+    assert not protocol_a.notify_im_your_in_node(node_b)  # B's format unknown
+    await protocol_a.call_im_your_in_node(node_b)  # B learns A's format
+    await protocol_b.call_im_your_in_node(node_a)
+    protocol_a._link_store.add_out_link(node_b)
+    protocol_b._link_store.remove_in_link(node_a)
+
+    await protocol_a.call_random_walk(node_b, 0, 0, LinkType.IN)
+    assert protocol_b._link_store.contains_in_link(node_a)  # flagged request
+    announced = protocol_a._link_store.get_out_link_announce(node_b)
+    assert announced > float("-inf")
+
+    protocol_b._link_store.remove_in_link(node_a)
+    assert protocol_a.notify_im_your_in_node(node_b)  # one-way
+    await asyncio.sleep(0.1)
+    assert protocol_b._link_store.contains_in_link(node_a)
+    assert protocol_a._link_store.get_out_link_announce(node_b) > announced
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_garbage_does_not_refresh_out_link():
+    protocols, transports = await setup_n_protocols(2)
+    protocol_a, protocol_b = protocols
+    node_b = protocol_b._origin_node
+    protocol_a._link_store.add_out_link(node_b)
+    hbeat = protocol_a._link_store.get_out_link_hbeat(node_b)
+
+    undecodable = b"\x00" + b"\x01" * 20 + b"\xc1"  # 0xc1 is never used
+    for garbage in (b"\x00" * 8, undecodable, bytes([wire.MAGIC]) + b"\xff" * 8):
+        protocol_a.datagram_received(garbage, node_b)
+    await asyncio.sleep(0.01)
+    assert protocol_a._link_store.get_out_link_hbeat(node_b) == hbeat
+
+    await protocol_b.call_im_your_in_node(protocol_a._origin_node)
+    assert protocol_a._link_store.get_out_link_hbeat(node_b) > hbeat
+
+    # clean up
+    close_transports(transports)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_call_is_forgotten():
+    protocols, transports = await setup_n_protocols(2)
+    protocol_a, protocol_b = protocols
+    node_b = protocol_b._origin_node
+    errors = []
+    asyncio.get_event_loop().set_exception_handler(
+        lambda _, context: errors.append(context)
+    )
+
+    for speaks_binary in (False, True):  # msgpack first, then binary
+        if speaks_binary:
+            introduce(protocols)
+        call = asyncio.ensure_future(protocol_a._call("im_your_in_node", node_b))
+        await asyncio.sleep(0)  # sent
+        call.cancel()
+        await asyncio.sleep(0.05)  # the answer comes anyway
+        assert not protocol_a._outstanding
+    assert not errors
+    asyncio.get_event_loop().set_exception_handler(None)
+
+    # clean up
+    close_transports(transports)
@@ -0,0 +1,289 @@
+import asyncio
+import random
+
+import pytest
+
+from swaplink import defaults
+from swaplink.analysis import collect_samples, analyze
+from swaplink.data_objects import LinkType
+from swaplink.errors import SelectError, AllExcludedError
+from swaplink.metrics import WalkRecorder
+from swaplink.simulation import SimulatedNetwork, run_simulation, create_swaplinks
+
+
+def test_simulated_network():
+    async def simulation():
+        network = SimulatedNetwork(latency=0.01, jitter=0.01, seed=1)
+        loads = [random.randrange(2, 8) for _ in range(50)]
+        swaplinks = await create_swaplinks(network, loads)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 3)
+
+        degrees = [len(swaplink.list_neighbours()) for swaplink in swaplinks]
+        assert sum(degrees) >= 0.8 * sum(loads)
+        random_nodes = await swaplinks[-1].select_many(10, unique=True)
+        assert len(random_nodes) >= 5
+
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return asyncio.get_event_loop().time()
+
+    virtual_time = run_simulation(simulation())
+    assert virtual_time >= defaults.HBEAT_CHECK_FREQUENCY * 3
+
+
+def test_simulated_churn():
+    async def simulation():
+        network = SimulatedNetwork(latency=0.01, loss_rate=0.01, seed=2)
+        swaplinks = await create_swaplinks(network, [3] * 30)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+
+        dead_nodes = {swaplink._node for swaplink in swaplinks[:10]}
+        for node in dead_nodes:
+            network.kill(node)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 3)
+
+        for swaplink in swaplinks[10:]:
+            assert not dead_nodes & set(swaplink.list_neighbours())
+            assert not dead_nodes & set(swaplink._link_store.get_in_links_copy())
+
+        for swaplink in swaplinks:
+            await swaplink.leave()
+
+    run_simulation(simulation())
+
+
+def test_simulated_selection_distribution():
+    async def simulation():
+        random.seed(3)  # topology and walks, for a deterministic result
+        network = SimulatedNetwork(latency=0.01, seed=3)
+        swaplinks = await create_swaplinks(network, [2, 4, 8] * 10)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 2)
+
+        samples = await collect_samples(swaplinks, 3000)
+        report = analyze(swaplinks, samples)
+
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return report
+
+    report = run_simulation(simulation())
+    assert report["kl_divergence"] < 0.1  # bits away from num_links-proportional
+    assert report["min_walk_length"] is not None
+    assert report["min_walk_length"] <= defaults.DEFAULT_WALK_LENGTH
+
+
+def test_simulated_adaptive_walk_length():
+    async def simulation():
+        random.seed(4)
+        network = SimulatedNetwork(latency=0.01, seed=4)
+        swaplinks = await create_swaplinks(
+            network, [4, 8] * 10, adaptive_walk_length=True
+        )
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 2)
+
+        initiator = swaplinks[-1]
+        await initiator.select_many(200)
+        walk_length = initiator._walk_length()
+        samples = await collect_samples(swaplinks, 2000)
+        report = analyze(swaplinks, samples)
+
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return walk_length, report
+
+    walk_length, report = run_simulation(simulation())
+    assert walk_length < defaults.DEFAULT_WALK_LENGTH
+    assert report["kl_divergence"] < 0.1
+
+
+def test_simulated_one_way_hbeats():
+    async def idle_traffic(one_way_hbeats: bool, seed: int):
+        random.seed(seed)
+        network = SimulatedNetwork(latency=0.01, seed=seed)
+        swaplinks = await create_swaplinks(
+            network, [4] * 20, one_way_hbeats=one_way_hbeats
+        )
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 2)
+        sent = network.sent
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 2)
+        idle_sent = network.sent - sent
+        degrees = [len(swaplink.list_neighbours()) for swaplink in swaplinks]
+        in_degrees = [swaplink._link_store.num_in_links() for swaplink in swaplinks]
+        one_way = sum(
+            hbeat_round.one_way
+            for swaplink in swaplinks
+            for hbeat_round in swaplink.stats.hbeat_rounds
+        )
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return idle_sent, degrees, in_degrees, one_way
+
+    # the savings depend on the share of mutual links, so several topologies
+    acked_sent = one_way_sent = 0
+    for seed in (5, 6, 7, 8):
+        acked_sent += run_simulation(idle_traffic(False, seed))[0]
+        sent, degrees, in_degrees, one_way = run_simulation(idle_traffic(True, seed))
+        one_way_sent += sent
+        assert one_way > 0
+        assert sum(degrees) >= 0.9 * 4 * 20  # links are not lost
+        assert sum(in_degrees) >= 0.9 * 4 * 20
+    assert one_way_sent < acked_sent * 0.85
+
+
+def test_simulated_select_under_churn():
+    async def simulation():
+        random.seed(6)
+        network = SimulatedNetwork(latency=0.01, seed=6)
+        swaplinks = await create_swaplinks(network, [4] * 30)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+
+        for swaplink in swaplinks[:6]:  # crashed, still linked by the others
+            network.kill(swaplink._node)
+        loop = asyncio.get_event_loop()
+        durations, failures = [], 0
+        for swaplink in swaplinks[6:] * 2:
+            select_start = loop.time()
+            try:
+                await swaplink.select()
+            except SelectError:
+                failures += 1
+            durations.append(loop.time() - select_start)
+
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return durations, failures
+
+    durations, failures = run_simulation(simulation())
+    assert failures <= 0.1 * len(durations)
+    assert sorted(durations)[len(durations) // 2] < 0.5
+    assert max(durations) <= defaults.WALK_TIMEOUT
+
+
+def test_simulated_graceful_leave():
+    async def simulation():
+        random.seed(7)
+        network = SimulatedNetwork(latency=0.01, seed=7)
+        swaplinks = await create_swaplinks(network, [4] * 20)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 2)
+
+        leaving, others = swaplinks[0], swaplinks[1:]
+        in_peers = [s for s in others if leaving._node in s.list_neighbours()]
+        degrees = [len(swaplink.list_neighbours()) for swaplink in in_peers]
+        out_peers = [s for s in others if s._node in leaving.list_neighbours()]
+        loop = asyncio.get_event_loop()
+        leave_start = loop.time()
+        await leaving.leave()
+        leave_duration = loop.time() - leave_start
+
+        for swaplink in others:
+            assert leaving._node not in swaplink.list_neighbours()
+        for swaplink in out_peers:  # the others expire their stale in-link
+            assert not swaplink._link_store.contains_in_link(leaving._node)
+        degrees_after = [len(swaplink.list_neighbours()) for swaplink in in_peers]
+        spliced = leaving.metrics.counter("leave_splices", result="given")
+        for swaplink in others:
+            await swaplink.leave()
+        return len(in_peers), spliced, degrees, degrees_after, leave_duration
+
+    in_peers, spliced, degrees, degrees_after, leave_duration = run_simulation(
+        simulation()
+    )
+    assert in_peers > 0 and spliced >= in_peers  # stale in-links too
+    assert degrees_after == degrees  # kept without walking for new links
+    assert leave_duration < defaults.LEAVE_DEADLINE
+
+
+def test_simulated_sample_pool():
+    async def selects(sample_pool_size: int):
+        random.seed(8)
+        network = SimulatedNetwork(latency=0.01, seed=8)
+        swaplinks = await create_swaplinks(
+            network, [4] * 20, sample_pool_size=sample_pool_size
+        )
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+
+        selecting = swaplinks[-1]
+        loop = asyncio.get_event_loop()
+        select_start = loop.time()
+        random_nodes = [await selecting.select() for _ in range(20)]
+        duration = loop.time() - select_start
+        stats = selecting.stats
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return random_nodes, duration, stats
+
+    walked, walk_duration, _ = run_simulation(selects(0))
+    pooled, pool_duration, stats = run_simulation(selects(20))
+    assert stats.sample_pool_hits == 20 and stats.sample_pool_misses == 0
+    assert pool_duration < walk_duration * 0.1
+    assert len(set(pooled)) >= 0.5 * len(set(walked))
+
+
+def test_simulated_sample_pool_staleness():
+    async def simulation():
+        random.seed(9)
+        network = SimulatedNetwork(latency=0.01, seed=9)
+        swaplinks = await create_swaplinks(
+            network, [4] * 10, sample_pool_size=5, sample_pool_max_age=1
+        )
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+        selecting = swaplinks[-1]
+        fresh = [await selecting.select() for _ in range(10)]
+        for swaplink in swaplinks:
+            await swaplink.leave()
+        return fresh, selecting.stats
+
+    fresh, stats = run_simulation(simulation())
+    assert stats.sample_pool_stale > 0  # idle pool, refilled as samples age
+    assert stats.sample_pool_hits > 0
+    assert stats.sample_pool_hits + stats.sample_pool_misses == len(fresh)
+
+
+def test_simulated_select_parameters():
+    async def simulation():
+        random.seed(10)
+        network = SimulatedNetwork(latency=0.01, seed=10)
+        recorder = WalkRecorder()  # every node's hops, by walk id
+        swaplinks = await create_swaplinks(network, [4] * 20, walk_tracer=recorder)
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+        selecting = swaplinks[-1]
+
+        async def hops(precision: float) -> int:
+            recorder.walks.clear()
+            for _ in range(10):
+                await selecting.select(precision=precision)
+            return sum(
+                event.index
+                for events in recorder.walks.values()
+                for event in events
+                if event.kind == "hop" and event.detail is None
+            )
+
+        in_links = set(selecting._link_store.get_in_links_copy())
+        for _ in range(10):  # no hop: the walk's start
+            assert await selecting.select(walk_length=0) in in_links
+        out_links = set(selecting.list_neighbours())
+        for _ in range(10):
+            node = await selecting.select(walk_length=0, link_type=LinkType.OUT)
+            assert node in out_links
+
+        excluded = {swaplink._node for swaplink in swaplinks[:5]}
+        for _ in range(10):
+            assert await selecting.select(exclude=excluded) not in excluded
+        everyone = {swaplink._node for swaplink in swaplinks}
+        selecting._select_deadline = 60  # it gives up long before
+        select_start = asyncio.get_event_loop().time()
+        with pytest.raises(AllExcludedError):
+            await selecting.select(exclude=everyone)
+        assert asyncio.get_event_loop().time() - select_start < 5
+        selecting._select_deadline = None
+
+        await selecting.select_many(300)  # network size estimate for precision
+        assert await hops(precision=0.5) < await hops(precision=0.01)
+        with pytest.raises(ValueError):
+            await selecting.select(precision=0)
+
+        for swaplink in swaplinks:
+            await swaplink.leave()
+
+    run_simulation(simulation())
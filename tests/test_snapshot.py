@@ -0,0 +1,90 @@
+import asyncio
+import os
+import random
+
+from swaplink import defaults, Swaplink
+from swaplink.data_objects import PeerSnapshot
+from swaplink.simulation import (
+    SimulatedNetwork,
+    run_simulation,
+    create_swaplinks,
+    simulated_node,
+)
+from swaplink.snapshot import save_snapshot, load_snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "peers")
+    assert load_snapshot(path) is None
+    snapshot = PeerSnapshot(
+        [simulated_node(1), simulated_node(2)], [simulated_node(3)], []
+    )
+    save_snapshot(path, snapshot)
+    save_snapshot(path, snapshot)  # replaces the old one
+    assert load_snapshot(path) == snapshot
+    assert os.listdir(tmp_path) == ["peers"]  # no temporary file left
+
+    with open(path, "wb") as snapshot_file:
+        snapshot_file.write(b"\x93\x01")  # truncated
+    assert load_snapshot(path) is None
+
+
+def test_warm_restart(tmp_path):
+    path = str(tmp_path / "peers")
+
+    async def simulation():
+        random.seed(8)
+        network = SimulatedNetwork(latency=0.01, seed=8)
+        swaplinks = await create_swaplinks(network, [4] * 20)
+        node = simulated_node(20)
+        swaplink = Swaplink(*node, transport_factory=network, snapshot_path=path)
+        await swaplink.join(4, [swaplinks[0]._node])
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+        neighbours = set(swaplink.list_neighbours())
+        await swaplink.leave()  # saves the snapshot
+
+        restarted = Swaplink(*node, transport_factory=network, snapshot_path=path)
+        await restarted.join(4, [swaplinks[0]._node])
+        restored = set(restarted.list_neighbours())
+        stats, metrics = restarted.stats, restarted.metrics
+
+        for swaplink in swaplinks + [restarted]:
+            await swaplink.leave()
+        return neighbours, restored, stats, metrics
+
+    neighbours, restored, stats, metrics = run_simulation(simulation())
+    assert len(neighbours) == 4
+    assert restored == neighbours
+    assert stats.restored_links == 4
+    assert metrics.counter("rpc_calls", rpc="sample_walk") == 0  # no bootstrap
+
+
+def test_warm_restart_with_dead_peers(tmp_path):
+    path = str(tmp_path / "peers")
+
+    async def simulation():
+        random.seed(9)
+        network = SimulatedNetwork(latency=0.01, seed=9)
+        swaplinks = await create_swaplinks(network, [4] * 20)
+        node = simulated_node(20)
+        swaplink = Swaplink(*node, transport_factory=network, snapshot_path=path)
+        await swaplink.join(4, [swaplinks[0]._node])
+        await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY)
+        dead_nodes = set(swaplink.list_neighbours()[:2])
+        await swaplink.leave()
+        for dead_node in dead_nodes:
+            network.kill(dead_node)
+
+        restarted = Swaplink(*node, transport_factory=network, snapshot_path=path)
+        await restarted.join(4, [swaplinks[0]._node])
+        neighbours = set(restarted.list_neighbours())
+        restored_links = restarted.stats.restored_links
+
+        for swaplink in swaplinks + [restarted]:
+            await swaplink.leave()
+        return dead_nodes, neighbours, restored_links
+
+    dead_nodes, neighbours, restored_links = run_simulation(simulation())
+    assert restored_links == 2
+    assert len(neighbours) == 4  # the failed slots were walked for
+    assert not dead_nodes & neighbours
@@ -6,12 +6,18 @@ from typing import List, Any
 import pytest
 
 from swaplink import defaults
+from swaplink.data_objects import WalkMode, Node
+from swaplink.errors import NoPeersError
+from swaplink import Swaplink
+from swaplink.simulation import run_simulation
 from tests.utils import setup_network_by_relative_loads
 
 # for speeding up tests
 defaults.HBEAT_SEND_FREQUENCY *= 0.3
 defaults.HBEAT_CHECK_FREQUENCY *= 0.3
 defaults.RPC_TIMEOUT *= 0.3
+defaults.WALK_TIMEOUT *= 0.3
+defaults.HBEAT_ROUND_DEADLINE *= 0.3
 
 
 @pytest.mark.asyncio
@@ -28,12 +34,63 @@ async def test_swaplink_neighbour_retrieval():
         my_num_links * 0.8
     )  # todo: how much links should it have after two cycles?
 
+    hbeat_round = my_network.stats.hbeat_rounds[-1]
+    hbeated = hbeat_round.sent + hbeat_round.skipped + hbeat_round.one_way
+    assert hbeated >= len(neighbours) - hbeat_round.failed
+    assert hbeat_round.duration < defaults.HBEAT_ROUND_DEADLINE * 1.5
+
     # clean up
     await my_network.leave()
     for network in other_networks:
         await network.leave()
 
 
+@pytest.mark.asyncio
+async def test_swaplink_link_repair():
+    my_num_links = 5
+    others_amount = 10
+    others_relative_load = [random.randrange(2, 20) for _ in range(others_amount)]
+    my_network, other_networks = await setup_network_by_relative_loads(
+        my_num_links, others_relative_load
+    )
+    for neighbour in my_network.list_neighbours():
+        my_network._link_store.remove_out_link(neighbour)
+
+    await my_network._add_out_links()
+    neighbours = my_network.list_neighbours()
+    assert len(neighbours) >= int(my_num_links * 0.8)
+    assert my_network._node not in neighbours
+
+    # clean up
+    await my_network.leave()
+    for network in other_networks:
+        await network.leave()
+
+
+@pytest.mark.asyncio
+async def test_swaplink_join_min_degree():
+    others_amount = 10
+    others_relative_load = [random.randrange(5, 20) for _ in range(others_amount)]
+    my_network, other_networks = await setup_network_by_relative_loads(
+        3, others_relative_load
+    )
+    my_num_links, min_degree = 6, 2
+    late_network = Swaplink("127.0.0.1", my_network._node.port + 1)
+    await late_network.join(my_num_links, [my_network._node], min_degree=min_degree)
+
+    assert len(late_network.list_neighbours()) >= min_degree
+    assert late_network.stats.min_degree_duration <= late_network.stats.join_duration
+    await asyncio.sleep(defaults.HBEAT_SEND_FREQUENCY)
+    neighbours = late_network.list_neighbours()
+    assert int(my_num_links * 0.8) <= len(neighbours) <= my_num_links
+
+    # clean up
+    await late_network.leave()
+    await my_network.leave()
+    for network in other_networks:
+        await network.leave()
+
+
 @pytest.mark.asyncio
 async def test_swaplink_callback():
     callback_flag = Event()
@@ -50,7 +107,8 @@ async def test_swaplink_callback():
     my_network, other_networks = await setup_network_by_relative_loads(
         my_num_links, others_relative_load
     )
-    my_network.list_neighbours(callback)
+    lost_neighbor = my_network.list_neighbours(callback)[0]
+    my_network._link_store.remove_out_link(lost_neighbor)  # it is repaired later
     await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 1.5)
     cuurent_neighbors = my_network.list_neighbours(callback)
 
@@ -88,6 +146,55 @@ async def test_swaplink_random_selection():
         await network.leave()
 
 
+@pytest.mark.asyncio
+async def test_swaplink_forwarding_selection():
+    my_relative_load = 5
+    others_amount = 10
+    others_relative_load = [random.randrange(2, 20) for _ in range(others_amount)]
+    my_network, other_networks = await setup_network_by_relative_loads(
+        my_relative_load, others_relative_load
+    )
+    my_network._walk_mode = WalkMode.FORWARDING
+    await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 1.5)
+
+    random_nodes = []
+    for _ in range(others_amount):
+        random_nodes.append(await my_network.select())
+
+    assert len(set(random_nodes)) >= 0.5 * others_amount
+    assert my_network._node not in random_nodes
+
+    # clean up
+    await my_network.leave()
+    for network in other_networks:
+        await network.leave()
+
+
+@pytest.mark.asyncio
+async def test_swaplink_select_many():
+    my_relative_load = 5
+    others_amount = 10
+    others_relative_load = [random.randrange(2, 20) for _ in range(others_amount)]
+    my_network, other_networks = await setup_network_by_relative_loads(
+        my_relative_load, others_relative_load
+    )
+    await asyncio.sleep(defaults.HBEAT_CHECK_FREQUENCY * 1.5)
+
+    random_nodes = await my_network.select_many(others_amount, max_in_flight=4)
+    assert len(random_nodes) >= 0.8 * others_amount
+
+    unique_nodes = await my_network.select_many(others_amount, unique=True)
+    assert len(unique_nodes) == len(set(unique_nodes))
+
+    sampled_nodes = await my_network.select_many(others_amount, samples_per_walk=3)
+    assert 0 < len(sampled_nodes) <= others_amount
+
+    # clean up
+    await my_network.leave()
+    for network in other_networks:
+        await network.leave()
+
+
 @pytest.mark.asyncio
 async def test_swaplink_leave():
     my_num_links = 3
@@ -101,3 +208,70 @@ async def test_swaplink_leave():
     await my_network.leave()
     for network in other_networks:
         await network.leave()
+
+
+@pytest.mark.asyncio
+async def test_swaplink_select_without_peers():
+    network = Swaplink("127.0.0.1", 7777)  # never joined
+    with pytest.raises(NoPeersError):
+        await network.select()
+    assert network.metrics.counter("select_failures", reason="no_peers") == 1
+
+
+@pytest.mark.asyncio
+async def test_swaplink_unwatch_neighbours():
+    network = Swaplink("127.0.0.1", 7777)  # never joined
+    node = Node("127.0.0.1", 7778)
+    watch = network.watch_neighbours()
+    changes = []
+    callback_watch = network.watch_neighbours(changes.append)
+    assert callback_watch.changes is None
+
+    network._link_store.add_out_link(node)
+    assert watch.changes.get_nowait().added == {node}
+    assert len(changes) == 1
+
+    network.unwatch_neighbours(watch)
+    network.unwatch_neighbours(callback_watch)
+    network._link_store.remove_out_link(node)
+    assert watch.changes.empty()
+    assert len(changes) == 1
+
+
+def test_sample_pool_refill():
+    async def simulation():
+        network = Swaplink(
+            "127.0.0.1",
+            7777,
+            sample_pool_size=3,
+            sample_pool_max_age=10,
+            sample_pool_refill_rate=10,
+        )  # never joined: the walks are counted, not sent
+        walks = []
+
+        async def pool_walk():
+            walks.append(asyncio.get_event_loop().time())
+            network._sample_pool.add(Node("127.0.0.1", len(walks)))
+
+        network._pool_walk = pool_walk
+        network._sample_pool_room = asyncio.Event()
+        refill = asyncio.ensure_future(network._refill_sample_pool())
+
+        await asyncio.sleep(1)
+        assert len(walks) == 3  # full: no more walks
+        assert walks[1] - walks[0] == pytest.approx(0.1)  # refill_rate walks/s
+        assert network._pooled_sample() == Node("127.0.0.1", 1)
+        await asyncio.sleep(1)
+        assert len(walks) == 4  # the pool had room again
+        await asyncio.sleep(10)
+        assert network.stats.sample_pool_stale == 3
+        assert len(walks) == 7  # the stale samples were replaced
+        refill.cancel()
+
+    run_simulation(simulation())
+
+
+def test_sample_pool_refill_rate():
+    with pytest.raises(ValueError):
+        Swaplink("127.0.0.1", 7777, sample_pool_size=3, sample_pool_refill_rate=0)
+    Swaplink("127.0.0.1", 7777, sample_pool_refill_rate=0)  # no pool
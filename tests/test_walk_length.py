@@ -0,0 +1,47 @@
+from swaplink import defaults, Swaplink
+from swaplink.simulation import simulated_node
+from swaplink.walk_length import WalkLengthEstimator
+
+
+def test_network_size_estimate():
+    estimator = WalkLengthEstimator(window=1000, min_collisions=1)
+    assert estimator.network_size() is None
+    assert estimator.walk_length(10) == defaults.DEFAULT_WALK_LENGTH
+
+    nodes = [simulated_node(i) for i in range(100)]
+    estimator.observe(nodes * 3)  # 300 samples, 3 * 100 colliding pairs
+    assert estimator.network_size() == 300 * 299 / (2 * 300)
+
+
+def test_network_size_window():
+    estimator = WalkLengthEstimator(window=10, min_collisions=1)
+    estimator.observe([simulated_node(0)] * 10)
+    estimator.observe(simulated_node(i) for i in range(1, 11))
+    assert estimator.network_size() is None  # the collisions left the window
+
+
+def test_walk_length_grows_with_network_size():
+    lengths = []
+    for network_size in (10, 100, 10000):
+        estimator = WalkLengthEstimator(window=2 * network_size, min_collisions=1)
+        nodes = [simulated_node(i) for i in range(network_size)]
+        estimator.observe(nodes * 2)
+        lengths.append(estimator.walk_length(degree=8))
+    assert lengths == sorted(lengths)
+    assert lengths[0] < defaults.DEFAULT_WALK_LENGTH
+    assert defaults.MIN_WALK_LENGTH <= lengths[0]
+    assert lengths[-1] <= defaults.MAX_WALK_LENGTH
+    # a stricter tolerance needs more hops
+    assert estimator.walk_length(8, tolerance=0.01) > lengths[-1]
+
+
+def test_walk_length_ignores_own_in_degree():
+    swaplink = Swaplink("127.0.0.1", 7777, adaptive_walk_length=True)
+    swaplink._num_links = 4
+    swaplink._walk_length_estimator.observe(
+        [simulated_node(i) for i in range(1000)] * 2
+    )
+    walk_length = swaplink._walk_length()
+    for i in range(100):  # a heavily loaded node
+        swaplink._link_store.add_in_link(simulated_node(i))
+    assert swaplink._walk_length() == walk_length
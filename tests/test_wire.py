@@ -0,0 +1,72 @@
+import pytest
+
+from swaplink import wire
+from swaplink.data_objects import Node, LinkType
+
+
+def test_request_round_trip():
+    args = (
+        Node("10.0.0.1", 5678),
+        0,
+        300,
+        LinkType.IN,
+        2**63,
+        [Node("::1", 1), Node("example.org", 65535)],
+        [],
+        None,
+        True,
+    )
+    data = wire.encode_request("sample_walk", 42, args)
+    is_response, opcode, msg_id, values, in_node = wire.decode(bytes(data))
+    assert not is_response
+    assert wire.RPC_NAMES[opcode] == "sample_walk"
+    assert msg_id == 42
+    assert values == list(args)
+    assert not in_node
+
+
+def test_response_round_trip():
+    data = wire.encode_response(wire.Opcode.RANDOM_WALK, 7, ("127.0.0.1", 80))
+    assert wire.decode(data) == (
+        True,
+        wire.Opcode.RANDOM_WALK,
+        7,
+        [Node("127.0.0.1", 80)],
+        False,
+    )
+    heartbeat = wire.encode_request("im_your_in_node", 7, ())
+    assert len(heartbeat) == 7
+    assert len(wire.encode_response(wire.Opcode.IM_YOUR_IN_NODE, 7, None)) == 8
+
+
+def test_in_node_flag():
+    data = wire.encode_request("random_walk", 3, (Node("10.0.0.1", 1),), True)
+    message = wire.decode(data)
+    assert message.in_node and not message.is_response
+    assert message.opcode == wire.Opcode.RANDOM_WALK
+    message = wire.decode(wire.encode_response(wire.Opcode.HBEAT, 0, None, True))
+    assert message.in_node and message.is_response
+    assert message.opcode == wire.Opcode.HBEAT
+
+
+def test_malformed():
+    with pytest.raises(wire.MalformedMessage):
+        wire.encode_request("unknown", 1, ())
+    with pytest.raises(wire.MalformedMessage):
+        wire.encode_request("random_walk", 1, (1.5,))
+    data = wire.encode_request("random_walk", 1, (Node("10.0.0.1", 1),))
+    with pytest.raises(wire.MalformedMessage):
+        wire.decode(data[:-1])  # truncated
+    data[1] = wire.VERSION + 1
+    with pytest.raises(wire.MalformedMessage):
+        wire.decode(data)
+
+
+def test_batches():
+    frames = [("a", b"\x00" * 10), ("b", b"\x01" * 10), ("tenant-c", b"\x02" * 10)]
+    (batch,) = wire.encode_batches(frames, 1400)
+    assert wire.decode_batch(batch) == frames
+    batches = wire.encode_batches(frames, 20)  # a frame per batch
+    assert [wire.decode_batch(batch) for batch in batches] == [[f] for f in frames]
+    with pytest.raises(wire.MalformedMessage):
+        wire.decode_batch(batch[:-1])
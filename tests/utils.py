@@ -1,11 +1,11 @@
 import asyncio
 from asyncio.transports import DatagramTransport
-from collections import deque
 from typing import List, Tuple
 
 from swaplink import Swaplink
 from swaplink.core import LinkStore
 from swaplink.abc import Node
+from swaplink.data_objects import RecentPeers
 from swaplink.protocol import SwaplinkProtocol
 
 
@@ -29,7 +29,7 @@ async def setup_network_by_relative_loads(
 
 
 async def setup_n_protocols(
-    n: int
+    n: int,
 ) -> Tuple[List[SwaplinkProtocol], List[DatagramTransport]]:
     localhost = "127.0.0.1"
     protocols = []
@@ -39,7 +39,8 @@ async def setup_n_protocols(
         node = Node(localhost, 5678 + i)
         link_store = LinkStore()
         transport, protocol = await loop.create_datagram_endpoint(
-            lambda: SwaplinkProtocol(node, link_store, deque(), n), local_addr=node
+            lambda: SwaplinkProtocol(node, link_store, RecentPeers(128, 60), n),
+            local_addr=node,
         )
         protocols.append(protocol)
         transports.append(transport)
@@ -49,3 +50,13 @@ async def setup_n_protocols(
 def close_transports(transports: List[DatagramTransport]) -> None:
     for udp in transports:
         udp.close()
+
+
+def introduce(protocols: List[SwaplinkProtocol]) -> None:
+    """
+    Let the protocols know each other as peers of the current version, as if
+    they had talked before.
+    """
+    for protocol in protocols:
+        for other in protocols:
+            protocol._peer_versions.add(other._origin_node)